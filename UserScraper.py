@@ -1,9 +1,12 @@
-from bs4 import BeautifulSoup
-import requests
+import logging
 import re
 
 from static import *
 from CustomExceptions import *
+from goodreads_fetcher import get_fetcher
+from instrumentation import count
+
+logger = logging.getLogger(__name__)
 
 def regex_match(pattern, text):
     match = re.search(pattern, text)
@@ -90,35 +93,18 @@ class UserMetaData:
         return self.reviews
         
     def set_soup(self, headers_list = headers_list):
-        for header in headers_list:
-            response = requests.get(self.url, headers=header)
-            source = response.text
-
-            if len(source) > 10000:
-                soup = BeautifulSoup(source, "lxml")
-
-                if soup:
-                    self.soup = soup
-                    return True
-                
-                else:
-                    continue
-
-        raise RequestFailedException(f"Failed to fetch URL: {self.url}")
+        self.soup = self.get_soup(self.url, headers_list = headers_list)
+        return True
     
     def get_soup(self, url, headers_list = headers_list):
-        for header in headers_list:
-            response = requests.get(url, headers=header)
-            source = response.text
+        # shared pooled session (same path as the async review loader)
+        from bs4 import BeautifulSoup
 
-            if len(source) > 10000:
-                soup = BeautifulSoup(source, "lxml")
+        source = get_fetcher().fetch_text_sync(url, headers = headers_list)
+        soup = BeautifulSoup(source, "lxml")
 
-                if soup:
-                    return soup
-                
-                else:
-                    continue
+        if soup:
+            return soup
 
         raise RequestFailedException(f"Failed to fetch URL: {url}")
 
@@ -184,23 +170,37 @@ class UserMetaData:
             self.follow_rank = get_number_from_text(best_follower_text)
 
 
+    def set_soup_from_source(self, source):
+        """ Use an already fetched profile page (e.g. from the async fetcher) """
+        from bs4 import BeautifulSoup
+
+        self.soup = BeautifulSoup(source, "lxml")
+        return True
+
     def get_metadata(self):
         try:
             self.set_soup()  
         except Exception as e:
-            print(f"Error in set_soup: {e}")
+            count("scrape.parse_errors", method = "set_soup")
+            logger.warning("Error in set_soup: %s", e)
             return  
         
+        self.parse_metadata()
+
+    def parse_metadata(self):
+        """ Fill in metadata from self.soup (each step fails independently) """
         try:
             self.get_name_from_html() 
         except Exception as e:
-            print(f"Error in get_name_from_html: {e}")
+            count("scrape.parse_errors", method = "get_name_from_html")
+            logger.warning("Error in get_name_from_html: %s", e)
 
 
         try:
             self.get_user_stats_html()
         except Exception as e:
-            print(f"Error in get_user_stats_html: {e}")
+            count("scrape.parse_errors", method = "get_user_stats_html")
+            logger.warning("Error in get_user_stats_html: %s", e)
             return  
         
         methods = [
@@ -213,7 +213,8 @@ class UserMetaData:
             try:
                 method()  
             except Exception as e:
-                print(f"Error in {method.__name__} for {self.user_id}: {e}")
+                count("scrape.parse_errors", method = method.__name__)
+                logger.warning("Error in %s for %s: %s", method.__name__, self.user_id, e)
                 continue  
 
     
@@ -227,12 +228,15 @@ class UserMetaData:
         
         return None
     
-    def get_review_cards(self, user_id):
-        all_review_cards = []
-
+    def num_review_pages(self):
         # make sure we don't look at empty pages
         n = self.review_pages
         n = min(n, self.num_ratings // 20) + 1
+        return n
+
+    def get_review_cards(self, user_id):
+        all_review_cards = []
+        n = self.num_review_pages()
 
         for i in range(1, n + 1):
             review_cards = self.get_review_cards_single_page(user_id, i)
@@ -303,7 +307,8 @@ class UserMetaData:
                 result = method(review_card)
                 review_card_dict[dict_key] = result
             except Exception as e:
-                print(f"Error in {method.__name__} for review card: {e}")
+                count("scrape.parse_errors", method = method.__name__)
+                logger.warning("Error in %s for review card: %s", method.__name__, e)
                 continue  
         
         return review_card_dict
@@ -315,11 +320,14 @@ class UserMetaData:
             self.reviews = reviews
 
         except SoupNotFoundException as e:
-            print(f"SoupNotFound error in get_reviews(): {e}")
+            count("scrape.parse_errors", method = "get_reviews")
+            logger.warning("SoupNotFound error in get_reviews(): %s", e)
         except RegexPatternNotFoundException as e:
-            print(f"RegexNotFound error in get_reviews(): {e}")
+            count("scrape.parse_errors", method = "get_reviews")
+            logger.warning("RegexNotFound error in get_reviews(): %s", e)
         except Exception as e:
-            print(f"Unexpected error in get_reviews(): {e}")
+            count("scrape.parse_errors", method = "get_reviews")
+            logger.warning("Unexpected error in get_reviews(): %s", e)
 
     def get_review_info(self):
         
@@ -328,7 +336,8 @@ class UserMetaData:
         try:
             self.get_review_cards(user_id = self.user_id)
         except Exception as e:
-            print(f"Error in get_review_cards(): {e}")
+            count("scrape.parse_errors", method = "get_review_cards")
+            logger.warning("Error in get_review_cards(): %s", e)
         else:
             self.get_reviews()
 
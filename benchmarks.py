@@ -0,0 +1,282 @@
+""" Benchmarks for the recommendation and scraping hot paths
+
+    python benchmarks.py                         everything at 1x, 10x, 100x the current data
+    python benchmarks.py --scales 1 10           only some scales
+    python benchmarks.py -k ranker               only benchmarks whose name contains "ranker"
+    python benchmarks.py --save before.json      keep the results ...
+    python benchmarks.py --compare before.json   ... and fail on anything > --tolerance slower
+    python benchmarks.py --metrics stages.prom   also write the per-stage span histograms
+                                                 (Prometheus text, JSON unless the name ends in .prom)
+
+Data comes from synthetic_data.py: scale 1 is the size of the current
+data/ files (9.5k users, 16k books, up to 20 scraped reviews per user),
+so a scaling cliff shows up as a jump between 10x and 100x rather than in
+production. Scraping
+benchmarks run once on the saved review pages in fixtures/ (they do not
+depend on the data size).
+
+Every benchmark runs for at least --min-time seconds (at least 3 rounds);
+min and median per round are reported, like pytest-benchmark. The median
+is what --compare checks.
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from synthetic_data import generate, labeled_reviews, write_bundle
+
+
+# sizes of the current data/ files
+base_users = 9466
+base_books = 16083
+
+fixtures_glob = "fixtures/*.html"
+
+# scraped reviews per user: one page (what a fresh scrape of a user gets first)
+review_pages = 0
+
+
+""" Synthetic data """
+
+def scaled_data(scale, seed = 0):
+    """ synthetic_data.generate for base_users * scale users and base_books * scale books """
+    return generate(base_users * scale, base_books * scale, seed = seed, review_pages = review_pages)
+
+def query_profile(data, user = 0):
+    """ A real user's genre profile (so the query has neighbors) """
+    return data['compact_user_genre_pct'].iloc[:, [user]]
+
+
+""" Benchmarks: setup(data) -> function to time """
+
+def bench_similarity_ranker(data):
+    from main_genre_book_recommender import get_user_similarities_ranker_by_genre
+
+    q = query_profile(data)
+    return lambda: get_user_similarities_ranker_by_genre(q, data['user_genre_counts'], data['compact_user_genre_pct'],
+                                                         alpha = 250, min_similarity = 0.8, k = 100)
+
+def bench_similarity_ranker_index(data):
+    from main_genre_book_recommender import get_user_similarities_ranker_by_genre
+    from genre_similarity_index import GenreSimilarityIndex
+
+    index = GenreSimilarityIndex(data['compact_user_genre_pct'], data['user_genre_counts'])
+    q = query_profile(data)
+    return lambda: get_user_similarities_ranker_by_genre(q, None, None, alpha = 250, min_similarity = 0.8,
+                                                         similarity_index = index, k = 100)
+
+def ranker(data):
+    from genre_similarity_index import GenreSimilarityIndex
+    index = GenreSimilarityIndex(data['compact_user_genre_pct'], data['user_genre_counts'])
+    return index.query(query_profile(data), alpha = 250, min_similarity = 0.8, k = 100)
+
+def bench_recommendation_from_top(data):
+    from main_genre_book_recommender import get_recommendation_from_top
+
+    r = ranker(data)
+    return lambda: get_recommendation_from_top(r, 0.4, 8, data['user_item_matrix'], data['users_data'],
+                                               data['book_ratings'], data['metadata'])
+
+def bench_recommendation_from_top_catalog(data):
+    from main_genre_book_recommender import get_recommendation_from_top
+    from book_catalog import BookCatalog
+
+    r = ranker(data)
+    catalog = BookCatalog(data['books'])
+    return lambda: get_recommendation_from_top(r, 0.4, 8, data['user_item_matrix'], data['users_data'],
+                                               None, None, catalog = catalog)
+
+def bench_book_scores_from_experts(data):
+    from main_genre_book_recommender import get_expert_user_item_matrix, get_book_scores_from_experts
+
+    experts = get_expert_user_item_matrix(data['user_item_matrix'], ranker(data).index)
+    return lambda: get_book_scores_from_experts(experts, 8)
+
+def bench_user_genre_counts_one_user(data):
+    from main_genre_book_recommender import get_user_genre_counts
+
+    reviews = labeled_reviews(data, users = [0])
+    return lambda: get_user_genre_counts(reviews)
+
+def bench_user_genre_counts_all(data):
+    from main_genre_book_recommender import get_user_genre_counts
+
+    reviews = labeled_reviews(data)
+    return lambda: get_user_genre_counts(reviews)
+
+def bench_interface_loader(data):
+    """ current_version + load_bundle, what full_app.interface_loader does on a new version """
+    from data_loader import load_bundle, current_version
+
+    artifacts_dir = tempfile.mkdtemp(prefix = "bench-artifacts-")
+    write_bundle(data, artifacts_dir, version = "bench")
+    return lambda: load_bundle(artifacts_dir, current_version(artifacts_dir)), lambda: shutil.rmtree(artifacts_dir)
+
+def fixture_sources():
+    paths = sorted(glob.glob(fixtures_glob))
+    if not paths:
+        raise FileNotFoundError(f"No review page fixtures match {fixtures_glob}")
+
+    sources = []
+    for path in paths:
+        with open(path, encoding = "utf-8") as f:
+            sources.append(f.read())
+    return sources
+
+def bench_get_reviews(data):
+    """ UserMetaData.get_reviews on every fixture page (bs4 engine, incl. building the soup) """
+    from bs4 import BeautifulSoup
+    from UserScraper import UserMetaData
+
+    sources = fixture_sources()
+
+    def run():
+        for source in sources:
+            user = UserMetaData("https://www.goodreads.com/user/show/155041466-jamie-ren")
+            user.review_cards = BeautifulSoup(source, "lxml").find_all('tr', class_ = 'bookalike review')
+            user.get_reviews()
+    return run
+
+def bench_parse_review_cards_lxml(data):
+    from review_card_parser import parse_review_cards_lxml
+
+    sources = fixture_sources()
+    return lambda: [parse_review_cards_lxml(source, "155041466-jamie-ren") for source in sources]
+
+
+# name: (setup, depends on the data scale)
+benchmarks = {
+    'similarity ranker (sklearn)': (bench_similarity_ranker, True),
+    'similarity ranker (index)': (bench_similarity_ranker_index, True),
+    'recommendation from top': (bench_recommendation_from_top, True),
+    'recommendation from top (catalog)': (bench_recommendation_from_top_catalog, True),
+    'book scores from experts': (bench_book_scores_from_experts, True),
+    'user genre counts (one user)': (bench_user_genre_counts_one_user, True),
+    'user genre counts (all reviews)': (bench_user_genre_counts_all, True),
+    'interface_loader': (bench_interface_loader, True),
+    'UserMetaData.get_reviews (fixtures)': (bench_get_reviews, False),
+    'parse_review_cards_lxml (fixtures)': (bench_parse_review_cards_lxml, False)
+}
+
+# too big to build as a DataFrame at high scales (reviews x genres)
+max_labeled_reviews = 5_000_000
+
+
+def time_rounds(fn, min_time = 1.0, min_rounds = 3, max_rounds = 1000):
+    """ Seconds per round, for at least min_time seconds / min_rounds rounds
+        (the functions' prints are swallowed)
+    """
+    rounds = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()  # warm up
+        while len(rounds) < max_rounds and (len(rounds) < min_rounds or sum(rounds) < min_time):
+            start = time.perf_counter()
+            fn()
+            rounds.append(time.perf_counter() - start)
+    return rounds
+
+def run_benchmark(name, setup, data, min_time):
+    if name == 'user genre counts (all reviews)' and len(data['reviews'][0]) > max_labeled_reviews:
+        return None
+
+    fn = setup(data)
+    cleanup = None
+    if isinstance(fn, tuple):
+        fn, cleanup = fn
+
+    try:
+        rounds = time_rounds(fn, min_time = min_time)
+    finally:
+        if cleanup is not None:
+            cleanup()
+
+    return {
+        'min_ms': min(rounds) * 1000,
+        'median_ms': statistics.median(rounds) * 1000,
+        'rounds': len(rounds)
+    }
+
+def print_result(name, scale, result):
+    label = f"{scale}x" if scale is not None else "-"
+    if result is None:
+        print(f"{name:<38} {label:>5}   skipped (too large)")
+        return
+    print(f"{name:<38} {label:>5} {result['min_ms']:>10.2f} {result['median_ms']:>10.2f} {result['rounds']:>7}")
+
+def compare(results, baseline, tolerance):
+    """ Benchmarks whose median got more than tolerance slower than in baseline """
+    regressions = []
+    for name, by_scale in results.items():
+        for scale, result in by_scale.items():
+            before = baseline.get(name, {}).get(scale)
+            if result is None or before is None:
+                continue
+            if result['median_ms'] > before['median_ms'] * (1 + tolerance):
+                regressions.append((name, scale, before['median_ms'], result['median_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks for the recommendation and scraping hot paths")
+    parser.add_argument("--scales", type = int, nargs = "+", default = [1, 10, 100])
+    parser.add_argument("-k", dest = "keyword", default = "", help = "only benchmarks whose name contains this")
+    parser.add_argument("--min-time", type = float, default = 1.0, help = "seconds per benchmark")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--save", help = "write the results to this JSON file")
+    parser.add_argument("--compare", help = "JSON file from --save to check against")
+    parser.add_argument("--tolerance", type = float, default = 0.25, help = "allowed slowdown vs --compare")
+    parser.add_argument("--metrics", help = "write the instrumentation histograms to this file")
+    args = parser.parse_args()
+
+    selected = {name: b for name, b in benchmarks.items() if args.keyword.lower() in name.lower()}
+    results = {name: {} for name in selected}
+
+    print(f"{'benchmark':<38} {'scale':>5} {'min ms':>10} {'median ms':>10} {'rounds':>7}")
+
+    for name, (setup, scaled) in selected.items():
+        if not scaled:
+            results[name]['-'] = run_benchmark(name, setup, None, args.min_time)
+            print_result(name, None, results[name]['-'])
+
+    for scale in args.scales:
+        if not any(scaled for _, scaled in selected.values()):
+            break
+
+        start = time.perf_counter()
+        data = scaled_data(scale, seed = args.seed)
+        print(f"--- {scale}x: {len(data['users_data'])} users, {len(data['books'])} books, "
+              f"{len(data['reviews'][0])} reviews (generated in {time.perf_counter() - start:.1f} s)")
+
+        for name, (setup, scaled) in selected.items():
+            if scaled:
+                results[name][f"{scale}x"] = run_benchmark(name, setup, data, args.min_time)
+                print_result(name, scale, results[name][f"{scale}x"])
+        del data
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent = 2)
+
+    if args.metrics:
+        from instrumentation import registry
+        with open(args.metrics, "w") as f:
+            f.write(registry.to_prometheus() if args.metrics.endswith(".prom") else registry.to_json())
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, scale, before, after in regressions:
+            print(f"SLOWER {name} {scale}: {before:.2f} -> {after:.2f} ms median")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+
+def book_ids_from_title_ids(title_ids):
+    """ Goodreads book ids from review title_ids ('1052.The_Richest_Man' / '1052-the-richest-man' -> 1052)
+        Unparsable ids become -1.
+    """
+    ids = pd.Series(title_ids, dtype = object).astype(str).str.extract(r'^(\d+)')[0]
+    return pd.to_numeric(ids).fillna(-1).to_numpy(dtype = np.int64)
+
+
+def assign_book_ids(titles, reviews):
+    """ Book id for each title: the id its reviews link to most often (-1 if never reviewed) """
+    pairs = pd.DataFrame({'title': reviews['title'].to_numpy(),
+                          'book_id': book_ids_from_title_ids(reviews['title_id'])})
+    pairs = pairs[pairs.book_id >= 0]
+
+    most_common = pairs.value_counts().reset_index().drop_duplicates(subset = 'title')
+    book_ids = most_common.set_index('title')['book_id']
+
+    return book_ids.reindex(titles).fillna(-1).to_numpy(dtype = np.int64)
+
+
+def books_for_matrix(books, user_item_matrix):
+    """ Catalog rows for a bundle: one per book id column of an id-keyed
+        SparseUserItemMatrix (metadata joined from books by title, for
+        display), then the books none of those columns has (book_id -1)
+
+    books: title-keyed frame (title, author, publish_date, rating, num_ratings, ...)
+    """
+    books = books.drop(columns = 'book_id', errors = 'ignore').drop_duplicates(subset = 'title')
+    book_ids = user_item_matrix.all_book_ids()
+    if book_ids is None:
+        return books.assign(book_id = -1)
+
+    known = book_ids >= 0
+    by_id = pd.DataFrame({'book_id': book_ids[known], 'title': user_item_matrix.all_titles()[known]})
+    by_id = by_id.drop_duplicates(subset = 'book_id').merge(books, on = 'title', how = 'inner')
+    rest = books[~books['title'].isin(by_id['title'])].assign(book_id = -1)
+
+    return pd.concat([by_id, rest[by_id.columns]], ignore_index = True)
+
+
+class BookCatalog:
+    """ Columnar book metadata, one row per book
+
+    Columns are plain arrays (book_id, title, author, publish_date, rating,
+    num_ratings and optionally novelty), so enriching recommendations is a
+    take by row instead of merges on title. book_id is the Goodreads id
+    (-1 if unknown).
+
+    A bundle catalog has one row per Goodreads book id, so books that share
+    a title are separate rows; titles are only displayed. Id-keyed matrix
+    columns are matched by id, title-keyed ones by title. Rows for the
+    columns of a user-item matrix are looked up once per set of columns
+    (rows_for_matrix), not per request.
+    """
+
+    def __init__(self, books):
+        """ books: DataFrame or {column: array} (e.g. a bundle's memory-mapped
+            columns, which are used as is, without a copy)
+        """
+        column = lambda name: np.asarray(books[name])
+
+        self.title = column('title')
+        self.book_id = column('book_id').astype(np.int64, copy = False) if 'book_id' in books \
+            else np.full(len(self.title), -1, dtype = np.int64)
+        self.author = column('author')
+        self.publish_date = column('publish_date')
+        self.rating = column('rating')
+        self.num_ratings = column('num_ratings')
+        self.novelty = column('novelty') if 'novelty' in books else None
+
+        self._id_rows = None
+        self._title_rows = None
+        self._matrix_token = None
+        self._matrix_rows = None
+
+    @classmethod
+    def from_frames(cls, book_ratings, metadata):
+        """ From the title-keyed frames recommend_books_by_custom_genre_pct takes
+            (no book ids, so the first row wins for duplicate titles; bundles use books_for_matrix)
+        """
+        books = book_ratings.drop_duplicates(subset = 'title').reset_index(drop = True)
+        metadata = metadata[~metadata.index.duplicated()].reindex(books['title'])
+
+        return cls(books.assign(author = metadata['author'].to_numpy(),
+                                publish_date = metadata['publish_date'].to_numpy()))
+
+    def __len__(self):
+        return len(self.title)
+
+    def rows_for_titles(self, titles):
+        """ Catalog row for each title (-1 if not in the catalog) """
+        if self._title_rows is None:
+            title_rows = pd.Series(np.arange(len(self.title)), index = self.title)
+            self._title_rows = title_rows[~title_rows.index.duplicated()]
+        return self._title_rows.reindex(titles).fillna(-1).to_numpy(dtype = np.int64)
+
+    def rows_for_ids(self, book_ids):
+        """ Catalog row for each book id (-1 if not in the catalog) """
+        if self._id_rows is None:
+            known = self.book_id >= 0
+            id_rows = pd.Series(np.flatnonzero(known), index = self.book_id[known])
+            self._id_rows = id_rows[~id_rows.index.duplicated()]
+        return self._id_rows.reindex(book_ids).fillna(-1).to_numpy(dtype = np.int64)
+
+    def rows_for_matrix(self, user_item_matrix):
+        """ Catalog row of every column of a SparseUserItemMatrix (-1 if not in the catalog)
+
+        Columns with a book id are matched by id, the others by title.
+        Cached per columns_token, so slices of one matrix (take_users) and
+        pending upserts that add no columns reuse the lookup.
+        """
+        token = user_item_matrix.columns_token
+        if self._matrix_token is not token:
+            titles = user_item_matrix.all_titles()
+            book_ids = user_item_matrix.all_book_ids()
+            by_id = book_ids >= 0 if book_ids is not None else np.zeros(len(titles), dtype = bool)
+
+            rows = np.full(len(titles), -1, dtype = np.int64)
+            rows[by_id] = self.rows_for_ids(book_ids[by_id]) if by_id.any() else []
+            if not by_id.all():
+                rows[~by_id] = self.rows_for_titles(titles[~by_id])
+            self._matrix_rows = rows
+            self._matrix_token = token
+        return self._matrix_rows
@@ -0,0 +1,298 @@
+""" Bulk Goodreads user ingestion
+
+Crawl (resumable, writes parquet shards):
+    python bulk_ingest.py crawl user_ids.txt --out crawl/ --concurrency 8
+
+Build (compacts shards into the files full_app.py loads):
+    python bulk_ingest.py build --out crawl/ --data-dir data/
+
+Add (fetch a few users straight into a new data bundle, no full rebuild):
+    python bulk_ingest.py add user_ids.txt --artifacts-dir data/artifacts
+
+Crawl progress is checkpointed in <out>/done.txt after each shard is
+written, so a crashed run can be restarted with the same command and only
+users that were not flushed yet get fetched again.
+"""
+
+import argparse
+import asyncio
+import glob
+import os
+import time
+import uuid
+
+import pandas as pd
+
+from static import fiction_genres, nonfiction_genres
+from UserScraper import UserMetaData
+from goodreads_fetcher import get_fetcher
+from get_user_reviews import load_user_reviews_from_single_url, get_user_review_page_url, get_user_profile_url
+from sparse_user_item_matrix import SparseUserItemMatrix
+from instrumentation import count
+
+
+def read_id_file(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def append_ids(path, user_ids):
+    with open(path, "a") as f:
+        for user_id in user_ids:
+            f.write(f"{user_id}\n")
+
+
+async def fetch_user(user_id, fetcher, review_pages = 5):
+    """ Profile metadata + reviews for one user
+
+    Profile first (its rating count decides how many review pages exist),
+    then all review pages concurrently. Raises RuntimeError if any review
+    page failed, so the user goes to failed.txt instead of being written
+    with missing reviews.
+    """
+    user = UserMetaData(get_user_profile_url(user_id), review_pages = review_pages)
+
+    source = await fetcher.fetch_text(user.url)
+    user.set_soup_from_source(source)
+    user.parse_metadata()
+
+    urls = [get_user_review_page_url(user_id, i) for i in range(1, user.num_review_pages() + 1)]
+    pages = await asyncio.gather(*[load_user_reviews_from_single_url(url, fetcher) for url in urls],
+                                 return_exceptions = True)
+
+    errors = [page for page in pages if isinstance(page, Exception)]
+    if errors:
+        count("scrape.dropped_pages", len(errors))
+        raise RuntimeError(f"{len(errors)} of {len(pages)} review pages failed ({errors[0]})")
+
+    reviews = [review for page in pages for review in page]
+
+    return user.retrieve_metadata(), reviews
+
+
+class ShardWriter:
+    """ Buffers crawled users and writes them out as parquet shards """
+
+    def __init__(self, out_dir, shard_size = 100):
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.shard_count = 0
+
+        self.user_ids = []
+        self.users = []
+        self.reviews = []
+
+        os.makedirs(os.path.join(out_dir, "users"), exist_ok = True)
+        os.makedirs(os.path.join(out_dir, "reviews"), exist_ok = True)
+
+    def add(self, user_id, metadata, reviews):
+        self.user_ids.append(user_id)
+        self.users.append(metadata)
+        self.reviews.extend(reviews)
+
+        if len(self.user_ids) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if not self.user_ids:
+            return
+
+        shard_name = f"shard-{self.run_id}-{self.shard_count:05d}.parquet"
+        pd.DataFrame(self.users).to_parquet(os.path.join(self.out_dir, "users", shard_name))
+        pd.DataFrame(self.reviews, columns = ['user_id', 'title_id', 'title', 'rating', 'votes']).to_parquet(
+            os.path.join(self.out_dir, "reviews", shard_name))
+
+        # only checkpoint once the shard is on disk
+        append_ids(os.path.join(self.out_dir, "done.txt"), self.user_ids)
+
+        print(f"Wrote {shard_name} ({len(self.user_ids)} users, {len(self.reviews)} reviews)")
+        self.shard_count += 1
+        self.user_ids, self.users, self.reviews = [], [], []
+
+
+async def crawl_users(user_ids, out_dir, concurrency = 8, shard_size = 100, review_pages = 5, retry_failed = False):
+    fetcher = get_fetcher()
+
+    done = set(read_id_file(os.path.join(out_dir, "done.txt")))
+    failed = set() if retry_failed else set(read_id_file(os.path.join(out_dir, "failed.txt")))
+    todo = [u for u in dict.fromkeys(user_ids) if u not in done and u not in failed]
+    print(f"{len(todo)} users to crawl ({len(done)} done, {len(failed)} failed before)")
+
+    writer = ShardWriter(out_dir, shard_size = shard_size)
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.time()
+    finished = 0
+
+    async def crawl_one(user_id):
+        nonlocal finished
+        async with semaphore:
+            try:
+                metadata, reviews = await fetch_user(user_id, fetcher, review_pages = review_pages)
+            except Exception as e:
+                print(f"Failed to crawl {user_id}: {e}")
+                append_ids(os.path.join(out_dir, "failed.txt"), [user_id])
+                return
+
+        writer.add(user_id, metadata, reviews)
+        finished += 1
+        if finished % 50 == 0:
+            rate = finished / (time.time() - start)
+            print(f"{finished}/{len(todo)} users ({rate:.2f} users/s)")
+
+    try:
+        await asyncio.gather(*[crawl_one(u) for u in todo])
+    finally:
+        writer.flush()
+
+
+def read_shards(out_dir, kind):
+    paths = sorted(glob.glob(os.path.join(out_dir, kind, "*.parquet")))
+    if not paths:
+        raise FileNotFoundError(f"No {kind} shards in {out_dir}")
+    return pd.concat([pd.read_parquet(p) for p in paths], ignore_index = True)
+
+
+def build_datasets(out_dir, data_dir, genre_labels_path = "data/genre_labels.parquet",
+                   min_ratings = 1, dense_matrix = False):
+    """ Compact crawl shards into the parquet files full_app.py loads
+
+    - users_data.parquet
+    - all_labeled_reviews.parquet
+    - compact_user_genre_pct.parquet (fiction + nonfiction genres x users)
+    - smaller_user_item_matrix/ (sparse, see load_user_item_matrix)
+      and smaller_user_item_matrix.parquet if dense_matrix
+    """
+    from main_genre_book_recommender import label_reviews_with_genre, get_user_genre_counts
+
+    users = read_shards(out_dir, "users").drop_duplicates(subset = 'user_id', keep = 'last')
+    reviews = read_shards(out_dir, "reviews").dropna(subset = ['title'])
+    reviews = reviews.drop_duplicates(subset = ['user_id', 'title_id'], keep = 'last')
+
+    genre_labels = pd.read_parquet(genre_labels_path)
+    all_labeled_reviews = label_reviews_with_genre(reviews, genre_labels)
+
+    ratings_per_user = all_labeled_reviews[all_labeled_reviews.rating > 0].groupby('user_id')['title'].count()
+    kept_users = ratings_per_user[ratings_per_user >= min_ratings].index
+
+    user_genre_counts, user_genre_pct = get_user_genre_counts(all_labeled_reviews[all_labeled_reviews.user_id.isin(kept_users)])
+    compact_user_genre_pct = user_genre_pct.loc[fiction_genres + nonfiction_genres]
+
+    rated = all_labeled_reviews[all_labeled_reviews.user_id.isin(kept_users)]
+    user_item_matrix = SparseUserItemMatrix.from_reviews(rated, title_id_col = 'title_id')
+
+    os.makedirs(data_dir, exist_ok = True)
+    users.to_parquet(os.path.join(data_dir, "users_data.parquet"), index = False)
+    all_labeled_reviews.to_parquet(os.path.join(data_dir, "all_labeled_reviews.parquet"), index = False)
+    compact_user_genre_pct.to_parquet(os.path.join(data_dir, "compact_user_genre_pct.parquet"))
+    user_item_matrix.save(os.path.join(data_dir, "smaller_user_item_matrix"))
+
+    if dense_matrix:
+        user_item_matrix.to_dataframe().to_parquet(os.path.join(data_dir, "smaller_user_item_matrix.parquet"))
+
+    print(f"Built {len(users)} users, {len(all_labeled_reviews)} labeled reviews, "
+          f"{user_item_matrix.shape[0]} x {user_item_matrix.shape[1]} user-item matrix ({user_item_matrix.nnz} ratings) in {data_dir}")
+
+
+async def add_users(user_ids, pool, concurrency = 8, review_pages = 5):
+    """ Fetch users and upsert them into a NeighborPool; returns how many joined """
+    fetcher = get_fetcher()
+    semaphore = asyncio.Semaphore(concurrency)
+    added = 0
+
+    async def add_one(user_id):
+        nonlocal added
+        async with semaphore:
+            try:
+                metadata, reviews = await fetch_user(user_id, fetcher, review_pages = review_pages)
+            except Exception as e:
+                print(f"Failed to fetch {user_id}: {e}")
+                return
+
+        reviews = pd.DataFrame(reviews, columns = ['user_id', 'title_id', 'title', 'rating', 'votes'])
+        if pool.upsert_user(user_id, reviews.dropna(subset = ['title']), name = metadata['name']):
+            added += 1
+        else:
+            print(f"Skipped {user_id}: not enough rated books with genre labels")
+
+    await asyncio.gather(*[add_one(u) for u in dict.fromkeys(user_ids)])
+    return added
+
+
+def add_users_to_bundle(user_ids, artifacts_dir = "data/artifacts", concurrency = 8, review_pages = 5,
+                        min_ratings = 1):
+    """ Current bundle + fetched users -> new bundle version (made current) """
+    from data_loader import load_bundle, build_bundle_from_pool
+    from neighbor_pool import NeighborPool
+
+    bundle = load_bundle(artifacts_dir)
+    pool = NeighborPool(bundle['similarity_index'], bundle['user_item_matrix'], bundle['genre_labels'],
+                        users_data = pd.DataFrame(bundle['users_data']), min_ratings = min_ratings)
+
+    added = get_fetcher().run(add_users(user_ids, pool, concurrency = concurrency, review_pages = review_pages))
+    if added == 0:
+        print("No users added, bundle unchanged")
+        return None
+
+    version = build_bundle_from_pool(pool, artifacts_dir, base_version = bundle['version'])
+    print(f"Added {added} users: bundle {version} ({len(pool)} users) is now current")
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Bulk Goodreads user ingestion")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    crawl = commands.add_parser("crawl", help = "fetch profiles and reviews into parquet shards")
+    crawl.add_argument("user_ids", help = "file with one Goodreads user id per line")
+    crawl.add_argument("--out", default = "crawl")
+    crawl.add_argument("--concurrency", type = int, default = 8, help = "users in flight at once")
+    crawl.add_argument("--per-host-limit", type = int, default = 5, help = "requests in flight per host")
+    crawl.add_argument("--shard-size", type = int, default = 100, help = "users per shard / checkpoint")
+    crawl.add_argument("--review-pages", type = int, default = 5)
+    crawl.add_argument("--retry-failed", action = "store_true", help = "also retry users in failed.txt")
+
+    build = commands.add_parser("build", help = "compact shards into the app's datasets")
+    build.add_argument("--out", default = "crawl")
+    build.add_argument("--data-dir", default = "data")
+    build.add_argument("--genre-labels", default = "data/genre_labels.parquet")
+    build.add_argument("--min-ratings", type = int, default = 1, help = "min rated books for a user to be a neighbor")
+    build.add_argument("--dense-matrix", action = "store_true", help = "also write the dense user-item parquet")
+
+    add = commands.add_parser("add", help = "fetch users into a new version of the current data bundle")
+    add.add_argument("user_ids", help = "file with one Goodreads user id per line")
+    add.add_argument("--artifacts-dir", default = "data/artifacts")
+    add.add_argument("--concurrency", type = int, default = 8)
+    add.add_argument("--review-pages", type = int, default = 5)
+    add.add_argument("--min-ratings", type = int, default = 1, help = "min rated books for a user to be a neighbor")
+
+    args = parser.parse_args()
+
+    if args.command == "crawl":
+        os.makedirs(args.out, exist_ok = True)
+        fetcher = get_fetcher()
+        fetcher.per_host_limit = args.per_host_limit
+        fetcher.connection_limit = max(fetcher.connection_limit, args.per_host_limit)
+
+        try:
+            fetcher.run(crawl_users(read_id_file(args.user_ids), args.out, concurrency = args.concurrency,
+                                    shard_size = args.shard_size, review_pages = args.review_pages,
+                                    retry_failed = args.retry_failed))
+        finally:
+            fetcher.close()
+
+    elif args.command == "build":
+        build_datasets(args.out, args.data_dir, genre_labels_path = args.genre_labels,
+                       min_ratings = args.min_ratings, dense_matrix = args.dense_matrix)
+
+    elif args.command == "add":
+        try:
+            add_users_to_bundle(read_id_file(args.user_ids), args.artifacts_dir, concurrency = args.concurrency,
+                                review_pages = args.review_pages, min_ratings = args.min_ratings)
+        finally:
+            get_fetcher().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+""" Versioned recommender data bundles for full_app
+
+Build a bundle from the raw parquet files (offline, once per data refresh):
+    python data_loader.py build [--data-dir data] [--artifacts-dir data/artifacts]
+
+Other commands:
+    python data_loader.py list                 versions on disk (* = current)
+    python data_loader.py verify [version]     check file checksums
+    python data_loader.py activate <version>   switch the app to another version
+
+A bundle is one directory, data/artifacts/<version>/, containing
+
+    manifest.json          version, build time, sha256 + size of every file
+    books/                 book_id, title, author, publish_date, rating, num_ratings, novelty (.npy, one row per book)
+    users/                 user_id, name (.npy, sorted by user_id)
+    genre_labels.arrow     Arrow IPC table
+    similarity_index/      normalized genre matrix, read counts (GenreSimilarityIndex)
+    user_item_matrix/      sparse rating matrix (SparseUserItemMatrix)
+
+build_bundle_from_pool writes a new version from the current one plus users
+added incrementally (NeighborPool, see bulk_ingest.py add), without
+rebuilding from the raw files.
+
+Bundles are built in a temporary directory and renamed into place, and
+data/artifacts/CURRENT (the active version) is replaced atomically, so the
+app never sees a half-written bundle and versions can be rolled back.
+All .npy arrays are memory-mapped read-only at startup and used as is
+(books and users stay column arrays, not DataFrames, so nothing is copied).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from static import genres
+from book_catalog import BookCatalog, books_for_matrix
+from genre_similarity_index import GenreSimilarityIndex
+from sparse_user_item_matrix import SparseUserItemMatrix, load_user_item_matrix
+
+
+books_columns = ['title', 'author', 'publish_date', 'rating', 'num_ratings']
+users_columns = ['user_id', 'name']
+
+data_files = {
+    'books': "all_books_final.parquet",
+    'users': "users_data.parquet",
+    'genre_labels': "genre_labels.parquet",
+    'reviews': "all_labeled_reviews.parquet",
+    'genre_pct': "compact_user_genre_pct.parquet",
+    'genre_pct_by_user': "user_genre_pct.parquet",
+    'user_item_matrix': "smaller_user_item_matrix.parquet"
+}
+
+current_file = "CURRENT"
+manifest_file = "manifest.json"
+
+
+class BundleError(Exception):
+    """Raised when a data bundle is missing or fails verification."""
+    pass
+
+
+def save_arrow(df, path):
+    table = pa.Table.from_pandas(df, preserve_index = False)
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+def load_arrow(path):
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas()
+
+
+def save_columns(df, path):
+    """ One .npy per column
+        (text as fixed-width unicode, missing text as "", so every column can be memory-mapped)
+    """
+    os.makedirs(path, exist_ok = True)
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if not np.issubdtype(values.dtype, np.number):
+            values = df[column].fillna("").to_numpy().astype(str)
+        np.save(os.path.join(path, f"{column}.npy"), values)
+
+def load_columns(path, columns, mmap_mode = None):
+    """ {column: array} (memory-mapped with mmap_mode, no copy) """
+    return {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode = mmap_mode) for column in columns}
+
+def save_users(users, path):
+    """ save_columns for users, one row per user_id, sorted by it
+        (so names can be looked up with a binary search on the memory-mapped ids)
+    """
+    users = users[users_columns].drop_duplicates(subset = 'user_id')
+    save_columns(users.sort_values('user_id').reset_index(drop = True), path)
+
+
+def file_sha256(path, chunk_size = 1024 ** 2):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def bundle_files(bundle_dir):
+    for root, _, file_names in os.walk(bundle_dir):
+        for file_name in file_names:
+            rel_path = os.path.relpath(os.path.join(root, file_name), bundle_dir)
+            if rel_path != manifest_file:
+                yield rel_path
+
+
+def global_novelty(num_ratings):
+    """ Novelty of every book relative to the whole catalog (1 = rarely read) """
+    from main_genre_book_recommender import get_novelty
+    return get_novelty(np.asarray(num_ratings))
+
+
+def read_genre_pct(paths):
+    """ compact_user_genre_pct (genres x users)
+
+    Read from compact_user_genre_pct.parquet (one column per user), or, for
+    data with too many users for that, user_genre_pct.parquet (the same
+    table transposed: one row per user, indexed by user_id)
+    """
+    if os.path.exists(paths['genre_pct']):
+        return pd.read_parquet(paths['genre_pct'])
+    if os.path.exists(paths['genre_pct_by_user']):
+        return pd.read_parquet(paths['genre_pct_by_user']).T
+    raise BundleError(f"Neither {paths['genre_pct']} nor {paths['genre_pct_by_user']} exists")
+
+
+def build_bundle(data_dir = "data", artifacts_dir = "data/artifacts", version = None, activate = True):
+    """ Build a new bundle from the raw parquet files; returns its version """
+    from main_genre_book_recommender import get_user_genre_counts
+
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    if os.path.exists(os.path.join(artifacts_dir, version)):
+        raise BundleError(f"Bundle {version} already exists in {artifacts_dir}")
+
+    tmp_dir = os.path.join(artifacts_dir, f".tmp-{version}")
+    shutil.rmtree(tmp_dir, ignore_errors = True)
+    os.makedirs(tmp_dir)
+
+    paths = {name: os.path.join(data_dir, file_name) for name, file_name in data_files.items()}
+
+    review_columns = ['user_id', 'title'] + genres
+    if 'title_id' in pq.read_schema(paths['reviews']).names:
+        review_columns.append('title_id')
+    reviews = pd.read_parquet(paths['reviews'], columns = review_columns)
+
+    # the matrix and books files are keyed by title; Goodreads ids come from
+    # the reviews' title_id links, so books that share a title get their own
+    # column and catalog row
+    user_item_matrix = load_user_item_matrix(paths['user_item_matrix'])
+    if user_item_matrix.book_ids is None and 'title_id' in reviews.columns:
+        user_item_matrix = user_item_matrix.with_book_ids(reviews)
+    user_item_matrix.save(os.path.join(tmp_dir, "user_item_matrix"))
+
+    books = books_for_matrix(pd.read_parquet(paths['books'], columns = books_columns), user_item_matrix)
+    books['novelty'] = global_novelty(books['num_ratings'])
+    save_columns(books[['book_id'] + books_columns + ['novelty']], os.path.join(tmp_dir, "books"))
+
+    users = pd.read_parquet(paths['users'], columns = users_columns)
+    save_users(users, os.path.join(tmp_dir, "users"))
+
+    save_arrow(pd.read_parquet(paths['genre_labels']), os.path.join(tmp_dir, "genre_labels.arrow"))
+
+    user_genre_counts, _ = get_user_genre_counts(reviews)
+    compact_user_genre_pct = read_genre_pct(paths)
+    GenreSimilarityIndex(compact_user_genre_pct, user_genre_counts).save(os.path.join(tmp_dir, "similarity_index"))
+
+    publish_bundle(tmp_dir, artifacts_dir, version, activate, books = len(books), users = len(users))
+    return version
+
+
+def build_bundle_from_pool(pool, artifacts_dir = "data/artifacts", base_version = None, version = None, activate = True):
+    """ New bundle = base bundle + the users added to a NeighborPool
+
+    Books and genre labels are hard-linked from the base bundle (copied if
+    linking fails), users, similarity index and user-item matrix are written
+    from the compacted pool. Returns the new version.
+    """
+    base_version = base_version or current_version(artifacts_dir)
+    base_dir = os.path.join(artifacts_dir, base_version)
+    base_manifest = read_manifest(artifacts_dir, base_version)
+
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    if os.path.exists(os.path.join(artifacts_dir, version)):
+        raise BundleError(f"Bundle {version} already exists in {artifacts_dir}")
+
+    tmp_dir = os.path.join(artifacts_dir, f".tmp-{version}")
+    shutil.rmtree(tmp_dir, ignore_errors = True)
+    os.makedirs(tmp_dir)
+
+    for rel_path in base_manifest['files']:
+        if rel_path.startswith("books") or rel_path == "genre_labels.arrow":
+            link_or_copy(os.path.join(base_dir, rel_path), os.path.join(tmp_dir, rel_path))
+
+    pool.compact()
+    save_users(pd.DataFrame(pool.users_data), os.path.join(tmp_dir, "users"))
+    pool.similarity_index.save(os.path.join(tmp_dir, "similarity_index"))
+    pool.user_item_matrix.save(os.path.join(tmp_dir, "user_item_matrix"))
+
+    publish_bundle(tmp_dir, artifacts_dir, version, activate, books = base_manifest['books'],
+                   users = len(pool.users_data), parent = base_version)
+    return version
+
+
+def link_or_copy(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok = True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def publish_bundle(tmp_dir, artifacts_dir, version, activate, **info):
+    """ Write the manifest, move tmp_dir into place and (optionally) make it current """
+    manifest = {
+        'version': version,
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **info,
+        'files': {rel_path: {'sha256': file_sha256(os.path.join(tmp_dir, rel_path)),
+                             'bytes': os.path.getsize(os.path.join(tmp_dir, rel_path))}
+                  for rel_path in sorted(bundle_files(tmp_dir))}
+    }
+    with open(os.path.join(tmp_dir, manifest_file), "w") as f:
+        json.dump(manifest, f, indent = 2)
+
+    os.rename(tmp_dir, os.path.join(artifacts_dir, version))
+    if activate:
+        activate_bundle(artifacts_dir, version)
+
+
+def activate_bundle(artifacts_dir, version):
+    """ Point CURRENT at version (atomic replace) """
+    if not os.path.exists(os.path.join(artifacts_dir, version, manifest_file)):
+        raise BundleError(f"No bundle {version} in {artifacts_dir}")
+
+    tmp_path = os.path.join(artifacts_dir, f".{current_file}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(artifacts_dir, current_file))
+
+def current_version(artifacts_dir):
+    path = os.path.join(artifacts_dir, current_file)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip()
+
+def list_versions(artifacts_dir):
+    if not os.path.isdir(artifacts_dir):
+        return []
+    return sorted(v for v in os.listdir(artifacts_dir)
+                  if os.path.exists(os.path.join(artifacts_dir, v, manifest_file)))
+
+def read_manifest(artifacts_dir, version):
+    with open(os.path.join(artifacts_dir, version, manifest_file)) as f:
+        return json.load(f)
+
+def verify_bundle(artifacts_dir, version):
+    """ Raises BundleError if any file is missing or its checksum differs """
+    bundle_dir = os.path.join(artifacts_dir, version)
+    manifest = read_manifest(artifacts_dir, version)
+
+    for rel_path, info in manifest['files'].items():
+        path = os.path.join(bundle_dir, rel_path)
+        if not os.path.exists(path):
+            raise BundleError(f"{version}: missing {rel_path}")
+        if file_sha256(path) != info['sha256']:
+            raise BundleError(f"{version}: checksum mismatch for {rel_path}")
+
+    return manifest
+
+
+def load_bundle(artifacts_dir = "data/artifacts", version = None, verify = False, mmap_mode = "r"):
+    """ Everything full_app needs to recommend, from one bundle
+
+    version defaults to CURRENT. Returns a dict with version, books
+    (incl. novelty) and users_data ({column: memory-mapped array}, users
+    sorted by user_id), genre_labels (DataFrame), catalog (BookCatalog over
+    books), similarity_index (GenreSimilarityIndex) and user_item_matrix
+    (SparseUserItemMatrix).
+    """
+    version = version or current_version(artifacts_dir)
+    if version is None:
+        raise BundleError(f"No current bundle in {artifacts_dir} (run: python data_loader.py build)")
+
+    bundle_dir = os.path.join(artifacts_dir, version)
+    manifest = verify_bundle(artifacts_dir, version) if verify else read_manifest(artifacts_dir, version)
+
+    # bundles built before book ids have no books/book_id.npy
+    books_dir = os.path.join(bundle_dir, "books")
+    columns = books_columns + ['novelty']
+    if os.path.exists(os.path.join(books_dir, "book_id.npy")):
+        columns = ['book_id'] + columns
+    books = load_columns(books_dir, columns, mmap_mode = mmap_mode)
+
+    # bundles built before save_users are not sorted by user_id
+    users = load_columns(os.path.join(bundle_dir, "users"), users_columns, mmap_mode = mmap_mode)
+    if np.any(users['user_id'][1:] < users['user_id'][:-1]):
+        order = np.argsort(users['user_id'], kind = 'stable')
+        users = {column: values[order] for column, values in users.items()}
+
+    return {
+        'version': manifest['version'],
+        'books': books,
+        'catalog': BookCatalog(books),
+        'users_data': users,
+        'genre_labels': load_arrow(os.path.join(bundle_dir, "genre_labels.arrow")),
+        'similarity_index': GenreSimilarityIndex.load(os.path.join(bundle_dir, "similarity_index"), mmap_mode = mmap_mode),
+        'user_item_matrix': SparseUserItemMatrix.load(os.path.join(bundle_dir, "user_item_matrix"), mmap_mode = mmap_mode)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Recommender data bundles")
+    parser.add_argument("--artifacts-dir", default = "data/artifacts")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    build = commands.add_parser("build", help = "build a new bundle from the raw parquet files")
+    build.add_argument("--data-dir", default = "data")
+    build.add_argument("--version", default = None)
+    build.add_argument("--no-activate", action = "store_true", help = "don't make it the current version")
+
+    commands.add_parser("list", help = "list bundle versions")
+
+    verify = commands.add_parser("verify", help = "check a bundle's checksums")
+    verify.add_argument("version", nargs = "?")
+
+    activate = commands.add_parser("activate", help = "make a version current")
+    activate.add_argument("version")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        version = build_bundle(args.data_dir, args.artifacts_dir, version = args.version,
+                               activate = not args.no_activate)
+        print(f"Built bundle {version} in {args.artifacts_dir}")
+
+    elif args.command == "list":
+        current = current_version(args.artifacts_dir)
+        for version in list_versions(args.artifacts_dir):
+            print(f"{'*' if version == current else ' '} {version}")
+
+    elif args.command == "verify":
+        version = args.version or current_version(args.artifacts_dir)
+        manifest = verify_bundle(args.artifacts_dir, version)
+        print(f"{version}: {len(manifest['files'])} files OK")
+
+    elif args.command == "activate":
+        activate_bundle(args.artifacts_dir, args.version)
+        print(f"Current bundle is now {args.version}")
+
+
+if __name__ == "__main__":
+    main()
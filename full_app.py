@@ -1,40 +1,56 @@
+import time
+
 import streamlit as st
-import os
+import pandas as pd
+from typing import List
 
-from static import *
-from get_user_reviews import *
-from main_genre_book_recommender import *
-from user_review_cache_class import UserReviewCache
-from concurrent.futures import ThreadPoolExecutor
+from static import (fiction_genres, nonfiction_genres, profiles, profile_images, profile_dicts,
+                    rec_df_cols, neighbor_df_cols)
+from get_user_reviews import UserLoads
+from main_genre_book_recommender import (GenreProfileAccumulator, retrieve_genre_values_from_df,
+                                         adjust_genre_values, recommend_books_by_custom_genre_pct, hide_read_books)
+from recommendation_cache import RecommendationCache, recommendation_key
+from user_review_cache_class import SharedReviewCache
+from data_loader import load_bundle, current_version
+from instrumentation import configure_logging, trace
 
 
 st.set_page_config(page_title="User Reviews", layout="wide")
+configure_logging()
 fiction_sliders, col2, nonfiction_sliders, col4, col_recommend = st.columns([2, .5, 2, .5, 6]) 
 
-# Preloaded parquet files (for calculations)
-file_paths = ["data/all_books_final.parquet",
-              "data/users_data.parquet",
-              "data/genre_labels.parquet",
-              "data/all_labeled_reviews.parquet",
-              "data/compact_user_genre_pct.parquet",
-              "data/smaller_user_item_matrix.parquet"]
-@st.cache_data
-def interface_loader(file_paths):
-    """ Load parquet files needed for calculations
-        Loads into st.st.session_state.data_dict
-        (only required 1st time)
+# Versioned bundles built offline from the raw parquet files (see data_loader.py)
+artifacts_dir = "data/artifacts"
+review_cache_path = "data/review_cache.sqlite"
+
+# seconds between reruns while a user's review pages are still arriving
+load_poll_interval = 0.3
+
+@st.cache_resource(max_entries = 2)
+def interface_loader(artifacts_dir, version):
+    """ Load one data bundle version (once per process)
+        Arrays are memory-mapped, so processes share one copy
+    """
+    return load_bundle(artifacts_dir, version)
+
+@st.cache_resource
+def review_cache_loader():
+    """ One review cache for every session in this process
+        (persisted to disk, so it also survives restarts)
     """
-    def load_file(path):
-        file_name = os.path.basename(path)
-        df = pd.read_parquet(path)
-        return file_name, df
-
-    data_dict = {}
-    with ThreadPoolExecutor() as executor:
-        results = executor.map(load_file, file_paths)
-        for name, df in results:
-            data_dict[name] = df
-    return data_dict
+    return SharedReviewCache(disk_path = review_cache_path)
+
+@st.cache_resource
+def recommendation_cache_loader():
+    """ Recommendation results for every session in this process
+        (keyed by slider values + mode, before hide_read)
+    """
+    return RecommendationCache()
+
+@st.cache_resource
+def review_loads_loader():
+    """ In-flight (streaming) user loads, shared by all sessions """
+    return UserLoads()
 
 def genre_subtext(title, spaces = 2):
     """ Basic formatting/text function
@@ -68,6 +84,50 @@ def check_if_sliders_zero():
 # Slider values are from 0 to max_genre_pct
 max_genre_pct = 50
 
+def set_sliders_from_accumulator():
+    """ Sliders <- genre values of the reviews loaded so far
+        (and recommendations get refreshed on this run)
+    """
+    _, genre_pct = st.session_state.genre_accumulator.counts_and_pcts(max_value = max_genre_pct/100)
+    if len(genre_pct) == 0:
+        return
+
+    st.session_state.load_user_status = True
+    set_sliders(retrieve_genre_values_from_df(genre_pct, fiction_genres))
+    set_sliders(retrieve_genre_values_from_df(genre_pct, nonfiction_genres))
+    st.session_state.refresh_recommendations = True
+
+def apply_user_load():
+    """ Pick up review pages that arrived since the last run
+        (must run before the sliders are drawn)
+    """
+    load = st.session_state.get("user_load")
+    if load is None:
+        return
+
+    done = load.done()
+    batches = load.batches_since(st.session_state.user_load_seen)
+    st.session_state.user_load_seen += len(batches)
+
+    reviews = [review for batch in batches for review in batch]
+    if reviews:
+        st.session_state.genre_accumulator.add(reviews)
+        st.session_state.user_reviews = pd.concat([st.session_state.user_reviews, pd.DataFrame(reviews)],
+                                                  ignore_index = True)
+        set_sliders_from_accumulator()
+
+    if done:
+        st.session_state.user_load = None
+        if len(st.session_state.user_reviews) > 0:
+            # partial loads (deadline hit, failed pages) are shown but not cached as the user's history
+            if load.complete:
+                review_cache_loader().set(load.user_id, st.session_state.user_reviews)
+        else:
+            st.session_state.load_user_status = False
+
+# pages of a streaming user load that arrived since the last run
+apply_user_load()
+
 with fiction_sliders:
     st.write("")
     st.subheader("📚 Your personality")
@@ -129,31 +189,32 @@ def load_user_reviews_button(user_id: str, genre_labels: pd.DataFrame,
             st.error("Please enter a valid user ID.")
     else:
 
-        # refresh recs and neighbors (before user presses 'recommend' button)
+        # refresh recs and neighbors
         st.session_state.recommendations = pd.DataFrame(columns=rec_df_cols)
         st.session_state.neighbors = pd.DataFrame(columns = neighbor_df_cols)
 
-        with st.spinner("Loading user reviews..."):
-            st.session_state.user_reviews = get_user_reviews_from_cache(user_id)
-        
-        # get genre info from user's reviews
-        temp_genre_counts, temp_genre_counts = get_user_genre_counts_and_pcts(st.session_state.user_reviews, 
-                                                                            genre_labels, max_value= max_genre_pct/100)
-
-        
-        
-        # check if loaded successfully
-        if len(temp_genre_counts) > 0:
-            st.session_state.load_user_status = True
-        else:
-            st.session_state.load_user_status = False
+        # genre info from the user's reviews, updated page by page
+        st.session_state.genre_accumulator = GenreProfileAccumulator(genre_labels)
+        st.session_state.user_reviews = pd.DataFrame()
 
-        # set sliders to user's genre values
-        user_fiction_values_dict = retrieve_genre_values_from_df(temp_genre_counts, fiction_genres)
-        user_nonfiction_values_dict = retrieve_genre_values_from_df(temp_genre_counts, nonfiction_genres)
+        cached = review_cache_loader().get(user_id)
+        if cached is not None:
+            st.session_state.user_load = None
+            st.session_state.user_reviews = cached
+            st.session_state.genre_accumulator.add(cached)
+            st.session_state.load_user_status = len(cached) > 0
+            set_sliders_from_accumulator()
+            return
+
+        # concurrent loads of the same user (other sessions) share one scrape;
+        # sliders and recommendations are provisional until every page is in
+        load = review_loads_loader().get_or_start(user_id)
+        with st.spinner("Loading user reviews..."):
+            load.wait_first()
 
-        set_sliders(user_fiction_values_dict)
-        set_sliders(user_nonfiction_values_dict)
+        st.session_state.user_load = load
+        st.session_state.user_load_seen = 0
+        apply_user_load()
 
 with col_recommend:
     
@@ -161,46 +222,23 @@ with col_recommend:
     st.sidebar.title("🔍 Load User Reviews")
     user_id = st.sidebar.text_input("GoodReads User ID")
 
-    def get_user_reviews_from_cache(user_id):
-        """
-        Load user's review data from GoodReads url
-        Stores in cache (for easier repeat retrieval)
-        """
-        cached = cache.get(user_id)
-        if cached is not None:
-            return cached
-        
-        user_reviews_dicts = get_reviews_from_user_url(user_id)
-        user_reviews = pd.DataFrame(user_reviews_dicts)
-        cache.set(user_id, user_reviews)
-        return user_reviews
-
-    if "data_dict" not in st.session_state: 
-        st.session_state.data_dict = interface_loader(file_paths)
+    # CURRENT is read on every run, so `data_loader.py activate` is picked up
+    # without a restart; bundles are only built offline (data_loader.py build)
+    version = current_version(artifacts_dir)
+    if version is None:
+        st.error(f"No data bundle in {artifacts_dir}. Build one first: python data_loader.py build")
+        st.stop()
+    data_dict = interface_loader(artifacts_dir, version)
 
-    data_dict = st.session_state.data_dict
+    users_data = data_dict["users_data"]
+    genre_labels = data_dict["genre_labels"]
+    smaller_user_item_matrix = data_dict["user_item_matrix"]
+    similarity_index = data_dict["similarity_index"]
+    book_catalog = data_dict["catalog"]  # metadata by row / book id, no title merges per request
 
-    all_books = data_dict["all_books_final.parquet"]
-    all_books_ratings = all_books[['title', 'rating', 'num_ratings']]
-    books_author_date = all_books[['title', 'author', 'publish_date']]
-    books_author_date = books_author_date.set_index('title')
-
-    users_data = data_dict["users_data.parquet"]
-    genre_labels = data_dict["genre_labels.parquet"]
-    all_labeled_reviews = data_dict["all_labeled_reviews.parquet"]
-    compact_user_genre_pct = data_dict["compact_user_genre_pct.parquet"]
-    smaller_user_item_matrix = data_dict["smaller_user_item_matrix.parquet"]
-
-    if "user_genre_counts" not in st.session_state:
-        st.session_state.user_genre_counts, st.session_state.user_genre_pct = get_user_genre_counts(data_dict["all_labeled_reviews.parquet"])
-
-    user_genre_counts, user_genre_pct = st.session_state.user_genre_counts, st.session_state.user_genre_pct
-
-    # --- Persist cache between reruns ---
-    if "cache" not in st.session_state:
-        st.session_state.cache = UserReviewCache(maxsize=10)
-
-    cache = st.session_state.cache
+    # results computed on another data version are dropped
+    recommendation_cache = recommendation_cache_loader()
+    recommendation_cache.invalidate(data_dict["version"])
 
     if 'user_reviews' not in st.session_state:
         st.session_state.user_reviews = pd.DataFrame()
@@ -291,26 +329,44 @@ with col_recommend:
     if 'recommendations' not in st.session_state:
         st.session_state.recommendations = None
 
-    if recommend_button:
+    # after the button, or when a user's review pages updated the sliders
+    if recommend_button or st.session_state.pop("refresh_recommendations", False):
         # Maps slider values to genre vector
         st.session_state.user_genre_stats_main = adjust_genre_values(st.session_state.user_genre_stats_main,
                                                                         fiction_genres + nonfiction_genres,
                                                                         fiction_values + nonfiction_values
                                                                         )
  
-        # Gets recommendations!!
-        st.session_state.recommendations, st.session_state.neighbors = recommend_books_by_custom_genre_pct(st.session_state.user_genre_stats_main, novelty_factor = novelty_factor,
-                                                                rating_emphasis = 8, user_reviews = st.session_state.user_reviews,
-                                                                user_genre_counts = user_genre_counts, other_users_genre_pct = compact_user_genre_pct,
-                                                                user_item_matrix = smaller_user_item_matrix, users_data = users_data, 
-                                                                book_ratings = all_books_ratings, metadata = books_author_date, hide_read=st.session_state.hide_read)
+        # Gets recommendations!! (cached per sliders + mode, shared by all users)
+        rating_emphasis = 8
+        with trace("recommend.request"):
+            cache_key = recommendation_key(st.session_state.user_genre_stats_main, novelty_factor, rating_emphasis,
+                                           genres = fiction_genres + nonfiction_genres)
+            recommendations, neighbors = recommendation_cache.get_or_compute(cache_key, recommend_books_by_custom_genre_pct,
+                                                                    st.session_state.user_genre_stats_main, novelty_factor = novelty_factor,
+                                                                    rating_emphasis = rating_emphasis, user_reviews = None,
+                                                                    user_genre_counts = None, other_users_genre_pct = None,
+                                                                    user_item_matrix = smaller_user_item_matrix, users_data = users_data, 
+                                                                    book_ratings = None, metadata = None, hide_read = False,
+                                                                    similarity_index = similarity_index, catalog = book_catalog)
+
+            # per user, after the cache lookup
+            if st.session_state.hide_read:
+                recommendations = hide_read_books(recommendations, st.session_state.user_reviews)
+
+        st.session_state.recommendations, st.session_state.neighbors = recommendations, neighbors
 
             
     # Display
     if st.session_state.recommendations is not None:
-        result= st.session_state.recommendations.head(50)
+        result= st.session_state.recommendations.head(50).drop(columns = 'book_id', errors = 'ignore')
         st.dataframe(result.head(10), height = 210)
 
+        if st.session_state.get("user_load") is not None:
+            load = st.session_state.user_load
+            total = f" of {load.pages}" if load.pages is not None else ""
+            st.caption(f"Provisional: {load.pages_loaded()}{total} review pages loaded...")
+
         if check_if_sliders_zero():
             st.warning("Kind reminder to toggle genres before loading recommendations")
 
@@ -351,4 +407,10 @@ with data_description:
     st.write("""*Data based on*""")
     st.caption(""" - 16,000+ books """)
     st.caption(""" - 9,500+ user profiles """)
-    st.caption(""" - 475,000+ ratings""")
\ No newline at end of file
+    st.caption(""" - 475,000+ ratings""")
+
+
+# review pages still arriving: pick them up on the next run
+if st.session_state.get("user_load") is not None:
+    time.sleep(load_poll_interval)
+    st.rerun()
@@ -1,9 +1,14 @@
+import logging
 import pandas as pd
 import numpy as np
+import threading
 import time
 
 from static import *
-from sklearn.metrics.pairwise import cosine_similarity
+from sparse_user_item_matrix import SparseUserItemMatrix
+from top_k import top_k_rows
+
+logger = logging.getLogger(__name__)
 
 def get_user_genre_counts(reviews):
     
@@ -15,25 +20,57 @@ def get_user_genre_counts(reviews):
 
 """ Local data files """
 
-print("Loading parquets...")
-start = time.time()
+class RecommenderData:
+    """ The parquet files this module works on, read on first attribute access
+        (importing the module no longer loads anything)
+
+    all_books, all_books_ratings, books_author_date, users_data, genre_labels,
+    all_labeled_reviews, user_genre_counts, user_genre_pct,
+    compact_user_genre_pct, main_user_item_matrix
+    """
+
+    def __init__(self, data_dir = "data"):
+        self.data_dir = data_dir
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def path(self, file_name):
+        return f"{self.data_dir}/{file_name}"
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+
+            logger.info("Loading parquets...")
+            start = time.time()
 
-all_books = pd.read_parquet("data/all_books.parquet")
-all_books['publish_date'] = all_books['publish_date'].str[:-6]
-all_books_ratings = all_books[['title', 'rating', 'num_ratings']]
-books_author_date = all_books[['title', 'author', 'publish_date']]
-books_author_date = books_author_date.set_index('title')
+            all_books = pd.read_parquet(self.path("all_books.parquet"))
+            all_books['publish_date'] = all_books['publish_date'].str[:-6]
+            self.all_books = all_books
+            self.all_books_ratings = all_books[['title', 'rating', 'num_ratings']]
+            self.books_author_date = all_books[['title', 'author', 'publish_date']].set_index('title')
 
-users_data = pd.read_parquet("data/users_data.parquet")
+            self.users_data = pd.read_parquet(self.path("users_data.parquet"))
 
-genre_labels = pd.read_parquet("data/genre_labels.parquet")
-all_labeled_reviews = pd.read_parquet("data/all_labeled_reviews.parquet")
-user_genre_counts, user_genre_pct = get_user_genre_counts(all_labeled_reviews)
-compact_user_genre_pct = pd.read_parquet("data/compact_user_genre_pct.parquet")
-main_user_item_matrix = pd.read_parquet("data/main_user_item_matrix.parquet")
+            self.genre_labels = pd.read_parquet(self.path("genre_labels.parquet"))
+            self.all_labeled_reviews = pd.read_parquet(self.path("all_labeled_reviews.parquet"))
+            self.user_genre_counts, self.user_genre_pct = get_user_genre_counts(self.all_labeled_reviews)
+            self.compact_user_genre_pct = pd.read_parquet(self.path("compact_user_genre_pct.parquet"))
+            self.main_user_item_matrix = pd.read_parquet(self.path("main_user_item_matrix.parquet"))
 
-end = time.time()
-print(f"Finished loading parquets in {(end - start):.1f} seconds!")
+            end = time.time()
+            logger.info("Finished loading parquets in %.1f seconds!", end - start)
+            self.loaded = True
+
+    def __getattr__(self, name):
+        # only called for attributes that aren't set yet
+        if name.startswith('_') or self.__dict__.get('loaded', True):
+            raise AttributeError(name)
+        self.load()
+        return getattr(self, name)
+
+data = RecommenderData()
 
 """ Functions """
 def get_expert_user_item_matrix(user_item_matrix, experts):
@@ -42,19 +79,33 @@ def get_expert_user_item_matrix(user_item_matrix, experts):
 
     return expert_user_item_matrix
 
+def get_weighted_expert_ratings(top_n_reviewers, expert_user_item_matrix):
+    """ Weighted rating stats from the experts for every book in one call
+    
+    Weights are the experts' amount of say (score_normed); zeros are "not read".
+    Accepts a dense DataFrame or a SparseUserItemMatrix.
+
+    Schema
+    ---------------------------------------------------
+    title  | weighted_rating   count   weighted_count   weighted_sum
+    ---------------------------------------------------
+    """
+    if isinstance(expert_user_item_matrix, pd.DataFrame):
+        expert_user_item_matrix = SparseUserItemMatrix.from_dataframe(expert_user_item_matrix)
+
+    amount_of_say = top_n_reviewers['score_normed'].reindex(expert_user_item_matrix.users).fillna(0)
+    return expert_user_item_matrix.weighted_book_rating_stats(amount_of_say.to_numpy())
+
 def get_expert_ratings(expert_user_item_matrix, top_n_reviewers):
     """ sum(amount of say * rating) for everyone who rated the book for each book
     
     The more people who interacted...the more the score will be affected
     E.g. 10 people who rated positive > 5 people who rated positive
     """
-    amount_of_say = top_n_reviewers['score_normed']
+    book_stats = get_weighted_expert_ratings(top_n_reviewers, expert_user_item_matrix)
 
-    expert_ratings = expert_user_item_matrix.T.dot(amount_of_say)
-    expert_ratings= pd.DataFrame(expert_ratings)
-    
+    expert_ratings = book_stats[['weighted_sum']]
     expert_ratings.columns = ['expert_metric']
-    expert_ratings = expert_ratings.drop_duplicates()
     expert_ratings = expert_ratings.sort_values(by = 'expert_metric', ascending = False)
 
     return expert_ratings
@@ -67,15 +118,15 @@ def ratings_of_those_who_read(book_name, top_n_reviewers, expert_user_item_matri
     amount_of_say = top_n_reviewers['score_normed']
     
     wavgs = pd.DataFrame(amount_of_say)
-    wavgs['book_rating'] = [lookup_rating(expert_user_item_matrix, u, book_name) for u in experts]
+    wavgs['book_rating'] = expert_user_item_matrix[book_name].reindex(experts).fillna(0).to_numpy()
     wavgs = wavgs[wavgs.book_rating != 0]
 
     return wavgs
 
 def avg_expert_rating(book_name, top_n_reviewers, expert_user_item_matrix):
-    amount_of_say = top_n_reviewers['score_normed']
-    experts = top_n_reviewers.index
-    
+    """ Weighted average rating and count for one book
+        (use get_weighted_expert_ratings to score all books at once)
+    """
     wavgs = ratings_of_those_who_read(book_name, top_n_reviewers, expert_user_item_matrix)
     res = np.dot(wavgs['score_normed'], wavgs['book_rating'])/np.sum(wavgs['score_normed'])
     
@@ -106,13 +157,12 @@ def label_reviews_with_genre(all_reviews, genre_labels):
     return all_labeled_reviews
 
 def user_read_counts_for_genre(my_genre, user_genre_counts, user_genre_pct):
-    genre_review_count_ranked = user_genre_counts.loc[my_genre, :].sort_values(ascending = False)
-    genre_pct_of_reviews_ranked = user_genre_pct.loc[my_genre, :].sort_values(ascending = False)
-
-    res = pd.DataFrame({"review_count": genre_review_count_ranked, "review_pct": genre_pct_of_reviews_ranked})
+    """ review_count and review_pct of every user for one genre (in user order, not ranked) """
+    res = pd.DataFrame({"review_count": user_genre_counts.loc[my_genre, :],
+                        "review_pct": user_genre_pct.loc[my_genre, :]})
     return res
 
-def get_genre_ranker(my_genre, user_genre_counts, user_genre_pct, alpha = 1, allowed = main_user_item_matrix.index):
+def get_genre_ranker(my_genre, user_genre_counts, user_genre_pct, alpha = 1, allowed = None, k = None):
     """ Ranks all reviewers for a genre in a df
 
     Schema
@@ -123,35 +173,44 @@ def get_genre_ranker(my_genre, user_genre_counts, user_genre_pct, alpha = 1, all
     review_count: How many books have they reviewed from this genre?
     review_pct: What % of the books they've reviewed are from this genre?
     score: Weighted combination of count and pct (count * pct ** alpha) 
-    
+
+    Only the top k reviewers are returned (and sorted) if k is given.
     """
     
     user_read_counts = user_read_counts_for_genre(my_genre, user_genre_counts, user_genre_pct)
     user_read_counts['score'] = get_score(user_read_counts['review_count'], user_read_counts['review_pct'], alpha = alpha)
 
     user_read_counts = user_read_counts[user_read_counts.review_count > 0]
-    user_read_counts = user_read_counts.sort_values(by = 'score', ascending = False)
 
+    if allowed is None:
+        allowed = data.main_user_item_matrix.index
     user_read_counts = user_read_counts[user_read_counts.index.isin(allowed)]
+    user_read_counts = top_k_rows(user_read_counts, 'score', k)
     
     return user_read_counts
 
 def get_top_n_reviewers(ranker, n):
     n = min(n, len(ranker))
-    print("n", n)
+    logger.debug("top %d reviewers of %d", n, len(ranker))
     top_n = ranker.head(n)
     top_n['score_normed'] = top_n['score']/np.sum(top_n['score'])
 
     return top_n
 
-def get_user_genre_counts_and_pcts(user_reviews, genre_labels = genre_labels):
+def get_user_genre_counts_and_pcts(user_reviews, genre_labels = None):
+    genre_labels = data.genre_labels if genre_labels is None else genre_labels
     this_user_reviews_labeled = label_reviews_with_genre(user_reviews, genre_labels)
     this_user_genre_counts, this_user_genre_pct = get_user_genre_counts(this_user_reviews_labeled)
 
     return this_user_genre_counts, this_user_genre_pct
 
-def get_user_similarities_ranker_by_genre(this_user_genre_pct, alpha, min_similarity = 0.8, user_genre_counts = user_genre_counts, 
-                                          other_users_genre_pct = compact_user_genre_pct):
+def get_user_similarities_ranker_by_genre(this_user_genre_pct, alpha, min_similarity = 0.8, user_genre_counts = None, 
+                                          other_users_genre_pct = None, k = None):
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    user_genre_counts = data.user_genre_counts if user_genre_counts is None else user_genre_counts
+    other_users_genre_pct = data.compact_user_genre_pct if other_users_genre_pct is None else other_users_genre_pct
+
     # construct matrix
     M = other_users_genre_pct.values
     v = this_user_genre_pct.values
@@ -164,12 +223,13 @@ def get_user_similarities_ranker_by_genre(this_user_genre_pct, alpha, min_simila
     similarity_ranker['read_count'] = user_genre_counts.sum(axis = 0)
     similarity_ranker = similarity_ranker[similarity_ranker.genre_similarity >= min_similarity]
     similarity_ranker['score'] = get_score(similarity_ranker['read_count'], similarity_ranker['genre_similarity'], alpha = alpha)
-    similarity_ranker = similarity_ranker.sort_values(by = 'score', ascending = False) 
+    similarity_ranker = top_k_rows(similarity_ranker, 'score', k)
     
     return similarity_ranker
 
 
-def get_author_for_recs(recs, books_author_date = books_author_date):
+def get_author_for_recs(recs, books_author_date = None):
+    books_author_date = data.books_author_date if books_author_date is None else books_author_date
     assert recs.index.name == 'title', "Recs index must be title"
     assert books_author_date.index.name == 'title', "books/author df index must be title"
     
@@ -179,7 +239,8 @@ def get_author_for_recs(recs, books_author_date = books_author_date):
     
     return recs
 
-def recommend_books_by_user_genre_reading_pattern_similarity(user_reviews, novelty_factor, alpha = 250, genre_labels = genre_labels):
+def recommend_books_by_user_genre_reading_pattern_similarity(user_reviews, novelty_factor, alpha = 250, genre_labels = None,
+                                                             num_reviewers = 100):
     if len(user_reviews) == 0:
         return pd.DataFrame(), pd.DataFrame()
     
@@ -187,14 +248,15 @@ def recommend_books_by_user_genre_reading_pattern_similarity(user_reviews, novel
     this_user_genre_counts, this_user_genre_pct = get_user_genre_counts_and_pcts(user_reviews, genre_labels = genre_labels)
     
     """ USE THIS FOR CUSTOME GENRE PCT"""
-    genre_similarity_ranker = get_user_similarities_ranker_by_genre(this_user_genre_pct, alpha = alpha)
+    genre_similarity_ranker = get_user_similarities_ranker_by_genre(this_user_genre_pct, alpha = alpha, k = num_reviewers)
 
-    recommended_books, neighbors = get_recommendation_from_top(genre_similarity_ranker, novelty_factor)
+    recommended_books, neighbors = get_recommendation_from_top(genre_similarity_ranker, novelty_factor, num_reviewers = num_reviewers)
     recommended_books = recommended_books[~recommended_books.index.isin(user_reviews.title.values)]
     
     return recommended_books, neighbors
 
 def get_url_from_user_id(user_id):
+    users_data = data.users_data
     user_row = users_data[users_data.user_id == user_id]
     if user_row:
         url = user_row['user_url'].values[0]
@@ -222,13 +284,13 @@ def get_book_scores_from_experts(user_item_matrix, rating_emphasis):
     book_stats = book_stats.dropna(subset=["rating"])
     book_stats['score'] = get_score(book_stats['count'], book_stats['rating'], alpha = rating_emphasis)
     book_stats['score'] = min_max_scale(book_stats['score']).round(1)
-    book_stats = book_stats.sort_values(by="score", ascending=False)
+    book_stats = top_k_rows(book_stats, 'score')
     book_stats = book_stats[['score', 'rating', "count"]]
 
     return book_stats
 
 def merge_expert_with_overall(expert_rating, all_books_rating, num_reviewers):
-    merged = expert_rating.merge(all_books_ratings, left_index=True, right_on='title', how='inner')
+    merged = expert_rating.merge(data.all_books_ratings, left_index=True, right_on='title', how='inner')
     merged = merged.set_index('title')
     
     return merged
@@ -262,7 +324,9 @@ def get_bin_labels(arr, width = 0.001):
     return bin_labels
 
 
-def enrich_books_with_metadata(recommended_books, book_ratings = all_books_ratings, metadata = books_author_date):
+def enrich_books_with_metadata(recommended_books, book_ratings = None, metadata = None):
+    book_ratings = data.all_books_ratings if book_ratings is None else book_ratings
+    metadata = data.books_author_date if metadata is None else metadata
     merged = recommended_books.merge(book_ratings, left_index=True, right_on='title', how='inner')
     merged = merged.set_index('title').rename(columns = {'rating_x': 'rating', 'rating_y': 'overall_rating'})
     merged_with_book_data = pd.merge(metadata, merged, left_index = True, right_index = True, how = 'right')
@@ -281,7 +345,8 @@ def post_process_books(recommended_books, n = 50):
 
     return recommended_books.head(50).sort_values(by = 'score', ascending = False)
 
-def post_process_neighbors(neighbors, users_data = users_data):
+def post_process_neighbors(neighbors, users_data = None):
+    users_data = data.users_data if users_data is None else users_data
     user_cols = ['name','genre_similarity', 'read_count']
 
     m_neighbors = pd.merge(neighbors, users_data, left_index = True, right_on = "user_id", how = "left")
@@ -293,8 +358,9 @@ def post_process_neighbors(neighbors, users_data = users_data):
     
     return m_neighbors
 
-def get_recommendation_from_top(ranker, novelty_factor, user_item_matrix = main_user_item_matrix,
+def get_recommendation_from_top(ranker, novelty_factor, user_item_matrix = None,
                                 num_reviewers = 100, rating_emphasis = 2, min_similarity = 0.85):
+    user_item_matrix = data.main_user_item_matrix if user_item_matrix is None else user_item_matrix
     
     top_n = get_top_n_reviewers(ranker, num_reviewers)
     top_n = top_n[top_n.genre_similarity >= min_similarity]
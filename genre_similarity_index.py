@@ -0,0 +1,307 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from top_k import top_k_indices
+
+
+class GenreSimilarityIndex:
+    """ Precomputed search index over users' genre profiles
+
+    Built once from other_users_genre_pct (genres x users) and
+    user_genre_counts. Answers the same query as
+    get_user_similarities_ranker_by_genre (cosine similarity, then
+    score = read_count * similarity ** alpha) but only sorts the top k users.
+
+    Modes
+    ---------------------------------------------------
+    exact:     one float32 matrix-vector product over all users
+    balltree:  sklearn BallTree radius query (only users above min_similarity are touched)
+    quantized: int8 dot products to shortlist, exact float32 rescoring of the shortlist
+
+    upsert_user() adds or replaces one user without touching the built arrays:
+    new vectors are kept in a small pending overlay that every query also
+    scans, and compact() folds them in (rebuilding the tree / int8 copy).
+    """
+
+    modes = ("exact", "balltree", "quantized")
+
+    def __init__(self, other_users_genre_pct, user_genre_counts, mode = "exact"):
+        if mode not in self.modes:
+            raise ValueError(f"mode must be one of {self.modes}, got '{mode}'")
+
+        vectors = normalize_rows(other_users_genre_pct.to_numpy(dtype = np.float32).T)
+        read_count = user_genre_counts.sum(axis = 0).reindex(other_users_genre_pct.columns, fill_value = 0)
+
+        self.set_arrays(vectors, other_users_genre_pct.columns.to_numpy(), other_users_genre_pct.index,
+                        read_count.to_numpy(), mode)
+
+    @classmethod
+    def from_arrays(cls, vectors, users, genres, read_count, mode = "exact"):
+        """ Index over already normalized vectors (users x genres), e.g. memory-mapped """
+        if mode not in cls.modes:
+            raise ValueError(f"mode must be one of {cls.modes}, got '{mode}'")
+
+        index = cls.__new__(cls)
+        index.set_arrays(vectors, users, genres, read_count, mode)
+        return index
+
+    def set_arrays(self, vectors, users, genres, read_count, mode):
+        self.mode = mode
+        self.vectors = vectors
+        self.users = np.asarray(users)
+        self.genres = pd.Index(genres)
+        self.read_count = np.asarray(read_count)
+
+        self.tree = None
+        self.quantized = None
+        self._user_index = None
+
+        # pending overlay (see upsert_user / compact)
+        self.pending_users = []
+        self.pending_vectors = []
+        self.pending_read_count = []
+        self.pending_position = {}
+        self.replaced = set()
+
+        if mode == "balltree":
+            from sklearn.neighbors import BallTree
+            self.tree = BallTree(self.vectors.astype(np.float64))
+        elif mode == "quantized":
+            self.quantized = np.round(self.vectors * 127).astype(np.int8)
+
+    def save(self, path):
+        """ Write as a directory of .npy arrays (vectors, users, genres, read_count) """
+        self.compact()
+        os.makedirs(path, exist_ok = True)
+        arrays = {
+            'vectors': np.asarray(self.vectors, dtype = np.float32),
+            'users': self.users.astype(str),
+            'genres': self.genres.to_numpy().astype(str),
+            'read_count': self.read_count
+        }
+        for name, arr in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), arr)
+
+    @classmethod
+    def load(cls, path, mode = "exact", mmap_mode = None):
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode = mmap_mode)
+                  for name in ['vectors', 'users', 'genres', 'read_count']}
+
+        return cls.from_arrays(arrays['vectors'], arrays['users'], arrays['genres'], arrays['read_count'], mode = mode)
+
+    def __len__(self):
+        return len(self.users) - len(self.replaced) + len(self.pending_users)
+
+    @property
+    def user_index(self):
+        """ user_id -> position in the built arrays (built on first use) """
+        if self._user_index is None:
+            self._user_index = {u: i for i, u in enumerate(self.users.tolist())}
+        return self._user_index
+
+    def upsert_user(self, user_id, genre_pct, read_count):
+        """ Add a user to the index, or replace their profile, in O(genres)
+
+        genre_pct: the user's genre fractions (Series / one-column frame
+        indexed by genre, or an array in index order), read_count: their
+        number of genre-labeled reviews.
+        """
+        v = self.query_vector(genre_pct)
+
+        if user_id in self.pending_position:
+            i = self.pending_position[user_id]
+            self.pending_vectors[i] = v
+            self.pending_read_count[i] = read_count
+        else:
+            self.pending_position[user_id] = len(self.pending_users)
+            self.pending_users.append(user_id)
+            self.pending_vectors.append(v)
+            self.pending_read_count.append(read_count)
+
+        if user_id in self.user_index:
+            self.replaced.add(self.user_index[user_id])
+
+    def compact(self):
+        """ Fold pending users into the built arrays """
+        if not self.pending_users:
+            return
+
+        keep = np.ones(len(self.users), dtype = bool)
+        keep[list(self.replaced)] = False
+
+        vectors = np.vstack([np.asarray(self.vectors)[keep], np.asarray(self.pending_vectors, dtype = np.float32)])
+        users = np.concatenate([self.users[keep].astype(str), np.asarray(self.pending_users, dtype = str)])
+        read_count = np.concatenate([self.read_count[keep], np.asarray(self.pending_read_count, dtype = self.read_count.dtype)])
+
+        self.set_arrays(vectors, users, self.genres, read_count, self.mode)
+
+    def users_at(self, positions):
+        """ user ids for positions returned by top_k (pending users come after the built ones) """
+        return self.lookup(self.users, self.pending_users, positions)
+
+    def read_count_at(self, positions):
+        return self.lookup(self.read_count, self.pending_read_count, positions)
+
+    def lookup(self, built, pending, positions):
+        positions = np.asarray(positions, dtype = np.int64)
+        if not pending:
+            return built[positions]
+
+        n_built = len(built)
+        values = np.asarray(pending)[np.maximum(positions - n_built, 0)]
+        if n_built:
+            values = np.where(positions < n_built, built[np.minimum(positions, n_built - 1)], values)
+        return values
+
+    def with_pending(self, v, min_similarity, positions, similarities):
+        """ Drop replaced users from the built candidates, add pending ones """
+        if self.replaced:
+            keep = ~np.isin(positions, np.fromiter(self.replaced, dtype = np.int64))
+            positions, similarities = positions[keep], similarities[keep]
+
+        if self.pending_users:
+            pending_similarities = np.asarray(self.pending_vectors) @ v
+            pending = np.flatnonzero(pending_similarities >= min_similarity)
+            positions = np.concatenate([positions, len(self.users) + pending])
+            similarities = np.concatenate([similarities, pending_similarities[pending]])
+
+        return positions, similarities
+
+    def query_vector(self, this_user_genre_pct):
+        """ Normalized float32 query vector (aligned to the index's genres) """
+        if isinstance(this_user_genre_pct, (pd.DataFrame, pd.Series)):
+            if this_user_genre_pct.index.equals(self.genres):
+                this_user_genre_pct = this_user_genre_pct.to_numpy()
+            elif isinstance(this_user_genre_pct, pd.DataFrame):
+                this_user_genre_pct = this_user_genre_pct.iloc[:, 0].reindex(self.genres, fill_value = 0).to_numpy()
+            else:
+                this_user_genre_pct = this_user_genre_pct.reindex(self.genres, fill_value = 0).to_numpy()
+
+        v = np.asarray(this_user_genre_pct, dtype = np.float32).reshape(1, -1)
+        return normalize_rows(v)[0]
+
+    def query_matrix(self, genre_profiles):
+        """ Normalized float32 query matrix (profiles x genres)
+
+        genre_profiles is a profiles x genres DataFrame (columns are aligned to
+        the index's genres) or an array with the genres in index order.
+        """
+        if isinstance(genre_profiles, pd.DataFrame):
+            genre_profiles = genre_profiles.reindex(columns = self.genres, fill_value = 0).to_numpy()
+
+        return normalize_rows(np.asarray(genre_profiles, dtype = np.float32))
+
+    def candidates(self, v, min_similarity):
+        """ (user positions, similarities) of users with similarity >= min_similarity """
+        if self.mode == "balltree":
+            # for unit vectors |a - b|^2 = 2 - 2 cos(a, b)
+            radius = np.sqrt(max(2 - 2 * min_similarity, 0))
+            positions = self.tree.query_radius(v.reshape(1, -1).astype(np.float64), r = radius)[0]
+            similarities = self.vectors[positions] @ v
+            keep = similarities >= min_similarity
+            return positions[keep], similarities[keep]
+
+        if self.mode == "quantized":
+            # rounding to int8 moves the dot product by at most sqrt(d)/127 + d/(4*127^2)
+            qv = np.round(v * 127).astype(np.int32)
+            approx = (self.quantized.astype(np.int32) @ qv) / (127 * 127)
+            slack = np.sqrt(len(v)) / 127 + len(v) / (4 * 127 * 127)
+            positions = np.flatnonzero(approx >= min_similarity - slack)
+            similarities = self.vectors[positions] @ v
+            keep = similarities >= min_similarity
+            return positions[keep], similarities[keep]
+
+        similarities = self.vectors @ v
+        positions = np.flatnonzero(similarities >= min_similarity)
+        return positions, similarities[positions]
+
+    def top_k(self, v, alpha, min_similarity, k = None):
+        """ (user positions, similarities, scores) of the top k users, best first
+
+        v is a normalized query vector (see query_vector)
+        """
+        positions, similarities = self.candidates(v, min_similarity)
+        if self.pending_users or self.replaced:
+            positions, similarities = self.with_pending(v, min_similarity, positions, similarities)
+
+        similarities = similarities.astype(np.float64)
+        scores = self.read_count_at(positions) * similarities ** alpha
+
+        top = top_k_indices(scores, k)
+
+        return positions[top], similarities[top], scores[top]
+
+    def top_k_batch(self, Q, alpha, min_similarity, k, chunk_size = 1024):
+        """ top_k for every row of a normalized query matrix Q at once
+
+        Similarities are one (profiles x genres) @ (genres x users) product per
+        chunk of profiles. Always exact, whatever the index mode.
+
+        Returns positions, similarities, scores as (profiles x k) arrays, best
+        first. Slots past a profile's last candidate have position -1.
+        Pending users are compacted first.
+        """
+        self.compact()
+        n_profiles = len(Q)
+        k = min(k, len(self.users))
+
+        positions = np.full((n_profiles, k), -1, dtype = np.int64)
+        similarities = np.zeros((n_profiles, k))
+        scores = np.zeros((n_profiles, k))
+
+        for start in range(0, n_profiles, chunk_size):
+            block = (Q[start:start + chunk_size] @ self.vectors.T).astype(np.float64)
+            is_candidate = block >= min_similarity
+
+            block_scores = self.read_count * np.where(is_candidate, block, 0) ** alpha
+            block_scores[~is_candidate] = -np.inf
+
+            if k < block.shape[1]:
+                top = np.argpartition(-block_scores, k - 1, axis = 1)[:, :k]
+            else:
+                top = np.tile(np.arange(block.shape[1]), (len(block), 1))
+            top_scores = np.take_along_axis(block_scores, top, axis = 1)
+
+            order = np.argsort(-top_scores, axis = 1, kind = 'stable')
+            top = np.take_along_axis(top, order, axis = 1)
+            top_scores = np.take_along_axis(top_scores, order, axis = 1)
+            found = np.isfinite(top_scores)
+
+            rows = slice(start, start + len(block))
+            positions[rows] = np.where(found, top, -1)
+            similarities[rows] = np.where(found, np.take_along_axis(block, top, axis = 1), 0)
+            scores[rows] = np.where(found, top_scores, 0)
+
+        return positions, similarities, scores
+
+    def query(self, this_user_genre_pct, alpha, min_similarity, k = None):
+        """ Ranker of the top k users most similar to the query profile
+
+        Schema (same as get_user_similarities_ranker_by_genre)
+        ---------------------------------------------------
+        other_users  | genre_similarity   read_count   score
+        ---------------------------------------------------
+        """
+        v = self.query_vector(this_user_genre_pct)
+        positions, similarities, scores = self.top_k(v, alpha, min_similarity, k = k)
+
+        return self.to_ranker(positions, similarities, scores)
+
+    def to_ranker(self, positions, similarities, scores):
+        similarity_ranker = pd.DataFrame({
+            'genre_similarity': similarities,
+            'read_count': self.read_count_at(positions),
+            'score': scores
+        }, index = pd.Index(self.users_at(positions), name = 'other_users'))
+
+        return similarity_ranker
+
+
+def normalize_rows(matrix):
+    """ Scale rows to unit length (all-zero rows stay zero) """
+    norms = np.linalg.norm(matrix, axis = 1, keepdims = True)
+    norms[norms == 0] = 1
+
+    return (matrix / norms).astype(np.float32)
@@ -1,9 +1,22 @@
 from static import headers_list
 from UserScraper import *
+from goodreads_fetcher import get_fetcher
+from review_card_parser import parse_review_page_async, get_user_id_from_review_url, get_review_page_count, default_parser
+
+from instrumentation import span, count
 
-import aiohttp
 import asyncio
-import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# seconds a whole user load may take; pages that arrived by then are used
+user_deadline = 10.0
+
+# review pages per user: at most max_review_pages, default_review_pages if page 1 doesn't say
+max_review_pages = 10
+default_review_pages = 5
 
 
 
@@ -18,47 +31,30 @@ def get_review_cards_single_page(self, user_id, i):
     return None
 
 
-async def load_user_reviews_from_single_url(url, session, 
+async def load_user_reviews_from_single_url(url, fetcher = None,
                                             headers = headers_list, 
-                                            time_out = 3.5,
-                                            attempts = 3):
-    
-    start = time.time()
+                                            time_out = None,
+                                            attempts = 3,
+                                            parser = default_parser,
+                                            with_page_count = False):
+    """ Review dicts ({user_id, title_id, title, rating, votes}) from one review page
+        parser: "lxml" (fast) or "bs4" (see review_card_parser.py)
+        time_out: per attempt, None for the fetcher's adaptive timeout
+        with_page_count: return (reviews, number of review pages the user has or None)
+    """
+    fetcher = fetcher or get_fetcher()
     attempts = max(attempts, len(headers))
-    for i in range(attempts):
-        try:
-            async with session.get(url, headers = headers[i], timeout = time_out) as response:
-
-                # if i == 0:
-                #     async def fake_text():
-                #         await asyncio.sleep(10)
-                #         return "<html>should never return</html>"
-                #     response.text = fake_text  # override method
-                # last attempt can take longer
-
-                if i < attempts - 1:
-                    source = await asyncio.wait_for(response.text(), timeout=time_out)
-                else:
-                    source = await response.text()
-                
-        except asyncio.TimeoutError:
-            print(f"Timeout while loading {url} on attempt {i}")
-            continue
-
-        except Exception as e:
-            print(f"Error with URL {url} on attempt {i}: {e}")
-            continue
-
-        if len(source) > 10000:
-            end = time.time()
-            print(f"Time taken: {end - start}")
-            soup = BeautifulSoup(source, "lxml")
-            review_cards = soup.find_all('tr', class_ = 'bookalike review')
-            return review_cards
-        
-        print(f"Parsed faulty url on attempt {i}")
-
-    raise RuntimeError(f"Failed to fetch URL {url} after {attempts} attempts")
+
+    try:
+        with span("scrape.fetch_page"):
+            source = await fetcher.fetch_text(url, headers = headers, attempts = attempts, time_out = time_out)
+    except RequestFailedException as e:
+        raise RuntimeError(str(e))
+
+    reviews = await parse_review_page_async(source, get_user_id_from_review_url(url), parser = parser)
+    if with_page_count:
+        return reviews, get_review_page_count(source)
+    return reviews
 
 
 def get_user_review_page_url(user_id, i):
@@ -73,34 +69,177 @@ page = 1
 user_profile_url = get_user_profile_url(user_id)
 
 
-async def main(user_id, pages = 5):
-    urls = [get_user_review_page_url(user_id, i) for i in range(1, pages + 1)]
-    start = time.time()
-    async with aiohttp.ClientSession() as session:
-        # Schedule all fetch coroutines concurrently
-        tasks = [load_user_reviews_from_single_url(url, session) for url in urls]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+async def stream_user_reviews(user_id, pages = None, fetcher = None, deadline = user_deadline,
+                              max_pages = max_review_pages, on_page_count = None, outcome = None):
+    """ (page, review dicts) for each review page of a user, as soon as it is parsed
+        (in the order pages finish, not page order)
+
+    pages: how many pages to load (at most max_pages). None learns it from
+    page 1 ("20 of N loaded"), then fetches the remaining pages concurrently;
+    users with one page cost one request. on_page_count(n) is called once
+    the number is known.
+
+    Pages still loading after deadline seconds are cancelled and never
+    yielded; deadline = None waits for all. Failed pages are skipped (if
+    page 1 fails while discovering, nothing else is loaded).
+
+    outcome (dict, optional) is filled in with 'deadline_hit' and
+    'failed_pages', so callers can tell a complete load from a partial one.
+    """
+    fetcher = fetcher or get_fetcher()
+    tasks = {}
+    if outcome is None:
+        outcome = {}
+    outcome.update(deadline_hit = False, failed_pages = [])
+
+    def schedule(page, **kwargs):
+        url = get_user_review_page_url(user_id, page)
+        task = asyncio.ensure_future(load_user_reviews_from_single_url(url, fetcher, **kwargs))
+        tasks[task] = page
+        return task
+
+    # Schedule fetch coroutines concurrently (shared session, capped per host)
+    if pages is None:
+        first = schedule(1, with_page_count = True)
+    else:
+        first = None
+        pages = max(min(pages, max_pages), 1)
+        for page in range(1, pages + 1):
+            schedule(page)
+        if on_page_count is not None:
+            on_page_count(pages)
+    pending = set(tasks)
+
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline if deadline is not None else None
+    try:
+        while pending:
+            timeout = max(end - loop.time(), 0) if end is not None else None
+            done, pending = await asyncio.wait(pending, timeout = timeout, return_when = asyncio.FIRST_COMPLETED)
+            if not done:
+                outcome['deadline_hit'] = True
+                count("scrape.deadline_hits")
+                logger.warning("Deadline of %.1f s hit for %s: %d of %d pages loaded",
+                               deadline, user_id, len(tasks) - len(pending), len(tasks))
+                break
+
+            for task in sorted(done, key = tasks.get):
+                if task.exception() is not None:
+                    outcome['failed_pages'].append(tasks[task])
+                    logger.warning("Page %d of %s failed: %s", tasks[task], user_id, task.exception())
+                    continue
+
+                reviews = task.result()
+                if task is first:
+                    reviews, page_count = reviews
+                    pages = min(page_count or default_review_pages, max_pages)
+                    logger.debug("%s has %s review pages, loading %d", user_id, page_count, pages)
+                    pending.update(schedule(page) for page in range(2, pages + 1))
+                    if on_page_count is not None:
+                        on_page_count(pages)
+
+                yield tasks[task], reviews
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+async def main(user_id, pages = None, fetcher = None, deadline = user_deadline):
+    """ Parsed review pages of a user, in page order (partial if the deadline hits)
+        pages = None: as many as the user has (see stream_user_reviews)
+    """
+    results = [(page, reviews) async for page, reviews in stream_user_reviews(user_id, pages, fetcher, deadline)]
+
+    return [reviews for page, reviews in sorted(results, key = lambda r: r[0])]
 
-        end = time.time()
-        elapsed = end - start
+""" Next: Load the reviews into a DataFrame"""
 
-        results = [r for r in results if not isinstance(r, Exception)]
+def get_reviews_from_user_url(user_id, deadline = user_deadline):
+    results = get_fetcher().run(main(user_id, deadline = deadline))
+    user_reviews = [review for page in results for review in page if review]
 
-        return results
+    return user_reviews
 
-""" Next: Load the reviews into a DataFrame"""
 
-def get_reviews_from_user_url(user_id):
-    results = asyncio.run(main(user_id))
-    flattened = [review for page in results for review in page if review]
+class StreamingUserLoad:
+    """ stream_user_reviews running on the fetcher's loop; batches can be
+        picked up from any thread while the remaining pages load
 
-    user_profile_url = get_user_profile_url(user_id)
-    user = UserMetaData(user_profile_url, review_pages = 4)
-    user.set_review_cards(flattened)
-    user.get_reviews()
-    user_reviews = user.retrieve_reviews()
+    load = StreamingUserLoad(user_id)
+    load.wait_first()                    returns once page 1 (or any page) is parsed
+    batches = load.batches_since(seen)   review dict lists not seen yet
+    load.done()
+    load.complete                        True once every page loaded (no deadline hit, no failed page)
 
-    return user_reviews
+    With pages = None, load.pages stays None until page 1 says how many
+    pages the user has.
+    """
+
+    def __init__(self, user_id, pages = None, deadline = user_deadline, fetcher = None, max_pages = max_review_pages):
+        self.user_id = user_id
+        self.pages = pages
+        self.max_pages = max_pages
+        self.batches = []  # (page, review dicts), in arrival order
+        self.lock = threading.Lock()
+        self.first_batch = threading.Event()
+        self.complete = False
+
+        fetcher = fetcher or get_fetcher()
+        self.future = asyncio.run_coroutine_threadsafe(self.run(fetcher, deadline), fetcher.get_loop())
+
+    async def run(self, fetcher, deadline):
+        outcome = {}
+        try:
+            async for page, reviews in stream_user_reviews(self.user_id, self.pages, fetcher, deadline,
+                                                           max_pages = self.max_pages, on_page_count = self.set_pages,
+                                                           outcome = outcome):
+                with self.lock:
+                    self.batches.append((page, [review for review in reviews if review]))
+                self.first_batch.set()
+            self.complete = not outcome['deadline_hit'] and not outcome['failed_pages']
+        finally:
+            self.first_batch.set()
+
+    def set_pages(self, pages):
+        self.pages = pages
+
+    def wait_first(self, timeout = None):
+        """ Wait for the first parsed page (or the end of a load without pages) """
+        return self.first_batch.wait(timeout)
+
+    def done(self):
+        return self.future.done()
+
+    def batches_since(self, seen):
+        with self.lock:
+            return [reviews for _, reviews in self.batches[seen:]]
+
+    def pages_loaded(self):
+        with self.lock:
+            return len(self.batches)
+
+    def reviews(self):
+        """ Every review loaded so far, in page order """
+        with self.lock:
+            return [review for _, reviews in sorted(self.batches, key = lambda b: b[0]) for review in reviews]
+
+
+class UserLoads:
+    """ Streaming loads in flight by user id, so sessions loading the same
+        user share one scrape (finished loads are started again)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loads = {}
+
+    def get_or_start(self, user_id, **kwargs):
+        with self.lock:
+            self.loads = {uid: load for uid, load in self.loads.items() if not load.done()}
+            if user_id not in self.loads:
+                self.loads[user_id] = StreamingUserLoad(user_id, **kwargs)
+            return self.loads[user_id]
 
 
 
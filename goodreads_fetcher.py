@@ -0,0 +1,388 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import Counter, deque
+from urllib.parse import urlsplit
+
+from static import headers_list
+from CustomExceptions import RequestFailedException
+from single_flight import AsyncSingleFlight
+from instrumentation import observe, count
+
+logger = logging.getLogger(__name__)
+
+
+class FetchAttempt:
+    """ Timestamps (time.perf_counter) of one HTTP attempt, filled in by fetch_trace_config
+
+    phases() turns them into seconds per phase:
+        queue     waiting for the per-host semaphore
+        dns       host resolution (None if cached)
+        connect   new connection incl. DNS and TLS (None if a keep-alive connection was reused)
+        ttfb      request sent -> response headers
+        body      response headers -> body read
+        total     request sent -> done (everything but queue)
+    """
+
+    def __init__(self, url, attempt, header_index, hedge = False):
+        self.url = url
+        self.attempt = attempt
+        self.header_index = header_index  # which headers_list entry was sent
+        self.hedge = hedge                # second request sent because the first was slow
+
+        self.created = time.perf_counter()
+        self.sent = None
+        self.dns_start = None
+        self.dns_end = None
+        self.connect_start = None
+        self.connect_end = None
+        self.reused = None
+        self.headers = None
+        self.done = None
+
+        self.status = None
+        self.size = None
+        self.outcome = None  # ok, short_page, timeout, error or cancelled (lost a hedge race)
+        self.error = None
+
+    def phases(self):
+        def between(start, end):
+            return end - start if start is not None and end is not None else None
+
+        return {
+            'queue': between(self.created, self.sent),
+            'dns': between(self.dns_start, self.dns_end),
+            'connect': between(self.connect_start, self.connect_end),
+            'ttfb': between(self.sent, self.headers),
+            'body': between(self.headers, self.done),
+            'total': between(self.sent, self.done)
+        }
+
+def fetch_trace_config():
+    """ aiohttp TraceConfig that timestamps the FetchAttempt passed as trace_request_ctx """
+    import aiohttp
+
+    def mark(field):
+        async def callback(session, trace_config_ctx, params):
+            attempt = trace_config_ctx.trace_request_ctx
+            if isinstance(attempt, FetchAttempt):
+                setattr(attempt, field, time.perf_counter())
+        return callback
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(mark('sent'))
+    trace_config.on_dns_resolvehost_start.append(mark('dns_start'))
+    trace_config.on_dns_resolvehost_end.append(mark('dns_end'))
+    trace_config.on_connection_create_start.append(mark('connect_start'))
+    trace_config.on_connection_create_end.append(mark('connect_end'))
+    trace_config.on_connection_reuseconn.append(mark('reused'))
+    trace_config.on_request_end.append(mark('headers'))
+    return trace_config
+
+def percentile(sorted_values, q):
+    """ Nearest-rank q-quantile of an already sorted list (None if empty) """
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class GoodreadsFetcher:
+    """ Shared HTTP layer for Goodreads pages
+
+    - one aiohttp session with a persistent keep-alive connector
+      (TLS handshakes are reused across pages and users)
+    - at most per_host_limit requests in flight per host
+    - retries cycle through headers_list with exponential backoff + jitter
+    - concurrent requests for the same url are coalesced into one
+    - every attempt is timed (FetchAttempt): phase histograms, response
+      sizes, outcomes and the headers that worked go to the instrumentation
+      registry, and stats() summarizes the last `history` attempts
+    - timeouts adapt to recent latency: timeout_factor x the p95 of the
+      last good attempts, between min_time_out and time_out
+    - hedging: if an attempt is slower than the p90 of recent good
+      attempts, a second request (next headers) is sent; the first good
+      response wins and the other one is cancelled
+
+    Until min_samples good attempts have been seen, attempts use time_out
+    and hedge after default_hedge_delay seconds.
+
+    Async code awaits fetch_text(). Sync code (UserMetaData, streamlit
+    callbacks) uses fetch_text_sync() / run(), which run on the fetcher's own
+    event loop in a background thread so the session is shared by both.
+    """
+
+    def __init__(self, per_host_limit = 5, connection_limit = 20, keepalive_timeout = 30,
+                 time_out = 3.5, backoff_base = 0.25, backoff_max = 4.0, min_length = 10000, history = 1000,
+                 adaptive = True, min_time_out = 0.5, timeout_factor = 1.5, min_samples = 20,
+                 hedge = True, hedge_quantile = 0.9, default_hedge_delay = 1.0):
+        self.per_host_limit = per_host_limit
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.time_out = time_out
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.min_length = min_length
+
+        self.adaptive = adaptive
+        self.min_time_out = min_time_out
+        self.timeout_factor = timeout_factor
+        self.min_samples = min_samples
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.default_hedge_delay = default_hedge_delay
+
+        self.session = None
+        self.host_semaphores = {}
+        self.in_flight = AsyncSingleFlight()
+        self.attempts = deque(maxlen = history)
+
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    async def get_session(self):
+        import aiohttp
+
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit = self.connection_limit,
+                                             limit_per_host = self.per_host_limit,
+                                             keepalive_timeout = self.keepalive_timeout,
+                                             ttl_dns_cache = 300)
+            self.session = aiohttp.ClientSession(connector = connector, trace_configs = [fetch_trace_config()])
+        return self.session
+
+    def host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return self.host_semaphores[host]
+
+    def backoff_delay(self, attempt):
+        """ Full jitter: uniform(0, min(max, base * 2^attempt)) """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def fetch_text(self, url, headers = headers_list, attempts = None, time_out = None):
+        """ Page source of url
+
+        Concurrent requests for the same url share one fetch (single flight).
+        """
+        return await self.in_flight.do(url, self.fetch_text_with_retries, url,
+                                       headers = headers, attempts = attempts, time_out = time_out)
+
+    async def fetch_text_with_retries(self, url, headers = headers_list, attempts = None, time_out = None):
+        """ Fetch url, retrying with the next headers until a good response
+
+        A response counts as good if it is longer than min_length (short
+        pages are Goodreads error/captcha pages). time_out overrides the
+        adaptive timeout; the last attempt gets no body timeout. Raises
+        RequestFailedException if no attempt succeeds.
+        """
+        attempts = attempts or len(headers)
+        session = await self.get_session()
+
+        for i in range(attempts):
+            source = await self.fetch_hedged(session, url, headers, i, time_out or self.current_time_out(),
+                                             last = i == attempts - 1)
+            if source is not None:
+                return source
+
+            if i < attempts - 1:
+                await asyncio.sleep(self.backoff_delay(i))
+
+        raise RequestFailedException(f"Failed to fetch URL {url} after {attempts} attempts")
+
+    async def fetch_hedged(self, session, url, headers, i, time_out, last = False):
+        """ Attempt i, plus a hedge request with the next headers if it is slower than hedge_delay()
+            Source of the first good response, None if neither is good.
+
+        The hedge delay counts from when attempt i got past the host
+        semaphore, so attempts still queued behind per_host_limit are never
+        hedged.
+        """
+        started = asyncio.Event()
+        first = asyncio.ensure_future(self.fetch_attempt(session, url, headers, FetchAttempt(url, i, i % len(headers)),
+                                                         time_out, last, started = started))
+        pending = {first}
+        delay = self.hedge_delay()
+
+        try:
+            if delay is not None and delay < time_out:
+                waiter = asyncio.ensure_future(started.wait())
+                try:
+                    await asyncio.wait({first, waiter}, return_when = asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+
+                if not first.done():
+                    done, _ = await asyncio.wait(pending, timeout = delay)
+                    if not done:
+                        count("scrape.hedges")
+                        hedge = FetchAttempt(url, i, (i + 1) % len(headers), hedge = True)
+                        pending.add(asyncio.ensure_future(self.fetch_attempt(session, url, headers, hedge, time_out, last)))
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                for task in done:
+                    source, attempt = task.result()
+                    if source is not None:
+                        if attempt.hedge:
+                            count("scrape.hedge_wins")
+                        return source
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+    async def fetch_attempt(self, session, url, headers, attempt, time_out, last = False, started = None):
+        """ One request; (source, attempt) with source None unless the response is good
+            started (asyncio.Event) is set once the request got past the host semaphore
+        """
+        import aiohttp
+
+        timeout = aiohttp.ClientTimeout(sock_connect = time_out, sock_read = time_out)
+        try:
+            async with self.host_semaphore(url):
+                if started is not None:
+                    started.set()
+                async with session.get(url, headers = headers[attempt.header_index], timeout = timeout,
+                                       trace_request_ctx = attempt) as response:
+                    attempt.status = response.status
+                    if not last:
+                        source = await asyncio.wait_for(response.text(), timeout = time_out)
+                    else:
+                        source = await response.text()
+
+        except asyncio.CancelledError:
+            self.record_attempt(attempt, "cancelled")
+            raise
+        except asyncio.TimeoutError:
+            self.record_attempt(attempt, "timeout")
+            logger.warning("Timeout while loading %s on attempt %d (%.2f s)", url, attempt.attempt, time_out)
+        except Exception as e:
+            self.record_attempt(attempt, "error", error = e)
+            logger.warning("Error with URL %s on attempt %d: %s", url, attempt.attempt, e)
+        else:
+            attempt.size = len(source)
+            if len(source) > self.min_length:
+                self.record_attempt(attempt, "ok")
+                return source, attempt
+            self.record_attempt(attempt, "short_page")
+            logger.warning("Parsed faulty url %s on attempt %d (%d characters)", url, attempt.attempt, len(source))
+
+        return None, attempt
+
+    def latency_quantile(self, q):
+        """ q-quantile of the total time of recent good attempts (None below min_samples) """
+        totals = sorted(a.done - a.sent for a in list(self.attempts) if a.outcome == "ok" and a.sent is not None)
+        if len(totals) < self.min_samples:
+            return None
+        return percentile(totals, q)
+
+    def current_time_out(self):
+        """ Per-attempt timeout: timeout_factor x the rolling p95, between min_time_out and time_out """
+        p95 = self.latency_quantile(0.95) if self.adaptive else None
+        if p95 is None:
+            return self.time_out
+        return min(max(p95 * self.timeout_factor, self.min_time_out), self.time_out)
+
+    def hedge_delay(self):
+        """ Seconds before a slow attempt gets hedged (rolling p90), None if hedging is off """
+        if not self.hedge:
+            return None
+        p90 = self.latency_quantile(self.hedge_quantile)
+        return p90 if p90 is not None else self.default_hedge_delay
+
+    def record_attempt(self, attempt, outcome, error = None):
+        attempt.done = time.perf_counter()
+        attempt.outcome = outcome
+        attempt.error = repr(error) if error is not None else None
+        self.attempts.append(attempt)
+
+        count("scrape.attempts", outcome = outcome)
+        if outcome == "cancelled":
+            return
+        if outcome == "ok":
+            count("scrape.header_success", header = attempt.header_index)
+        for phase, seconds in attempt.phases().items():
+            if seconds is not None:
+                observe(f"scrape.{phase}", seconds)
+        if attempt.size is not None:
+            observe("scrape.response_size", attempt.size, unit = "bytes")
+
+    def stats(self):
+        """ Summary of the last `history` attempts
+
+        outcomes (ok / short_page / timeout / error / cancelled), successes
+        per headers_list index, p50/p90/p95 per phase in ms (cancelled
+        attempts left out), response sizes, connection reuse, hedging and
+        the current timeout / hedge delay in seconds.
+        """
+        attempts = list(self.attempts)
+        phases = [a.phases() for a in attempts if a.outcome != "cancelled"]
+
+        phase_ms = {}
+        for phase in ['queue', 'dns', 'connect', 'ttfb', 'body', 'total']:
+            values = sorted(p[phase] * 1000 for p in phases if p[phase] is not None)
+            phase_ms[phase] = {'count': len(values), 'p50': percentile(values, 0.5),
+                               'p90': percentile(values, 0.9), 'p95': percentile(values, 0.95)}
+
+        sizes = sorted(a.size for a in attempts if a.size is not None)
+        return {
+            'attempts': len(attempts),
+            'outcomes': dict(Counter(a.outcome for a in attempts)),
+            'header_success': dict(sorted(Counter(a.header_index for a in attempts if a.outcome == "ok").items())),
+            'phases_ms': phase_ms,
+            'response_size': {'count': len(sizes), 'min': sizes[0] if sizes else None,
+                              'p50': percentile(sizes, 0.5), 'max': sizes[-1] if sizes else None},
+            'reused_connections': sum(a.reused is not None for a in attempts),
+            'hedges': sum(a.hedge for a in attempts),
+            'hedge_wins': sum(a.hedge and a.outcome == "ok" for a in attempts),
+            'time_out': self.current_time_out(),
+            'hedge_delay': self.hedge_delay()
+        }
+
+    def get_loop(self):
+        """ The fetcher's event loop (started in a daemon thread on first use) """
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target = self.loop.run_forever,
+                                               name = "goodreads-fetcher", daemon = True)
+                self.thread.start()
+        return self.loop
+
+    def run(self, coro):
+        """ Run a coroutine on the fetcher's loop and wait for the result
+            (must not be called from a coroutine running on that loop)
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop()).result()
+
+    def fetch_text_sync(self, url, **kwargs):
+        return self.run(self.fetch_text(url, **kwargs))
+
+    def close(self):
+        if self.loop is None:
+            return
+        if self.session is not None:
+            self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop = None
+        self.session = None
+        self.host_semaphores = {}
+
+
+fetcher = None
+fetcher_lock = threading.Lock()
+
+def get_fetcher():
+    """ Process-wide GoodreadsFetcher """
+    global fetcher
+    with fetcher_lock:
+        if fetcher is None:
+            fetcher = GoodreadsFetcher()
+    return fetcher
@@ -0,0 +1,102 @@
+""" Import-time budget for the app's modules
+
+    python import_benchmark.py             check every module against its budget
+    python import_benchmark.py --top 15    also show the slowest imports per module
+    python import_benchmark.py --scale 2   allow 2x the budgets (slow machine / CI)
+
+Each module is imported in a fresh interpreter with `python -X importtime`
+(best of --repeats runs). A module fails if its cumulative import time is
+over budget, or if importing it pulls in one of the heavy dependencies that
+are only supposed to load on first use.
+"""
+
+import argparse
+import subprocess
+import sys
+
+
+# cumulative import time budget in ms, ~1.5x what was measured when pinned
+# (asyncio is ~50 ms, pandas + numpy + scipy ~500 ms of the data modules)
+budgets_ms = {
+    'static': 5,
+    'top_k': 140,
+    'instrumentation': 20,
+    'single_flight': 80,
+    'goodreads_fetcher': 85,
+    'UserScraper': 85,
+    'review_card_parser': 90,
+    'get_user_reviews': 110,
+    'book_catalog': 800,
+    'sparse_user_item_matrix': 950,
+    'genre_similarity_index': 950,
+    'main_genre_book_recommender': 950,
+    'genre_book_recommender': 1000,
+    'user_review_cache_class': 700,
+    'data_loader': 1100
+}
+
+# loaded on first use, never at import
+lazy_modules = ['streamlit', 'sklearn', 'bs4', 'aiohttp', 'lxml', 'requests']
+
+
+def parse_importtime(stderr):
+    """ {module: (self us, cumulative us)} from -X importtime output """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if name.strip() == "site":
+            # interpreter startup, finished before `import module` runs
+            times = {}
+            continue
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+def import_times(module):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output = True, text = True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+def measure(module, repeats = 5):
+    """ (best cumulative ms, lazy modules that got imported, times of the best run) """
+    best_ms, best_times = None, None
+    for _ in range(repeats):
+        times = import_times(module)
+        ms = times[module][1] / 1000
+        if best_ms is None or ms < best_ms:
+            best_ms, best_times = ms, times
+
+    eager = [m for m in lazy_modules if m in best_times]
+    return best_ms, eager, best_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Import-time budget check")
+    parser.add_argument("modules", nargs = "*", help = "modules to check (default: all with a budget)")
+    parser.add_argument("--repeats", type = int, default = 5)
+    parser.add_argument("--scale", type = float, default = 1.0, help = "multiply every budget")
+    parser.add_argument("--top", type = int, default = 0, help = "show the N slowest imports per module")
+    args = parser.parse_args()
+
+    failed = []
+    for module in args.modules or budgets_ms:
+        budget = budgets_ms.get(module, float("inf")) * args.scale
+        ms, eager, times = measure(module, repeats = args.repeats)
+
+        ok = ms <= budget and not eager
+        if not ok:
+            failed.append(module)
+        print(f"{'ok  ' if ok else 'FAIL'} {module:<30} {ms:7.1f} ms (budget {budget:.0f} ms)"
+              + (f"  eager: {', '.join(eager)}" if eager else ""))
+
+        for name, (self_us, cumulative_us) in sorted(times.items(), key = lambda x: -x[1][1])[:args.top]:
+            print(f"       {cumulative_us / 1000:7.1f} ms  {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+""" Latency spans, histograms and request traces
+
+    with span("recommend.novelty"):          time a block
+        ...
+
+    @timed("recommend.book_scores")          time every call of a function
+    def get_book_scores_from_experts(...):
+
+    with trace("recommend.request") as t:    also collect the spans of one request
+        ...
+    print(t)                                 per-stage breakdown, nested
+
+    observe("scrape.response_size", len(source), unit = "bytes")
+    count("scrape.parse_errors", method = "get_rating")
+
+Every span is observed into a histogram of the process-wide `registry`
+(one per span name), next to any other histograms and labeled counters,
+and the registry exports as JSON (registry.to_json()) or in the
+Prometheus text format (registry.to_prometheus()). set_enabled(False)
+turns spans, observe and count into no-ops.
+
+Logging: modules log through logging.getLogger(__name__) with lazy %
+arguments, so disabled levels cost one level check. configure_logging()
+sets the level of those loggers (app_loggers) from RECOMMENDER_LOG_LEVEL
+(WARNING by default); Streamlit's, aiohttp's and the root logger's levels
+are left alone.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+
+
+# seconds, like Prometheus' default buckets but finer below 10 ms
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# page sizes (Goodreads error pages are < 10 kB, review pages ~100-300 kB)
+size_buckets = (1000, 5000, 10000, 25000, 50000, 100000, 200000, 400000, 800000, 1600000)
+
+enabled = True
+
+# modules that log through logging.getLogger(__name__)
+app_loggers = ("UserScraper", "genre_book_recommender", "get_user_reviews", "goodreads_fetcher",
+               "instrumentation", "main_genre_book_recommender", "review_card_parser")
+
+logger = logging.getLogger(__name__)
+
+
+def set_enabled(value):
+    global enabled
+    enabled = bool(value)
+
+def configure_logging(level = None):
+    """ Log level for the app's modules: level, else $RECOMMENDER_LOG_LEVEL, else WARNING """
+    level = level or os.environ.get("RECOMMENDER_LOG_LEVEL", "WARNING")
+    level = level.upper() if isinstance(level, str) else level
+
+    # a handler on the root logger (if it has none yet); its level stays as it is
+    logging.basicConfig(format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+    for name in app_loggers:
+        logging.getLogger(name).setLevel(level)
+
+
+class Histogram:
+    """ Counts of observations per bucket (upper bounds, in unit), plus sum, min and max """
+
+    def __init__(self, buckets = default_buckets, unit = "seconds"):
+        self.buckets = tuple(sorted(buckets))
+        self.unit = unit
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """ Estimated q-quantile (linear within the bucket it falls in), None if empty """
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                return lower + (upper - lower) * max(rank - seen, 0) / count
+            seen += count
+        return self.max
+
+    def snapshot(self):
+        return {
+            'unit': self.unit,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts))
+        }
+
+
+class MetricsRegistry:
+    """ Histograms by name and counters by (name, labels), safe to update from several threads
+
+    A histogram's buckets and unit are fixed by its first observation.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}  # (name, ((label, value), ...)) -> count
+        self.lock = threading.Lock()
+
+    def histogram(self, name, buckets = None, unit = "seconds"):
+        with self.lock:
+            if name not in self.histograms:
+                if buckets is None:
+                    buckets = default_buckets if unit == "seconds" else size_buckets
+                self.histograms[name] = Histogram(buckets, unit)
+            return self.histograms[name]
+
+    def observe(self, name, value, buckets = None, unit = "seconds"):
+        histogram = self.histogram(name, buckets, unit)
+        with self.lock:
+            histogram.observe(value)
+
+    def inc(self, name, n = 1, labels = None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def counter(self, name, **labels):
+        """ Current value of one counter (0 if never incremented) """
+        with self.lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def counter_values(self, name):
+        """ {labels: count} of every counter called name (labels as ((label, value), ...)) """
+        with self.lock:
+            return {labels: n for (counter, labels), n in self.counters.items() if counter == name}
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'histograms': {name: h.snapshot() for name, h in sorted(self.histograms.items())},
+                'counters': {name + format_labels(labels): n for (name, labels), n in sorted(self.counters.items())}
+            }
+
+    def to_json(self, indent = 2):
+        import json
+        return json.dumps(self.snapshot(), indent = indent)
+
+    def to_prometheus(self, prefix = "recommender"):
+        """ Prometheus text exposition format: histograms as <name>_<unit>, counters as <name>_total """
+        lines = []
+        with self.lock:
+            for name, h in sorted(self.histograms.items()):
+                metric = prometheus_name(f"{prefix}_{name}_{h.unit}")
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(list(h.buckets) + ['+Inf'], h.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f"{metric}_sum {h.sum}")
+                lines.append(f"{metric}_count {h.count}")
+
+            typed = set()
+            for (name, labels), n in sorted(self.counters.items()):
+                metric = prometheus_name(f"{prefix}_{name}_total")
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{format_labels(labels)} {n}")
+        return "\n".join(lines) + "\n"
+
+def prometheus_name(name):
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+
+def format_labels(labels):
+    """ ((label, value), ...) -> {label="value",...} ('' without labels) """
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{prometheus_name(k)}="{v}"' for k, v in labels) + "}"
+
+
+registry = MetricsRegistry()
+
+
+def observe(name, value, unit = "seconds"):
+    if enabled:
+        registry.observe(name, value, unit = unit)
+
+def count(name, n = 1, **labels):
+    if enabled:
+        registry.inc(name, n, labels)
+
+
+class Trace:
+    """ Spans of one request: (name, depth, start offset, seconds) in finishing order """
+
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.depth = 0
+        self.start = time.perf_counter()
+
+    def stages(self):
+        """ {span name: total seconds} """
+        totals = {}
+        for name, _, _, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def __str__(self):
+        lines = [f"trace {self.name}"]
+        for name, depth, _, seconds in sorted(self.spans, key = lambda s: (s[2], s[1])):
+            lines.append(f"{'  ' * (depth + 1)}{name:<40} {seconds * 1000:9.2f} ms")
+        return "\n".join(lines)
+
+_current_trace = contextvars.ContextVar('trace', default = None)
+
+
+@contextlib.contextmanager
+def span(name):
+    """ Time the block into registry[name] (and the current trace, if any) """
+    if not enabled:
+        yield
+        return
+
+    trace = _current_trace.get()
+    if trace is not None:
+        depth = trace.depth
+        trace.depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe(name, seconds)
+        if trace is not None:
+            trace.depth = depth
+            trace.spans.append((name, depth, start - trace.start, seconds))
+
+def timed(name):
+    """ Decorator: every call is a span """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def trace(name):
+    """ A span that also collects the spans inside it; logs the breakdown at INFO """
+    t = Trace(name)
+    token = _current_trace.set(t)
+    try:
+        with span(name):
+            yield t
+    finally:
+        _current_trace.reset(token)
+        logger.info("%s", t)
@@ -1,9 +1,18 @@
+import contextlib
+import logging
+
 import pandas as pd
 import numpy as np
-import streamlit as st
+from scipy import sparse
 
 from static import *
 from typing import List
+from sparse_user_item_matrix import SparseUserItemMatrix
+from book_catalog import BookCatalog, book_ids_from_title_ids
+from top_k import top_k_indices, top_k_rows
+from instrumentation import span, timed
+
+logger = logging.getLogger(__name__)
 
 def get_user_genre_counts(reviews):
     
@@ -48,43 +57,51 @@ def get_url_from_user_id(user_id, users_data):
     return "user url not found..."
 
 
+@timed("recommend.top_n")
 def get_top_n_reviewers(ranker, n):
     n = min(n, len(ranker))
-    print("n", n)
+    logger.debug("top %d reviewers of %d", n, len(ranker))
     top_n = ranker.head(n)
     top_n['score_normed'] = top_n['score']/np.sum(top_n['score'])
 
     return top_n
 
 
+@timed("recommend.expert_slice")
 def get_expert_user_item_matrix(user_item_matrix, experts):
+    """ Rows of the user-item matrix for the experts (in expert order)
+    
+    Returns a SparseUserItemMatrix. A dense DataFrame is still accepted,
+    only the expert slice of it gets converted.
+    """
+    if isinstance(user_item_matrix, SparseUserItemMatrix):
+        return user_item_matrix.take_users(experts)
+
     expert_user_item_matrix =  user_item_matrix[user_item_matrix.index.isin(experts)]
-    expert_user_item_matrix = expert_user_item_matrix.loc[experts]
+    expert_user_item_matrix = expert_user_item_matrix.loc[experts[experts.isin(expert_user_item_matrix.index)]]
 
-    return expert_user_item_matrix
+    return SparseUserItemMatrix.from_dataframe(expert_user_item_matrix)
 
 
-def get_book_scores_from_experts(user_item_matrix, rating_emphasis):
+@timed("recommend.book_scores")
+def get_book_scores_from_experts(user_item_matrix, rating_emphasis, sort = True):
     """
     Given a user-item rating matrix with users as rows and book titles as columns,
     returns a DataFrame with the mean rating and number of ratings per book,
     ignoring zero entries.
-    """
-
-    masked = user_item_matrix.mask(user_item_matrix == 0)
-    
-    avg_ratings = masked.mean(axis=0)
-    rating_counts = masked.count(axis=0)
 
-    book_stats = pd.DataFrame({
-        "rating": avg_ratings,
-        "count": rating_counts
-    })
+    Works on the stored ratings of a SparseUserItemMatrix, so zeros are never
+    materialized. sort = False leaves the books in column order
+    (post_process_books only picks the top n by score anyway).
+    """
+    if isinstance(user_item_matrix, pd.DataFrame):
+        user_item_matrix = SparseUserItemMatrix.from_dataframe(user_item_matrix)
 
-    book_stats = book_stats.dropna(subset=["rating"])
+    book_stats = user_item_matrix.book_rating_stats()
     book_stats['score'] = get_score(book_stats['count'], book_stats['rating'], alpha = rating_emphasis)
     book_stats['score'] = min_max_scale(book_stats['score']).round(1)
-    book_stats = book_stats.sort_values(by="score", ascending=False)
+    if sort:
+        book_stats = top_k_rows(book_stats, 'score')
     book_stats = book_stats[['score', 'rating', "count"]]
 
     return book_stats
@@ -117,7 +134,29 @@ def get_bin_labels(arr, width = 0.001):
 
     return bin_labels
 
+def get_rank_bin_labels(arr, width = 0.001):
+    """ Same labels as get_bin_labels, from one sort instead of 900 np.quantile cuts
+
+    A value lands past quantile q exactly when q * (n - 1) < the number of
+    values below it, so each label is a searchsorted of its rank.
+    """
+    arr = np.asarray(arr)
+    quantiles = np.arange(0.1, 1.0, width)
+    if len(arr) == 0:
+        return np.array([], dtype = float)
+
+    below = np.searchsorted(np.sort(arr), arr, side = 'left')
+    bin_indices = np.searchsorted(quantiles * (len(arr) - 1), below, side = 'left')
+    bin_indices = np.clip(bin_indices, 0, len(quantiles) - 1)
+
+    return quantiles[bin_indices].round(2)
 
+def get_novelty(num_ratings):
+    """ 1 - popularity bin (rarely read books -> close to 0.9) """
+    return np.abs(1 - get_rank_bin_labels(num_ratings))
+
+
+@timed("recommend.metadata")
 def enrich_books_with_metadata(recommended_books, book_ratings, metadata):
     merged = recommended_books.merge(book_ratings, left_index=True, right_on='title', how='inner')
     merged = merged.set_index('title').rename(columns = {'rating_x': 'rating', 'rating_y': 'overall_rating'})
@@ -126,7 +165,10 @@ def enrich_books_with_metadata(recommended_books, book_ratings, metadata):
     return merged_with_book_data
 
 
+@timed("recommend.post_process")
 def post_process_books(recommended_books, n):
+    """ Top n books by expert score, ordered by adjusted score """
+    recommended_books = top_k_rows(recommended_books, 'score', n)
     recommended_books = recommended_books[['author', 'publish_date', 'adjusted_score','rating', 'count', 'novelty', 'overall_rating', 'num_ratings']] 
     recommended_books.columns = ['author', 'published', 'score','rating', 'count', 'novelty', 'goodreads rating', 'ratings']
     recommended_books['score'] = recommended_books['score'].round(1) 
@@ -134,23 +176,115 @@ def post_process_books(recommended_books, n):
     recommended_books['goodreads rating'] = recommended_books['goodreads rating'].round(1) 
     recommended_books['ratings'] = format_thousands(recommended_books['ratings'])
 
-    return recommended_books.head(n).sort_values(by = 'score', ascending = False)
+    return top_k_rows(recommended_books, 'score')
 
-def post_process_neighbors(neighbors, users_data):
-    user_cols = ['name','genre_similarity', 'read_count']
+def recommend_books_from_catalog(expert_user_item_matrix, catalog, novelty_factor, rating_emphasis,
+                                 novelty = "global", n = 50):
+    """ get_book_scores_from_experts + enrich_books_with_metadata + post_process_books
+        on catalog rows: metadata is a take by row, no merges on title
 
-    m_neighbors = pd.merge(neighbors, users_data, left_index = True, right_on = "user_id", how = "left")
-    m_neighbors['genre_similarity'] = m_neighbors['genre_similarity'].round(3) 
-    m_neighbors = m_neighbors.set_index('user_id')
-    m_neighbors = m_neighbors[user_cols]
+    Same columns as post_process_books, plus book_id. The stage spans are
+    in score_catalog_books (one per stage per request).
+    """
+    matrix = expert_user_item_matrix.matrix
+    n_titles = matrix.shape[1]
+
+    counts = np.bincount(matrix.indices, minlength = n_titles)
+    sums = np.bincount(matrix.indices, weights = matrix.data, minlength = n_titles)
+    columns = np.flatnonzero(counts)
+    counts, rating = counts[columns], sums[columns] / counts[columns]
+
+    rows = catalog.rows_for_matrix(expert_user_item_matrix)[columns]
+    order, adjusted_score, book_novelty = score_catalog_books(counts, rating, rows, catalog, novelty_factor,
+                                                              rating_emphasis, novelty = novelty, n = n)
+    rows = rows[order]
+
+    return pd.DataFrame({
+        'author': catalog.author[rows],
+        'published': catalog.publish_date[rows],
+        'score': adjusted_score,
+        'rating': rating[order].round(1),
+        'count': counts[order].astype(np.int64),
+        'novelty': book_novelty,
+        'goodreads rating': catalog.rating[rows].round(1),
+        'ratings': format_thousands(pd.Series(catalog.num_ratings[rows], dtype = np.int64)).to_numpy(),
+        'book_id': catalog.book_id[rows]
+    }, index = pd.Index(catalog.title[rows], name = 'title'))
+
+def score_catalog_books(counts, rating, rows, catalog, novelty_factor, rating_emphasis, novelty = "global", n = 50,
+                        timed_stages = True):
+    """ Top n candidate books by expert score, ordered by novelty-adjusted score
+        (shared by recommend_books_from_catalog and recommend_books_for_genre_profiles)
+
+    counts, rating: number of expert ratings and mean expert rating per candidate
+    (in book column order, so ties break the same way in both paths)
+    rows: catalog row of each candidate, -1 if it is not in the catalog
+
+    Returns (positions into the candidates, adjusted scores, novelty), best first.
+    timed_stages = False skips the per-stage spans (the batch path times all profiles at once).
+    """
+    stage = span if timed_stages else lambda name: contextlib.nullcontext()
 
-    m_neighbors.columns = ['name', 'genre similarity', 'review samples']
-    
-    return m_neighbors
+    with stage("recommend.book_scores"):
+        score = min_max_scale_array(get_score(counts, rating, alpha = rating_emphasis)).round(1)
+
+    # inner join with the catalog
+    with stage("recommend.metadata"):
+        order = np.flatnonzero(rows >= 0)
+        rows = rows[order]
+
+    with stage("recommend.novelty"):
+        if novelty == "global" and catalog.novelty is not None:
+            book_novelty = catalog.novelty[rows]
+        else:
+            book_novelty = get_novelty(catalog.num_ratings[rows])
+        adjusted_score = min_max_scale_array(get_score(score[order], book_novelty, alpha = novelty_factor)).round(1)
+
+    with stage("recommend.post_process"):
+        # top n by expert score, then by adjusted score
+        top = top_k_indices(score[order], n)
+        top = top[top_k_indices(adjusted_score[top])]
+
+    return order[top], adjusted_score[top], book_novelty[top]
+
+def user_names(users_data, user_ids):
+    """ Name of each user id (None if unknown)
+
+    users_data: DataFrame, or a bundle's {column: array} sorted by user_id
+    (looked up with a binary search, nothing is copied)
+    """
+    user_ids = np.asarray(user_ids).astype(str)
+    if isinstance(users_data, pd.DataFrame):
+        names = users_data.drop_duplicates(subset = 'user_id').set_index('user_id')['name']
+        return names.reindex(user_ids).to_numpy()
+
+    ids = users_data['user_id']
+    if len(ids) == 0:
+        return np.full(len(user_ids), None)
+    positions = np.minimum(np.searchsorted(ids, user_ids), len(ids) - 1)
+    found = ids[positions] == user_ids
+    return np.where(found, np.asarray(users_data['name'])[positions].astype(object), None)
+
+@timed("recommend.neighbors")
+def post_process_neighbors(neighbors, users_data):
+    return pd.DataFrame({
+        'name': user_names(users_data, neighbors.index),
+        'genre similarity': neighbors['genre_similarity'].round(3).to_numpy(),
+        'review samples': neighbors['read_count'].to_numpy()
+    }, index = pd.Index(neighbors.index, name = 'user_id'))
 
 def get_recommendation_from_top(ranker, novelty_factor, rating_emphasis, user_item_matrix,
                                 users_data, book_ratings, metadata,
-                                num_reviewers = 100, min_similarity = 0.8):
+                                num_reviewers = 100, min_similarity = 0.8, novelty = "global", catalog = None):
+    """ novelty: "global" uses the catalog's precomputed novelty column of
+        book_ratings (see data_loader), "candidates" bins num_ratings among
+        the recommended books only (also used if book_ratings has no novelty)
+
+        catalog: BookCatalog; if given, books are enriched by row (book_ratings
+        and metadata are not used) and the result has a book_id column
+    """
+    if novelty not in ("global", "candidates"):
+        raise ValueError(f"novelty must be 'global' or 'candidates', got '{novelty}'")
     
     top_n = get_top_n_reviewers(ranker, num_reviewers)
     top_n = top_n[top_n.genre_similarity >= min_similarity]
@@ -159,18 +293,24 @@ def get_recommendation_from_top(ranker, novelty_factor, rating_emphasis, user_it
     
     # user_item_matrix for top reviewers of this genre
     expert_user_item_matrix = get_expert_user_item_matrix(user_item_matrix, experts)
-    expert_ratings = get_book_scores_from_experts(expert_user_item_matrix, rating_emphasis)
+
+    if catalog is not None:
+        best_books = recommend_books_from_catalog(expert_user_item_matrix, catalog, novelty_factor, rating_emphasis,
+                                                  novelty = novelty)
+        return best_books, neighbors
+
+    expert_ratings = get_book_scores_from_experts(expert_user_item_matrix, rating_emphasis, sort = False)
 
     rec_books_with_metadata = enrich_books_with_metadata(expert_ratings, book_ratings, metadata)
 
+    with span("recommend.novelty"):
+        if novelty == "candidates" or 'novelty' not in rec_books_with_metadata.columns:
+            rec_books_with_metadata['novelty'] = get_novelty(rec_books_with_metadata.num_ratings.values)
+        rec_books_with_metadata['adjusted_score'] = get_score(count = rec_books_with_metadata['score'],
+                                                              pct = rec_books_with_metadata['novelty'],
+                                                              alpha = novelty_factor)
 
-    rec_books_with_metadata['novelty'] = get_bin_labels(rec_books_with_metadata.num_ratings.values)
-    rec_books_with_metadata['novelty'] = np.abs(1 - rec_books_with_metadata['novelty'])
-    rec_books_with_metadata['adjusted_score'] = get_score(count = rec_books_with_metadata['score'],
-                                                          pct = rec_books_with_metadata['novelty'],
-                                                          alpha = novelty_factor)
-    
-    rec_books_with_metadata['adjusted_score'] = min_max_scale(rec_books_with_metadata['adjusted_score'])
+        rec_books_with_metadata['adjusted_score'] = min_max_scale(rec_books_with_metadata['adjusted_score'])
 
     best_books = post_process_books(rec_books_with_metadata, n = 50)
 
@@ -187,7 +327,7 @@ def label_reviews_with_genre(all_reviews, genre_labels):
     all_labeled_reviews = all_labeled_reviews.drop_duplicates(subset=['title', 'user_id', 'rating'])
     return all_labeled_reviews
 
-@st.cache_data
+@timed("user_genre_counts")
 def get_user_genre_counts_and_pcts(user_reviews, genre_labels, max_value = None):
     if len(user_reviews) == 0:
         return pd.DataFrame(), pd.DataFrame()
@@ -197,13 +337,62 @@ def get_user_genre_counts_and_pcts(user_reviews, genre_labels, max_value = None)
 
     if max_value:
         this_user_genre_pct[this_user_genre_pct.columns[0]] = this_user_genre_pct[this_user_genre_pct.columns[0]].clip(upper = max_value)
-        print("Hellooooo")
 
-    print(this_user_genre_pct)
+    logger.debug("user genre pct (%d reviews):\n%s", len(user_reviews), this_user_genre_pct)
 
     return this_user_genre_counts, this_user_genre_pct
 
-def get_user_similarities_ranker_by_genre(this_user_genre_pct, user_genre_counts, other_users_genre_pct, alpha, min_similarity):
+
+class GenreProfileAccumulator:
+    """ get_user_genre_counts_and_pcts for one user's reviews arriving in batches (review pages)
+
+    add() labels each batch and adds its genre counts; counts_and_pcts()
+    gives the same frames get_user_genre_counts_and_pcts would for all
+    reviews added so far. Reviews seen in an earlier batch are not counted
+    twice (same (title, user_id, rating) dedup as label_reviews_with_genre).
+    """
+
+    def __init__(self, genre_labels):
+        self.genre_labels = genre_labels
+        self.counts = None
+        self.num_reviews = 0
+        self.seen = set()
+
+    def add(self, reviews):
+        """ reviews: DataFrame or list of review dicts """
+        if not isinstance(reviews, pd.DataFrame):
+            reviews = pd.DataFrame(reviews)
+        if len(reviews) == 0:
+            return
+
+        labeled = label_reviews_with_genre(reviews, self.genre_labels)
+        keys = list(zip(labeled['title'], labeled['user_id'], labeled['rating']))
+        labeled = labeled[[key not in self.seen for key in keys]]
+        self.seen.update(keys)
+        if len(labeled) == 0:
+            return
+
+        counts, _ = get_user_genre_counts(labeled)
+        self.counts = counts if self.counts is None else self.counts.add(counts, fill_value = 0)
+        self.num_reviews += labeled['title'].count()
+
+    def counts_and_pcts(self, max_value = None):
+        if self.counts is None:
+            return pd.DataFrame(), pd.DataFrame()
+
+        genre_pct = self.counts / self.num_reviews
+        if max_value:
+            genre_pct[genre_pct.columns[0]] = genre_pct[genre_pct.columns[0]].clip(upper = max_value)
+
+        return self.counts, genre_pct
+
+@timed("recommend.similarity_ranking")
+def get_user_similarities_ranker_by_genre(this_user_genre_pct, user_genre_counts, other_users_genre_pct, alpha, min_similarity,
+                                          similarity_index = None, k = None):
+    # precomputed index: only the top k users get sorted
+    if similarity_index is not None:
+        return similarity_index.query(this_user_genre_pct, alpha = alpha, min_similarity = min_similarity, k = k)
+
     # lazy loads (to save time hopefully)
     from sklearn.metrics.pairwise import cosine_similarity
     
@@ -219,7 +408,7 @@ def get_user_similarities_ranker_by_genre(this_user_genre_pct, user_genre_counts
     similarity_ranker['read_count'] = user_genre_counts.sum(axis = 0)
     similarity_ranker = similarity_ranker[similarity_ranker.genre_similarity >= min_similarity]
     similarity_ranker['score'] = get_score(similarity_ranker['read_count'], similarity_ranker['genre_similarity'], alpha = alpha)
-    similarity_ranker = similarity_ranker.sort_values(by = 'score', ascending = False) 
+    similarity_ranker = top_k_rows(similarity_ranker, 'score', k)
     
     return similarity_ranker
 
@@ -228,21 +417,169 @@ def get_user_similarities_ranker_by_genre(this_user_genre_pct, user_genre_counts
 def recommend_books_by_custom_genre_pct(custom_user_genre_pct, novelty_factor, rating_emphasis,
                                         user_genre_counts, other_users_genre_pct,
                                         user_item_matrix, users_data, book_ratings,
-                                        metadata, hide_read, user_reviews = None):
+                                        metadata, hide_read, user_reviews = None,
+                                        similarity_index = None, num_reviewers = 100, novelty = "global",
+                                        catalog = None):
 
     genre_similarity_ranker = get_user_similarities_ranker_by_genre(custom_user_genre_pct, user_genre_counts, other_users_genre_pct,
-                                                                    alpha = 250, min_similarity = 0.8)
+                                                                    alpha = 250, min_similarity = 0.8,
+                                                                    similarity_index = similarity_index, k = num_reviewers)
     
     recommended_books, neighbors = get_recommendation_from_top(genre_similarity_ranker, novelty_factor, rating_emphasis, user_item_matrix,
-                                                               users_data, book_ratings, metadata)
+                                                               users_data, book_ratings, metadata, num_reviewers = num_reviewers,
+                                                               novelty = novelty, catalog = catalog)
     
     """ (add a toggle maybe!!! up to them)"""
     if hide_read:
-        if len(user_reviews) > 0:
-            recommended_books = recommended_books[~recommended_books.index.isin(user_reviews.title.values)]
+        recommended_books = hide_read_books(recommended_books, user_reviews)
     
     return recommended_books, neighbors
 
+@timed("recommend.hide_read")
+def hide_read_books(recommended_books, user_reviews):
+    """ Drop books the user has already reviewed
+        (separate step, so cached recommendations can be shared by all users)
+
+    Matched by book id when both sides have one (book_id column / review
+    title_id), by title otherwise.
+    """
+    if user_reviews is None or len(user_reviews) == 0:
+        return recommended_books
+
+    if 'book_id' not in recommended_books.columns or 'title_id' not in user_reviews.columns:
+        return recommended_books[~recommended_books.index.isin(user_reviews.title.values)]
+
+    book_ids = recommended_books['book_id'].to_numpy()
+    read_ids = book_ids_from_title_ids(user_reviews['title_id'])
+
+    is_read = np.isin(book_ids, read_ids[read_ids >= 0])
+    is_read |= (book_ids < 0) & recommended_books.index.isin(user_reviews.title.values)
+
+    return recommended_books[~is_read]
+
+def genre_profiles_from_dicts(genre_value_dicts):
+    """ {profile name: {genre: slider value}} -> profiles x genres DataFrame
+        (e.g. profile_dicts from static.py)
+    """
+    genre_profiles = pd.DataFrame.from_dict(genre_value_dicts, orient = 'index').fillna(0)
+    return genre_profiles / 100
+
+
+def min_max_scale_array(arr, max_value = 100):
+    """ min_max_scale for a numpy array without NaNs """
+    if len(arr) == 0 or arr.min() == arr.max():
+        return np.full(len(arr), max_value / 2)
+
+    return (arr - arr.min()) / (arr.max() - arr.min()) * max_value
+
+
+@timed("recommend.batch")
+def recommend_books_for_genre_profiles(genre_profiles, novelty_factor, rating_emphasis, similarity_index,
+                                       user_item_matrix, users_data, book_ratings, metadata,
+                                       num_reviewers = 100, min_similarity = 0.8, alpha = 250, n = 50,
+                                       novelty = "global", catalog = None):
+    """ Batch version of recommend_books_by_custom_genre_pct (without hide_read)
+
+    genre_profiles: profiles x genres DataFrame (see genre_profiles_from_dicts)
+    novelty: "global" or "candidates" (see get_recommendation_from_top)
+    catalog: BookCatalog (built from book_ratings and metadata if not given)
+
+    Similarities for all profiles are one matrix product, and expert ratings
+    for all profiles are aggregated with two sparse products
+    (profiles x experts) @ (experts x books). Only cheap numpy work is left
+    per profile.
+
+    Returns (recommendations, neighbors): long frames indexed by
+    (profile, title) and (profile, user_id), with the same columns as the
+    single-profile frames. Use recommendations.loc[profile] for one profile.
+    """
+    if isinstance(genre_profiles, pd.DataFrame):
+        profile_names = genre_profiles.index.to_numpy()
+    else:
+        profile_names = np.arange(len(genre_profiles))
+
+    # users added with upsert_user join the built arrays first
+    user_item_matrix.compact()
+    similarity_index.compact()
+
+    Q = similarity_index.query_matrix(genre_profiles)
+    positions, similarities, _ = similarity_index.top_k_batch(Q, alpha, min_similarity, k = num_reviewers)
+    found = positions >= 0
+
+    # profiles x experts selection matrix (experts as rows of user_item_matrix)
+    matrix_rows = pd.Index(user_item_matrix.users).get_indexer(similarity_index.users)
+    expert_rows = np.where(found, matrix_rows[positions], -1)
+    profile_ids, slots = np.nonzero(expert_rows >= 0)
+    selection = sparse.csr_matrix((np.ones(len(profile_ids)), (profile_ids, expert_rows[profile_ids, slots])),
+                                  shape = (len(Q), len(user_item_matrix)))
+
+    ratings = user_item_matrix.matrix
+    rated = ratings.copy()
+    rated.data = np.ones_like(rated.data)
+
+    # book columns in order in every row, like the single-profile path (ties break the same way)
+    rating_sums = (selection @ ratings).tocsr()
+    rating_counts = (selection @ rated).tocsr()
+    rating_sums.sort_indices()
+    rating_counts.sort_indices()
+
+    # book columns -> catalog rows
+    if catalog is None:
+        catalog = BookCatalog.from_frames(book_ratings, metadata)
+    catalog_positions = catalog.rows_for_matrix(user_item_matrix)
+
+    rec_parts = {k: [] for k in ['profile', 'catalog', 'score', 'rating', 'count', 'novelty']}
+    # one batch-level span: per-profile stage spans would add N observations per call
+    with span("recommend.batch.scoring"):
+        for p in range(len(Q)):
+            start, end = rating_sums.indptr[p], rating_sums.indptr[p + 1]
+            cols = rating_sums.indices[start:end]
+            counts = rating_counts.data[start:end]
+            rating = rating_sums.data[start:end] / counts
+
+            rows = catalog_positions[cols]
+            if not (rows >= 0).any():
+                continue
+            order, adjusted_score, book_novelty = score_catalog_books(counts, rating, rows, catalog, novelty_factor,
+                                                                      rating_emphasis, novelty = novelty, n = n,
+                                                                      timed_stages = False)
+
+            rec_parts['profile'].append(np.full(len(order), p))
+            rec_parts['catalog'].append(rows[order])
+            rec_parts['score'].append(adjusted_score)
+            rec_parts['rating'].append(rating[order])
+            rec_parts['count'].append(counts[order])
+            rec_parts['novelty'].append(book_novelty)
+
+    rec_parts = {k: np.concatenate(v) if v else np.array([], dtype = int) for k, v in rec_parts.items()}
+    books = rec_parts['catalog']
+
+    recommendations = pd.DataFrame({
+        'author': catalog.author[books],
+        'published': catalog.publish_date[books],
+        'score': rec_parts['score'],
+        'rating': rec_parts['rating'].round(1),
+        'count': rec_parts['count'].astype(np.int64),
+        'novelty': rec_parts['novelty'],
+        'goodreads rating': catalog.rating[books].round(1),
+        'ratings': format_thousands(pd.Series(catalog.num_ratings[books])).to_numpy(),
+        'book_id': catalog.book_id[books]
+    }, index = pd.MultiIndex.from_arrays([profile_names[rec_parts['profile']], catalog.title[books]],
+                                         names = ['profile', 'title']))
+
+    # neighbors
+    neighbor_profiles, neighbor_slots = np.nonzero(found)
+    neighbor_positions = positions[neighbor_profiles, neighbor_slots]
+    neighbor_users = similarity_index.users[neighbor_positions]
+    neighbors = pd.DataFrame({
+        'name': user_names(users_data, neighbor_users),
+        'genre similarity': similarities[neighbor_profiles, neighbor_slots].round(3),
+        'review samples': similarity_index.read_count[neighbor_positions]
+    }, index = pd.MultiIndex.from_arrays([profile_names[neighbor_profiles], neighbor_users],
+                                         names = ['profile', 'user_id']))
+
+    return recommendations, neighbors
+
 def adjust_genre_values(df: pd.DataFrame, genre_list: List[str], values: List[float]) -> pd.DataFrame:
 
     if df.shape[1] != 1:
@@ -257,7 +594,7 @@ def adjust_genre_values(df: pd.DataFrame, genre_list: List[str], values: List[fl
         if genre in df.index:
             df.loc[genre, column_name] = value
         else:
-            print(f"Warning: Genre '{genre}' not found in the DataFrame index. Skipping.")
+            logger.warning("Genre '%s' not found in the DataFrame index. Skipping.", genre)
 
     return df
 
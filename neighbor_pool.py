@@ -0,0 +1,84 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from main_genre_book_recommender import label_reviews_with_genre, get_user_genre_counts
+from book_catalog import book_ids_from_title_ids
+
+
+class NeighborPool:
+    """ Adds newly scraped users to the neighbor pool without an offline rebuild
+
+    Wraps the GenreSimilarityIndex (genre profiles + read counts) and the
+    SparseUserItemMatrix (ratings) the recommender reads. upsert_user() costs
+    O(the user's reviews): both structures keep the new rows in a pending
+    overlay that queries read through. Every compact_every upserts (or on
+    compact()) the overlays are folded into the arrays.
+
+    users_data gets the new users' names on compaction (see users_frame).
+    """
+
+    def __init__(self, similarity_index, user_item_matrix, genre_labels, users_data = None,
+                 compact_every = 256, min_ratings = 1):
+        self.similarity_index = similarity_index
+        self.user_item_matrix = user_item_matrix
+        self.genre_labels = genre_labels
+        self.users_data = users_data if users_data is not None else pd.DataFrame(columns = ['user_id', 'name'])
+        self.compact_every = compact_every
+        self.min_ratings = min_ratings
+
+        self.names = {}
+        self.upserts_since_compact = 0
+        self.lock = threading.Lock()
+
+    def upsert_user(self, user_id, user_reviews, name = None):
+        """ Add (or refresh) one user from their scraped reviews
+
+        user_reviews: frame with title and rating columns (title_id to match
+        books by id), e.g. from
+        get_reviews_from_user_url. Returns False if the user has fewer than
+        min_ratings rated, genre-labeled books (they are left out).
+        """
+        labeled = label_reviews_with_genre(user_reviews.assign(user_id = user_id), self.genre_labels)
+        if (labeled['rating'] > 0).sum() < self.min_ratings:
+            return False
+
+        user_genre_counts, user_genre_pct = get_user_genre_counts(labeled)
+        read_count = user_genre_counts.to_numpy().sum()
+        book_ids = book_ids_from_title_ids(labeled['title_id']) if 'title_id' in labeled.columns else None
+
+        with self.lock:
+            self.similarity_index.upsert_user(user_id, user_genre_pct.iloc[:, 0], read_count)
+            self.user_item_matrix.upsert_user(user_id, labeled['title'].to_numpy(), labeled['rating'].to_numpy(),
+                                              book_ids = book_ids)
+            self.names[user_id] = name
+
+            self.upserts_since_compact += 1
+            if self.upserts_since_compact >= self.compact_every:
+                self.compact_locked()
+
+        return True
+
+    def compact(self):
+        with self.lock:
+            self.compact_locked()
+
+    def compact_locked(self):
+        self.similarity_index.compact()
+        self.user_item_matrix.compact()
+        self.users_data = self.users_frame()
+        self.names = {}
+        self.upserts_since_compact = 0
+
+    def users_frame(self):
+        """ users_data with the added users' names (an upsert replaces the old name) """
+        if not self.names:
+            return self.users_data
+
+        added = pd.DataFrame({'user_id': list(self.names), 'name': list(self.names.values())})
+        kept = self.users_data[~np.isin(self.users_data['user_id'].to_numpy(), added['user_id'].to_numpy())]
+        return pd.concat([kept, added], ignore_index = True)
+
+    def __len__(self):
+        return len(self.similarity_index)
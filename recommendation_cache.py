@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def recommendation_key(genre_pct, novelty_factor, rating_emphasis, genres = None, step = 0.01):
+    """ Cache key for one recommendation request
+
+    genre_pct: genres x 1 frame (or Series) of the user's genre fractions.
+    Only `genres` are used if given (e.g. the slider genres), and values are
+    rounded to multiples of step, so slider positions (whole percents) map
+    to exactly one key.
+    """
+    if isinstance(genre_pct, pd.DataFrame):
+        genre_pct = genre_pct.iloc[:, 0]
+    if genres is not None:
+        genre_pct = genre_pct.reindex(genres, fill_value = 0)
+
+    quantized = np.round(genre_pct.to_numpy(dtype = np.float64) / step).astype(np.int64)
+    vector = tuple((genre, int(q)) for genre, q in zip(genre_pct.index, quantized) if q != 0)
+
+    return (vector, float(novelty_factor), float(rating_emphasis))
+
+
+class RecommendationCache:
+    """ (recommendations, neighbors) by recommendation_key, shared across sessions
+
+    - at most max_entries results, LRU eviction
+    - entries older than ttl seconds are treated as missing
+    - everything is dropped when the data bundle version changes (invalidate)
+
+    Results are cached before hide_read filtering so every user with the
+    same sliders shares them; cached frames must not be modified in place.
+    """
+
+    def __init__(self, max_entries = 512, ttl = 6 * 3600, version = None):
+        self.cache = OrderedDict()  # key -> (value, stored_at)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = version
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def invalidate(self, version):
+        """ Drop all entries if version differs from the one they were computed on """
+        with self.lock:
+            if version == self.version:
+                return False
+
+            self.cache.clear()
+            self.version = version
+            self.invalidations += 1
+            return True
+
+    def get(self, key):
+        with self.lock:
+            if key in self.cache:
+                value, stored_at = self.cache[key]
+                if self.ttl is None or time.time() - stored_at <= self.ttl:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self.cache[key]
+                self.expirations += 1
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self.lock:
+            if key in self.cache:
+                del self.cache[key]
+
+            while len(self.cache) >= self.max_entries:
+                self.cache.popitem(last = False)
+                self.evictions += 1
+
+            self.cache[key] = (value, time.time())
+
+    def get_or_compute(self, key, fn, *args, **kwargs):
+        value = self.get(key)
+        if value is None:
+            value = fn(*args, **kwargs)
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.cache),
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
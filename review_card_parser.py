@@ -0,0 +1,250 @@
+""" Review page parsers
+
+Both engines turn the source of one review list page into the dicts
+UserMetaData.get_review_card_info produces:
+    {user_id, title_id, title, rating, votes}
+
+bs4:  full BeautifulSoup tree + UserMetaData's per-card .find() calls (original engine)
+lxml: lxml.html tree + XPath, only the review rows are looked at
+
+Parity / speed check on saved review pages:
+    python review_card_parser.py fixtures/*.html
+(test_review_card_parser.py asserts parity on fixtures/review_list_page.html)
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from UserScraper import UserMetaData, clean_title_text, get_number_from_text
+from instrumentation import registry, count
+
+logger = logging.getLogger(__name__)
+
+
+default_parser = "lxml"
+default_parse_executor = "process"
+
+card_xpath = "//tr[normalize-space(@class)='bookalike review']"
+title_xpath = ".//td[normalize-space(@class)='field title']"
+rating_xpath = ".//td[normalize-space(@class)='field rating']"
+star_xpath = ".//span[normalize-space(@class)='staticStar p10']"
+votes_xpath = ".//td[normalize-space(@class)='field votes']"
+
+# review list pages show 20 reviews and say how many there are in total
+reviews_per_page = 20
+review_count_pattern = re.compile(r'id="infiniteStatus"[^>]*>\s*[\d,]+\s+of\s+([\d,]+)\s+loaded')
+pagination_pattern = re.compile(r'id="reviewPagination"(.*?)</div>', re.S)
+page_link_pattern = re.compile(r'[?&;]page=(\d+)')
+
+
+def get_user_id_from_review_url(url):
+    """ 'https://www.goodreads.com/review/list/155041466-jamie-ren?page=1' -> '155041466-jamie-ren' """
+    match = re.search(r'/review/list/([^/?#]+)', url)
+    if match:
+        return match.group(1)
+    return url.rsplit('/', 1)[-1]
+
+
+def get_review_page_count(source, per_page = reviews_per_page):
+    """ How many review pages the user has, from the source of page 1
+        ("20 of 1,234 loaded", else the highest page in the pagination links; None if neither is there)
+    """
+    match = review_count_pattern.search(source)
+    if match:
+        total = int(match.group(1).replace(",", ""))
+        return max(-(-total // per_page), 1)
+
+    match = pagination_pattern.search(source)
+    if match:
+        return max([int(page) for page in page_link_pattern.findall(match.group(1))] + [1])
+
+    return None
+
+
+def parse_review_cards_bs4(source, user_id):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(source, "lxml")
+    review_cards = soup.find_all('tr', class_ = 'bookalike review')
+
+    user = UserMetaData(user_id)
+    return [user.get_review_card_info(review_card) for review_card in review_cards]
+
+
+def first_match(element, xpath, name):
+    matches = element.xpath(xpath)
+    if matches:
+        return matches[0]
+    raise ValueError(f"Couldn't find {name} from review card")
+
+def get_title_id_from_card(card):
+    title_html = first_match(card, title_xpath, "(td, field title)")
+    href = first_match(title_html, ".//a", "title link").get('href')
+    if href is None:
+        raise ValueError("title url from review card error: no href")
+    return href.rsplit('/', 1)[-1]
+
+def get_title_from_card(card):
+    title_html = first_match(card, title_xpath, "(td, field title)")
+    return clean_title_text(title_html.text_content())
+
+def get_rating_from_card(card):
+    rating_html = first_match(card, rating_xpath, "(td, field rating)")
+    return len(rating_html.xpath(star_xpath))
+
+def get_votes_from_card(card):
+    votes_html = first_match(card, votes_xpath, "(td, field votes)")
+    return get_number_from_text(votes_html.text_content())
+
+card_fields = [
+    (get_title_id_from_card, 'title_id'),
+    (get_title_from_card, 'title'),
+    (get_rating_from_card, 'rating'),
+    (get_votes_from_card, 'votes')
+]
+
+def parse_review_cards_lxml(source, user_id):
+    from lxml import html as lxml_html
+
+    tree = lxml_html.fromstring(source)
+
+    reviews = []
+    for card in tree.xpath(card_xpath):
+        review_card_dict = {'user_id': user_id}
+
+        # same as get_review_card_info: a failing field is skipped, not fatal
+        for method, dict_key in card_fields:
+            try:
+                review_card_dict[dict_key] = method(card)
+            except Exception as e:
+                count("scrape.parse_errors", method = method.__name__)
+                logger.warning("Error in %s for review card: %s", method.__name__, e)
+                continue
+
+        reviews.append(review_card_dict)
+
+    return reviews
+
+
+parsers = {
+    "bs4": parse_review_cards_bs4,
+    "lxml": parse_review_cards_lxml
+}
+
+def parse_review_page(source, user_id, parser = default_parser):
+    if parser not in parsers:
+        raise ValueError(f"parser must be one of {list(parsers)}, got '{parser}'")
+    return parsers[parser](source, user_id)
+
+def parse_review_page_in_worker(source, user_id, parser = default_parser):
+    """ parse_review_page plus the parse errors it counted
+        (a worker process has its own registry, the parent adds them to its own)
+    """
+    before = registry.counter_values("scrape.parse_errors")
+    reviews = parse_review_page(source, user_id, parser = parser)
+    after = registry.counter_values("scrape.parse_errors")
+
+    return reviews, {labels: n - before.get(labels, 0) for labels, n in after.items() if n > before.get(labels, 0)}
+
+
+parse_executor = None
+parse_executor_kind = None
+parse_executor_lock = threading.Lock()
+
+def set_parse_executor(kind = "process", max_workers = None):
+    """ Where review pages get parsed when loading asynchronously
+
+    kind: "process" (ProcessPoolExecutor, parsing runs in parallel and off the
+    event loop), "thread" (ThreadPoolExecutor) or "inline" (on the event loop).
+    Workers only send back plain dicts, so pickling stays cheap.
+
+    Process workers are started with forkserver (spawn where that is not
+    available), never fork: the app already runs the fetcher's loop thread
+    and Streamlit's threads, and a forked worker could inherit a lock one of
+    them holds (logging, the metrics registry) and deadlock.
+    """
+    global parse_executor, parse_executor_kind
+    if kind not in ("process", "thread", "inline"):
+        raise ValueError(f"kind must be 'process', 'thread' or 'inline', got '{kind}'")
+
+    with parse_executor_lock:
+        if parse_executor is not None:
+            parse_executor.shutdown(wait = False)
+
+        if kind == "process":
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            parse_executor = ProcessPoolExecutor(max_workers = max_workers or min(4, os.cpu_count() or 1),
+                                                 mp_context = multiprocessing.get_context(method))
+        elif kind == "thread":
+            parse_executor = ThreadPoolExecutor(max_workers = max_workers)
+        else:
+            parse_executor = None
+        parse_executor_kind = kind
+
+    return parse_executor
+
+def get_parse_executor():
+    if parse_executor_kind is None:
+        set_parse_executor(default_parse_executor)
+    return parse_executor
+
+async def parse_review_page_async(source, user_id, parser = default_parser):
+    """ parse_review_page in the parse executor, so the event loop keeps
+        downloading other pages while this one is parsed
+    """
+    executor = get_parse_executor()
+    if executor is None:
+        return parse_review_page(source, user_id, parser = parser)
+
+    loop = asyncio.get_running_loop()
+    if parse_executor_kind != "process":
+        return await loop.run_in_executor(executor, parse_review_page, source, user_id, parser)
+
+    reviews, errors = await loop.run_in_executor(executor, parse_review_page_in_worker, source, user_id, parser)
+    for labels, n in errors.items():
+        count("scrape.parse_errors", n, **dict(labels))
+    return reviews
+
+
+def check_parser_parity(paths, user_id = "fixture", repeats = 5):
+    """ Compare both engines on saved review pages
+        Returns (pages that differ, bs4 seconds, lxml seconds)
+    """
+    mismatched = []
+    timings = {name: 0.0 for name in parsers}
+
+    for path in paths:
+        with open(path, encoding = "utf-8") as f:
+            source = f.read()
+
+        results = {}
+        for name, parser in parsers.items():
+            start = time.perf_counter()
+            for _ in range(repeats):
+                results[name] = parser(source, user_id)
+            timings[name] += (time.perf_counter() - start) / repeats
+
+        if results["bs4"] != results["lxml"]:
+            mismatched.append(path)
+
+    return mismatched, timings["bs4"], timings["lxml"]
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:]
+    mismatched, bs4_time, lxml_time = check_parser_parity(paths)
+
+    print(f"{len(paths) - len(mismatched)}/{len(paths)} pages identical")
+    for path in mismatched:
+        print(f"  differs: {path}")
+    print(f"bs4 {bs4_time * 1000:.1f} ms, lxml {lxml_time * 1000:.1f} ms "
+          f"({bs4_time / max(lxml_time, 1e-9):.1f}x faster)")
+
+    sys.exit(1 if mismatched else 0)
@@ -0,0 +1,45 @@
+import asyncio
+
+
+class AsyncSingleFlight:
+    """ Coalesces concurrent calls for the same key (coroutines running on one event loop)
+
+    The first caller of do(key, coro_fn) runs it; callers that arrive with the
+    same key while it is running wait for it and get the same result (or error).
+    Nothing is cached after the call finishes.
+
+    If the caller running the call is cancelled, the callers waiting for it
+    are not: they retry and one of them runs the call again.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        future = self.calls.get(key)
+        while future is not None:
+            self.coalesced += 1
+            try:
+                # a cancelled waiter must not cancel the shared call
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # this waiter was cancelled
+            future = self.calls.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        try:
+            result = await coro_fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self.calls[key]
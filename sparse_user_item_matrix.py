@@ -0,0 +1,416 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from book_catalog import assign_book_ids, book_ids_from_title_ids
+
+
+def columns_by_book_id(titles, book_ids):
+    """ One column per book id (per title for ids < 0), in title order
+
+    Returns (column of each entry, title of each column, book id of each column).
+    Books that share a title keep separate columns; titles are for display.
+    """
+    titles = np.asarray(titles)
+    book_ids = np.asarray(book_ids, dtype = np.int64)
+
+    title_codes, _ = pd.factorize(titles, sort = True)
+    keys = np.where(book_ids >= 0, book_ids, -1 - title_codes.astype(np.int64))
+    codes, unique_keys = pd.factorize(keys, sort = True)
+
+    # title of each column: its first entry
+    first = np.empty(len(unique_keys), dtype = np.int64)
+    first[codes[::-1]] = np.arange(len(codes))[::-1]
+
+    return codes, titles[first], np.maximum(unique_keys, -1)
+
+
+class SparseUserItemMatrix:
+    """ User x book rating matrix stored as CSR (users as rows, books as columns)
+
+    Zeros mean "not rated" and are never stored, so memory and the cost of
+    every operation scale with the number of ratings instead of users x books.
+
+    Columns are keyed by Goodreads book id when book_ids is given (books
+    that share a title are separate columns, titles are for display) and by
+    title otherwise (matrices built from the title-keyed parquet file, or
+    columns whose id is unknown, book_id -1).
+
+    On disk it is a directory of plain .npy files (data, indices, indptr,
+    users, titles and optionally book_ids) which can be loaded with mmap_mode='r'.
+
+    upsert_user() adds or replaces one user's ratings in O(their ratings):
+    the row goes into a pending overlay (new books get new columns) that
+    take_users reads through, and compact() rebuilds the CSR arrays once.
+    Methods that need the whole matrix compact first.
+
+    columns_token changes whenever columns are added, and is shared by the
+    slices take_users returns, so per-column lookups (BookCatalog.rows_for_matrix)
+    can be cached per token.
+    """
+
+    array_names = ['data', 'indices', 'indptr', 'users', 'titles']
+
+    def __init__(self, matrix, users, titles, book_ids = None, columns_token = None):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.users = np.asarray(users)
+        self.titles = np.asarray(titles)
+        self.book_ids = np.asarray(book_ids, dtype = np.int64) if book_ids is not None else None
+        self.columns_token = columns_token if columns_token is not None else object()
+        self._user_index = None
+        self._column_index = None
+
+        # pending overlay (see upsert_user / compact)
+        self.pending = {}
+        self.new_titles = []
+        self.new_book_ids = []
+
+        if self.matrix.shape != (len(self.users), len(self.titles)):
+            raise ValueError(f"Matrix shape {self.matrix.shape} does not match "
+                             f"{len(self.users)} users x {len(self.titles)} titles")
+        if self.book_ids is not None and len(self.book_ids) != len(self.titles):
+            raise ValueError(f"{len(self.book_ids)} book ids for {len(self.titles)} titles")
+
+    @property
+    def shape(self):
+        self.compact()
+        return self.matrix.shape
+
+    @property
+    def nnz(self):
+        self.compact()
+        return self.matrix.nnz
+
+    @property
+    def user_index(self):
+        """ user_id -> row position (built on first use) """
+        if self._user_index is None:
+            self._user_index = {u: i for i, u in enumerate(self.users.tolist())}
+        return self._user_index
+
+    def column_key(self, title, book_id = -1):
+        """ book id if the matrix is keyed by id and the id is known, else title """
+        return int(book_id) if self.book_ids is not None and book_id >= 0 else title
+
+    @property
+    def column_index(self):
+        """ column key -> column (built on first use, includes pending columns) """
+        if self._column_index is None:
+            book_ids = self.book_ids.tolist() if self.book_ids is not None else [-1] * len(self.titles)
+            self._column_index = {self.column_key(t, b): i for i, (t, b) in enumerate(zip(self.titles.tolist(), book_ids))}
+        return self._column_index
+
+    def __len__(self):
+        new_users = sum(1 for u in self.pending if u not in self.user_index)
+        return len(self.users) + new_users
+
+    def upsert_user(self, user_id, titles, ratings, book_ids = None):
+        """ Add a user's ratings, or replace all of them
+
+        book_ids (one per title, -1 if unknown) match id-keyed columns.
+        Zero ratings are skipped, a book rated twice keeps the last rating.
+        """
+        column_index = self.column_index
+        if book_ids is None:
+            book_ids = np.full(len(titles), -1, dtype = np.int64)
+
+        row = {}
+        for title, book_id, rating in zip(titles, book_ids, ratings):
+            if rating > 0:
+                key = self.column_key(title, book_id)
+                if key not in column_index:
+                    column_index[key] = len(self.titles) + len(self.new_titles)
+                    self.new_titles.append(title)
+                    self.new_book_ids.append(int(book_id) if self.book_ids is not None else -1)
+                    self.columns_token = object()
+                row[column_index[key]] = rating
+
+        columns = np.fromiter(row.keys(), dtype = np.int64, count = len(row))
+        order = np.argsort(columns)
+        self.pending[user_id] = (columns[order], np.fromiter(row.values(), dtype = np.float32, count = len(row))[order])
+
+    def pending_rows(self, users):
+        """ CSR rows (all current titles wide) for pending users """
+        n_titles = len(self.titles) + len(self.new_titles)
+        rows = [self.pending[u] for u in users]
+        indptr = np.concatenate([[0], np.cumsum([len(columns) for columns, _ in rows])])
+        indices = np.concatenate([columns for columns, _ in rows]) if rows else np.array([], dtype = np.int64)
+        data = np.concatenate([ratings for _, ratings in rows]) if rows else np.array([], dtype = np.float32)
+
+        return sparse.csr_matrix((data, indices, indptr), shape = (len(rows), n_titles))
+
+    def widen(self, matrix):
+        """ Rows of the built matrix with columns for the pending titles added """
+        n_titles = len(self.titles) + len(self.new_titles)
+        if matrix.shape[1] == n_titles:
+            return matrix
+        return sparse.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape = (matrix.shape[0], n_titles))
+
+    def all_titles(self):
+        if not self.new_titles:
+            return self.titles
+        return np.concatenate([self.titles.astype(str), np.asarray(self.new_titles, dtype = str)])
+
+    def all_book_ids(self):
+        """ Book id of every column incl. pending ones (None if the matrix is keyed by title) """
+        if self.book_ids is None or not self.new_book_ids:
+            return self.book_ids
+        return np.concatenate([self.book_ids, np.asarray(self.new_book_ids, dtype = np.int64)])
+
+    def compact(self):
+        """ Fold pending users into the CSR arrays (O(ratings), run periodically) """
+        if not self.pending and not self.new_titles:
+            return
+
+        user_index = self.user_index
+        keep = np.ones(len(self.users), dtype = bool)
+        keep[[user_index[u] for u in self.pending if u in user_index]] = False
+
+        pending_users = list(self.pending)
+        matrix = sparse.vstack([self.widen(self.matrix[keep]), self.pending_rows(pending_users)], format = 'csr')
+        users = np.concatenate([self.users[keep].astype(str), np.asarray(pending_users, dtype = str)])
+        titles, book_ids = self.all_titles(), self.all_book_ids()
+
+        # same columns as before, so columns_token and column_index stay valid
+        self.matrix, self.users, self.titles, self.book_ids = matrix, users, titles, book_ids
+        self._user_index = None
+        self.pending = {}
+        self.new_titles = []
+        self.new_book_ids = []
+
+    @classmethod
+    def from_dataframe(cls, user_item_matrix, chunk_size = 1024):
+        """ Convert a dense users x titles DataFrame (0 = not rated)
+
+        Converted a chunk of columns at a time so the full frame is never
+        copied into one dense numpy array.
+        """
+        blocks = []
+        for start in range(0, user_item_matrix.shape[1], chunk_size):
+            chunk = user_item_matrix.iloc[:, start:start + chunk_size].to_numpy()
+            chunk = np.nan_to_num(chunk, nan = 0)
+            blocks.append(sparse.csc_matrix(chunk.astype(np.float32)))
+
+        if blocks:
+            matrix = sparse.hstack(blocks, format = 'csr')
+        else:
+            matrix = sparse.csr_matrix((len(user_item_matrix), 0), dtype = np.float32)
+
+        matrix.eliminate_zeros()
+        return cls(matrix, user_item_matrix.index.astype(str), user_item_matrix.columns.astype(str))
+
+    @classmethod
+    def from_reviews(cls, reviews, user_col = 'user_id', title_col = 'title', rating_col = 'rating',
+                     title_id_col = None):
+        """ Build directly from a long reviews frame (one row per rating)
+
+        title_id_col (e.g. 'title_id'): key the columns by the Goodreads book
+        id in it (see columns_by_book_id) instead of by title.
+        Duplicate (user, book) pairs keep the last rating.
+        """
+        reviews = reviews[reviews[rating_col] > 0]
+        titles = reviews[title_col].to_numpy().astype(str)
+        if title_id_col is not None:
+            book_ids = book_ids_from_title_ids(reviews[title_id_col])
+        else:
+            book_ids = np.full(len(reviews), -1, dtype = np.int64)
+        columns, column_titles, column_book_ids = columns_by_book_id(titles, book_ids)
+
+        keep = ~pd.DataFrame({'user': reviews[user_col].to_numpy(), 'column': columns}).duplicated(keep = 'last').to_numpy()
+        user_codes, users = pd.factorize(reviews[user_col].to_numpy()[keep], sort = True)
+        ratings = reviews[rating_col].to_numpy(dtype = np.float32)[keep]
+
+        matrix = sparse.csr_matrix((ratings, (user_codes, columns[keep])),
+                                   shape = (len(users), len(column_titles)))
+        matrix.sum_duplicates()
+        return cls(matrix, np.asarray(users, dtype = str), column_titles,
+                   column_book_ids if title_id_col is not None else None)
+
+    def with_book_ids(self, reviews, user_col = 'user_id', title_col = 'title', title_id_col = 'title_id'):
+        """ Same ratings with columns keyed by Goodreads book id (for title-keyed matrices)
+
+        Each rating gets the id of the book its user reviewed under that
+        title (reviews: user, title, title_id), so books that share a title
+        are split into their own columns. Ratings without such a review get
+        the title's most common id, and keep the title as key if it has none.
+        """
+        self.compact()
+        coo = self.matrix.tocoo()
+
+        lookup = pd.DataFrame({'user': reviews[user_col].to_numpy(), 'title': reviews[title_col].to_numpy(),
+                               'book_id': book_ids_from_title_ids(reviews[title_id_col])})
+        lookup = lookup[lookup.book_id >= 0].drop_duplicates(subset = ['user', 'title'], keep = 'last')
+
+        cells = pd.DataFrame({'user': self.users[coo.row], 'title': self.titles[coo.col]})
+        book_ids = cells.merge(lookup, on = ['user', 'title'], how = 'left')['book_id'].to_numpy()
+
+        title_book_ids = assign_book_ids(self.titles, pd.DataFrame({'title': reviews[title_col].to_numpy(),
+                                                                    'title_id': reviews[title_id_col].to_numpy()}))
+        book_ids = np.where(np.isnan(book_ids), title_book_ids[coo.col], book_ids).astype(np.int64)
+
+        columns, column_titles, column_book_ids = columns_by_book_id(self.titles[coo.col], book_ids)
+        matrix = sparse.csr_matrix((coo.data, (coo.row, columns)), shape = (len(self.users), len(column_titles)))
+        return SparseUserItemMatrix(matrix, self.users, column_titles, column_book_ids)
+
+    def to_dataframe(self):
+        """ Dense users x titles frame (only for small slices / debugging) """
+        self.compact()
+        return pd.DataFrame(self.matrix.toarray(), index = self.users, columns = self.titles)
+
+    def take_users(self, users):
+        """ Row slice for the given users, in the given order
+
+        Users that are not in the matrix are skipped (same as isin + loc).
+        Pending users are read from the overlay.
+        """
+        user_index = self.user_index
+        if not self.pending:
+            rows = [user_index[u] for u in users if u in user_index]
+            rows = np.asarray(rows, dtype = np.int64)
+
+            return SparseUserItemMatrix(self.matrix[rows], self.users[rows], self.titles, self.book_ids,
+                                        columns_token = self.columns_token)
+
+        users = [u for u in users if u in self.pending or u in user_index]
+        built_users = [u for u in users if u not in self.pending]
+        pending_users = [u for u in users if u in self.pending]
+
+        rows = np.asarray([user_index[u] for u in built_users], dtype = np.int64)
+        stacked = sparse.vstack([self.widen(self.matrix[rows]), self.pending_rows(pending_users)], format = 'csr')
+
+        # back to the requested order
+        position = {u: i for i, u in enumerate(built_users + pending_users)}
+        order = np.asarray([position[u] for u in users], dtype = np.int64)
+
+        return SparseUserItemMatrix(stacked[order], np.asarray(users, dtype = str), self.all_titles(),
+                                    self.all_book_ids(), columns_token = self.columns_token)
+
+    def book_rating_stats(self):
+        """ Mean rating and number of ratings per book, ignoring zeros
+
+        Only books with at least one rating are returned.
+        """
+        self.compact()
+        matrix = self.matrix
+        n_titles = matrix.shape[1]
+
+        counts = np.bincount(matrix.indices, minlength = n_titles)
+        sums = np.bincount(matrix.indices, weights = matrix.data, minlength = n_titles)
+
+        rated = np.flatnonzero(counts)
+        book_stats = pd.DataFrame({
+            "rating": sums[rated] / counts[rated],
+            "count": counts[rated].astype(np.int64)
+        }, index = pd.Index(self.titles[rated], name = 'title'))
+
+        return book_stats
+
+    def weighted_book_rating_stats(self, weights):
+        """ Weighted rating stats for every book in one pass
+
+        weights: one weight per row (e.g. the experts' score_normed)
+
+        Schema
+        ---------------------------------------------------
+        title  | weighted_rating   count   weighted_count   weighted_sum
+        ---------------------------------------------------
+
+        weighted_rating: sum(weight * rating) / sum(weight) over non-zero ratings
+        count: number of non-zero ratings
+        weighted_count: sum(weight) of the users who rated the book
+        weighted_sum: sum(weight * rating)
+
+        Only books with at least one rating are returned.
+        """
+        self.compact()
+        matrix = self.matrix
+        weights = np.asarray(weights, dtype = np.float64)
+        if len(weights) != matrix.shape[0]:
+            raise ValueError(f"Expected {matrix.shape[0]} weights, got {len(weights)}")
+
+        n_titles = matrix.shape[1]
+        row_weights = np.repeat(weights, np.diff(matrix.indptr))
+
+        counts = np.bincount(matrix.indices, minlength = n_titles)
+        weighted_counts = np.bincount(matrix.indices, weights = row_weights, minlength = n_titles)
+        weighted_sums = np.bincount(matrix.indices, weights = row_weights * matrix.data, minlength = n_titles)
+
+        rated = np.flatnonzero(counts)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            weighted_rating = weighted_sums[rated] / weighted_counts[rated]
+
+        book_stats = pd.DataFrame({
+            "weighted_rating": weighted_rating,
+            "count": counts[rated].astype(np.int64),
+            "weighted_count": weighted_counts[rated],
+            "weighted_sum": weighted_sums[rated]
+        }, index = pd.Index(self.titles[rated], name = 'title'))
+
+        return book_stats
+
+    def save(self, path):
+        """ Write as a directory of .npy arrays """
+        self.compact()
+        os.makedirs(path, exist_ok = True)
+
+        # scipy wants indices and indptr in the same dtype; matching it means
+        # a memory-mapped load is used as is instead of being copied
+        index_dtype = np.int32 if self.nnz < np.iinfo(np.int32).max else np.int64
+        arrays = {
+            'data': self.matrix.data.astype(np.int8),
+            'indices': self.matrix.indices.astype(index_dtype),
+            'indptr': self.matrix.indptr.astype(index_dtype),
+            'users': self.users.astype(str),
+            'titles': self.titles.astype(str)
+        }
+        if self.book_ids is not None:
+            arrays['book_ids'] = self.book_ids
+        for name, arr in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), arr)
+
+    @classmethod
+    def load(cls, path, mmap_mode = None):
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode = mmap_mode)
+                  for name in cls.array_names}
+
+        # matrices saved before book ids are keyed by title
+        book_ids_path = os.path.join(path, "book_ids.npy")
+        book_ids = np.load(book_ids_path, mmap_mode = mmap_mode) if os.path.exists(book_ids_path) else None
+
+        shape = (len(arrays['users']), len(arrays['titles']))
+        matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape = shape)
+
+        return cls(matrix, arrays['users'], arrays['titles'], book_ids)
+
+
+def load_user_item_matrix(path):
+    """ Load a sparse user-item matrix
+
+    Accepts either a saved matrix directory or a dense parquet file. For a
+    parquet file the converted matrix is saved next to it (same name without
+    .parquet) so the dense frame only has to be read once.
+    """
+    if os.path.isdir(path):
+        return SparseUserItemMatrix.load(path)
+
+    sparse_path = path[:-len(".parquet")] if path.endswith(".parquet") else path + "_sparse"
+    if os.path.isdir(sparse_path):
+        return SparseUserItemMatrix.load(sparse_path)
+
+    user_item_matrix = SparseUserItemMatrix.from_dataframe(pd.read_parquet(path))
+    user_item_matrix.save(sparse_path)
+
+    return user_item_matrix
+
+
+if __name__ == "__main__":
+    # python sparse_user_item_matrix.py data/smaller_user_item_matrix.parquet [out_dir]
+    parquet_path = sys.argv[1]
+    out_path = sys.argv[2] if len(sys.argv) > 2 else parquet_path[:-len(".parquet")]
+
+    matrix = SparseUserItemMatrix.from_dataframe(pd.read_parquet(parquet_path))
+    matrix.save(out_path)
+    print(f"Saved {matrix.shape[0]} users x {matrix.shape[1]} books ({matrix.nnz} ratings) to {out_path}")
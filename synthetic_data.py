@@ -0,0 +1,358 @@
+""" Synthetic recommender data at any scale, shaped like the files in data/
+
+    python synthetic_data.py --users 100000 --out data/synthetic
+    python synthetic_data.py --users 1000000 --out data/synthetic --bundle data/synthetic/artifacts
+
+Writes the files data_loader.build_bundle reads (all_books_final,
+users_data, genre_labels, all_labeled_reviews, compact_user_genre_pct
+.parquet and the user-item matrix), with the same columns and dtypes, so
+loaders and benchmarks run offline at 100k-1M users. --bundle also writes
+a ready data_loader bundle straight from memory.
+
+Distributions are taken from the real files in --data-dir when they are
+there (defaults otherwise):
+- users: rating counts etc. resampled from users_data, so reviews per
+  user are as long-tailed as the real ones (and capped by the review
+  pages a scrape loads, like UserMetaData.num_review_pages)
+- books: num_ratings, rating, star counts, page count, publish date
+  resampled from all_books_final; genres are whole rows of genre_labels,
+  which keeps real genre co-occurrence
+- reviews: each user reads mostly from 1-3 favourite genres, books are
+  picked ~ num_ratings ** popularity_exponent, and each star rating is
+  drawn from the book's own 1-5 star histogram
+
+The user-item matrix is written as a SparseUserItemMatrix directory
+(smaller_user_item_matrix/, which load_user_item_matrix reads in place of
+the dense parquet); a dense frame would not fit at this scale.
+compact_user_genre_pct.parquet has one column per user and gets very
+slow to read past ~50k users, so above --max-wide-users the same table is
+written transposed instead, as user_genre_pct.parquet (one row per user,
+in row groups), which data_loader.build_bundle reads as well.
+
+1M users (57M reviews) with --no-files --bundle takes ~2.5 min and ~5 GB;
+--review-pages 0 (one page per user) roughly thirds the reviews.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from static import genres, fiction_genres, nonfiction_genres
+
+
+star_columns = ['one_star', 'two_stars', 'three_stars', 'four_stars', 'five_stars']
+user_columns = ['num_ratings', 'avg_rating', 'num_reviews', 'is_best_reviewer', 'reviewer_rank',
+                'is_most_followed', 'follow_rank']
+
+# share of scraped reviews without stars (shelved, not rated)
+unrated_share = 0.05
+reviews_per_page = 20
+
+
+def load_distributions(data_dir = "data"):
+    """ The real tables the generator resamples from (None where a file is missing) """
+    def read(file_name, columns = None):
+        path = os.path.join(data_dir, file_name)
+        return pd.read_parquet(path, columns = columns) if os.path.exists(path) else None
+
+    books = read("all_books_final.parquet", ['publish_date', 'page_count', 'rating', 'num_ratings', 'num_reviews'] + star_columns)
+    genre_labels = read("genre_labels.parquet", genres)
+
+    return {
+        'users': read("users_data.parquet", user_columns),
+        'books': books,
+        'genre_rows': genre_labels.to_numpy(dtype = np.int32) if genre_labels is not None else None
+    }
+
+def default_users(n, rng):
+    num_ratings = np.maximum(rng.lognormal(6.0, 1.1, n), 1).astype(np.int64)
+    return pd.DataFrame({
+        'num_ratings': num_ratings,
+        'avg_rating': rng.normal(3.9, 0.3, n).clip(1, 5).round(2),
+        'num_reviews': np.maximum((num_ratings * rng.uniform(0.1, 0.9, n)).astype(np.int64), 1),
+        'is_best_reviewer': False,
+        'reviewer_rank': 0,
+        'is_most_followed': False,
+        'follow_rank': 0
+    })
+
+def default_books(n, rng):
+    num_ratings = (rng.pareto(0.8, n) * 2000).astype(np.int64) + 1
+    stars = rng.dirichlet([0.4, 0.9, 3.5, 6.8, 8.4], n) * num_ratings[:, None]
+    books = pd.DataFrame(stars.round().astype(np.int64), columns = star_columns)
+    books['num_ratings'] = num_ratings
+    books['rating'] = (stars @ np.arange(1, 6) / num_ratings).round(2)
+    books['num_reviews'] = (num_ratings * 0.05).astype(np.int64)
+    books['page_count'] = rng.normal(330, 120, n).clip(20, 2000).astype(np.int64)
+    books['publish_date'] = rng.integers(1850, 2025, n).astype(str)
+    return books
+
+def default_genre_rows(n, rng):
+    rates = rng.dirichlet(np.full(len(genres), 0.6)) * 3.3
+    return (rng.random((n, len(genres))) < np.minimum(rates, 1)).astype(np.int32)
+
+
+def resample(table, n, rng):
+    return table.iloc[rng.integers(0, len(table), n)].reset_index(drop = True)
+
+def scraped_review_counts(num_ratings, review_pages):
+    """ Reviews a scrape of review_pages pages gets (pages as in UserMetaData.num_review_pages) """
+    pages = np.minimum(review_pages, num_ratings // reviews_per_page) + 1
+    return np.minimum(num_ratings, pages * reviews_per_page)
+
+def pick_weighted(cdf, n, rng):
+    """ n indices drawn with probability ~ weights (cdf = np.cumsum(weights)) """
+    return np.minimum(np.searchsorted(cdf, rng.random(n) * cdf[-1]), len(cdf) - 1)
+
+def sample_reviews(per_user, favourites, genre_matrix, popularity, taste_share, rng, block_users = 50_000):
+    """ (user rows, book columns) of every review, sorted by user then book
+
+    A review comes from one of the user's favourite genres with probability
+    taste_share (from all books otherwise), books are picked ~ popularity.
+    Users are sampled in blocks to keep the temporaries small.
+    """
+    n_users, n_books = len(per_user), len(genre_matrix)
+    all_cdf = np.cumsum(popularity)
+    genre_books = [np.flatnonzero(genre_matrix[:, g]) for g in range(genre_matrix.shape[1])]
+    genre_cdfs = [np.cumsum(popularity[books]) for books in genre_books]
+
+    user_parts, book_parts = [], []
+    for start in range(0, n_users, block_users):
+        rows = np.repeat(np.arange(start, min(start + block_users, n_users)), per_user[start:start + block_users])
+        books = pick_weighted(all_cdf, len(rows), rng)
+
+        genre = favourites[rows, rng.integers(0, 3, len(rows))]
+        from_taste = rng.random(len(rows)) < taste_share
+        for g in np.unique(genre[from_taste]):
+            if len(genre_books[g]):
+                picks = np.flatnonzero(from_taste & (genre == g))
+                books[picks] = genre_books[g][pick_weighted(genre_cdfs[g], len(picks), rng)]
+
+        pairs = np.unique(rows.astype(np.int64) * n_books + books)
+        user_parts.append((pairs // n_books).astype(np.int32))
+        book_parts.append((pairs % n_books).astype(np.int32))
+
+    return np.concatenate(user_parts), np.concatenate(book_parts)
+
+def generate(n_users, n_books = None, seed = 0, data_dir = "data", review_pages = 2,
+             popularity_exponent = 0.5, taste_share = 0.7):
+    """ Synthetic data for n_users users and n_books books (16k books per 9.5k users by default)
+
+    Returns a dict with
+        users_data, all_books, genre_labels   frames with the production schemas
+        books                                 bundle columns (book_id, title, author, publish_date,
+                                              rating, num_ratings, novelty)
+        book_ratings, metadata                what recommend_books_by_custom_genre_pct takes
+        user_genre_counts, user_genre_pct, compact_user_genre_pct
+        user_item_matrix                      SparseUserItemMatrix of ratings > 0
+        reviews                               (user rows, book columns, ratings, votes) arrays
+    """
+    from main_genre_book_recommender import get_novelty
+    from sparse_user_item_matrix import SparseUserItemMatrix
+
+    rng = np.random.default_rng(seed)
+    n_books = n_books or max(int(n_users * 16083 / 9466), 1)
+    real = load_distributions(data_dir)
+
+    # books
+    all_books = resample(real['books'], n_books, rng) if real['books'] is not None else default_books(n_books, rng)
+    genre_rows = real['genre_rows'] if real['genre_rows'] is not None else default_genre_rows(1000, rng)
+    genre_matrix = genre_rows[rng.integers(0, len(genre_rows), n_books)]
+
+    book_ids = np.arange(1000, 1000 + n_books)
+    titles = np.char.add("Synthetic Book ", np.arange(n_books).astype(str))
+    all_books.insert(0, 'title', titles)
+    all_books.insert(1, 'author', np.char.add("Author ", rng.integers(0, n_books // 3 + 1, n_books).astype(str)))
+    genre_names = np.array(genres)
+    all_books.insert(2, 'genres', [list(genre_names[row.astype(bool)]) for row in genre_matrix])
+    all_books = all_books[['title', 'author', 'genres', 'page_count', 'publish_date', 'rating', 'num_ratings',
+                           'num_reviews', 'five_stars', 'four_stars', 'three_stars', 'two_stars', 'one_star']]
+
+    genre_labels = pd.DataFrame(genre_matrix, columns = genres)
+    genre_labels.insert(0, 'title', titles)
+
+    # users
+    users_meta = resample(real['users'], n_users, rng) if real['users'] is not None else default_users(n_users, rng)
+    users = np.char.add(np.char.add(np.arange(n_users).astype(str), "-synthetic-user-"), (np.arange(n_users) % 997).astype(str))
+    users_data = pd.DataFrame({
+        'user_url': np.char.add("https://www.goodreads.com/user/show/", users),
+        'user_id': users,
+        'name': np.char.add("Synthetic User ", np.arange(n_users).astype(str))
+    })
+    users_data = pd.concat([users_data, users_meta[user_columns]], axis = 1)
+
+    # reviews: most from the user's 1-3 favourite genres (unused slots repeat the first), the rest from everything
+    per_user = scraped_review_counts(users_meta['num_ratings'].to_numpy(), review_pages)
+    popularity = all_books['num_ratings'].to_numpy(dtype = np.float64) ** popularity_exponent
+    genre_share = genre_matrix.sum(axis = 0) / genre_matrix.sum()
+
+    favourites = pick_weighted(np.cumsum(genre_share), n_users * 3, rng).reshape(n_users, 3).astype(np.int8)
+    favourites = np.where(np.arange(3) < rng.integers(1, 4, n_users)[:, None], favourites, favourites[:, [0]])
+
+    user_rows, book_cols = sample_reviews(per_user, favourites, genre_matrix, popularity, taste_share, rng)
+
+    # stars from each book's own histogram, some reviews unrated
+    star_counts = all_books[star_columns].to_numpy(dtype = np.float64) + 1e-9
+    star_cdf = np.cumsum(star_counts / star_counts.sum(axis = 1, keepdims = True), axis = 1)
+    ratings = np.zeros(len(user_rows), dtype = np.int8)
+    for start in range(0, len(user_rows), 1_000_000):
+        chunk = book_cols[start:start + 1_000_000]
+        u = rng.random(len(chunk))
+        ratings[start:start + 1_000_000] = np.minimum((star_cdf[chunk] < u[:, None]).sum(axis = 1) + 1, 5)
+    ratings[rng.random(len(ratings)) < unrated_share] = 0
+    votes = np.minimum(rng.pareto(1.2, len(ratings)) * 3, 1e6).astype(np.int32)
+
+    # derived tables (reviews are sorted by user, so the CSR arrays are the review arrays)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(user_rows, minlength = n_users))])
+    reviewed = sparse.csr_matrix((np.ones(len(book_cols), dtype = np.int32), book_cols, indptr), shape = (n_users, n_books))
+    counts = np.asarray((reviewed @ sparse.csr_matrix(genre_matrix)).todense(), dtype = np.int64)
+    num_reviews = np.maximum(np.diff(indptr), 1)
+    del reviewed
+
+    user_genre_counts = pd.DataFrame(counts.T, index = genres, columns = users)
+    user_genre_pct = user_genre_counts.div(num_reviews, axis = 1)
+
+    rated = ratings > 0
+    rated_indptr = np.concatenate([[0], np.cumsum(np.bincount(user_rows[rated], minlength = n_users))])
+    user_item_matrix = SparseUserItemMatrix(
+        sparse.csr_matrix((ratings[rated], book_cols[rated], rated_indptr), shape = (n_users, n_books)),
+        users, titles, book_ids)
+
+    books = all_books[['title', 'author', 'publish_date', 'rating', 'num_ratings']].copy()
+    books.insert(0, 'book_id', book_ids)
+    books['novelty'] = get_novelty(books['num_ratings'])
+
+    return {
+        'users_data': users_data,
+        'all_books': all_books,
+        'genre_labels': genre_labels,
+        'books': books,
+        'book_ratings': books[['title', 'rating', 'num_ratings', 'novelty']],
+        'metadata': books[['title', 'author', 'publish_date']].set_index('title'),
+        'user_genre_counts': user_genre_counts,
+        'user_genre_pct': user_genre_pct,
+        'compact_user_genre_pct': user_genre_pct.loc[fiction_genres + nonfiction_genres],
+        'user_item_matrix': user_item_matrix,
+        'reviews': (user_rows, book_cols, ratings, votes)
+    }
+
+
+def labeled_reviews(data, users = None):
+    """ all_labeled_reviews rows (user_id, title_id, title, rating, votes + genre columns)
+        for some user rows (all users if None)
+    """
+    user_rows, book_cols, ratings, votes = data['reviews']
+    if users is not None:
+        keep = np.isin(user_rows, users)
+        user_rows, book_cols, ratings, votes = user_rows[keep], book_cols[keep], ratings[keep], votes[keep]
+
+    titles = data['books']['title'].to_numpy()
+    title_ids = np.char.add(np.char.add(data['books']['book_id'].to_numpy().astype(str), "."),
+                            np.char.replace(titles.astype(str), " ", "_"))
+
+    labeled = data['genre_labels'].iloc[book_cols, 1:].reset_index(drop = True)
+    labeled.insert(0, 'user_id', data['users_data']['user_id'].to_numpy()[user_rows])
+    labeled.insert(1, 'title_id', title_ids[book_cols])
+    labeled.insert(2, 'title', titles[book_cols])
+    labeled.insert(3, 'rating', ratings.astype(np.int64))
+    labeled.insert(4, 'votes', votes.astype(np.int64))
+    return labeled
+
+def arrow_table(df, preserve_index = False):
+    """ Arrow table with text as `string`, like the production files
+        (pandas 3 would write `large_string`)
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index = preserve_index)
+    schema = pa.schema([field.with_type(pa.string()) if pa.types.is_large_string(field.type) else field
+                        for field in table.schema], metadata = table.schema.metadata)
+    return table.cast(schema)
+
+def write_files(data, out_dir, max_wide_users = 50_000, chunk_users = 5_000):
+    """ The raw files data_loader.build_bundle reads, into out_dir """
+    import pyarrow.parquet as pq
+
+    os.makedirs(out_dir, exist_ok = True)
+    path = lambda file_name: os.path.join(out_dir, file_name)
+
+    pq.write_table(arrow_table(data['all_books']), path("all_books_final.parquet"))
+    pq.write_table(arrow_table(data['users_data']), path("users_data.parquet"))
+    pq.write_table(arrow_table(data['genre_labels']), path("genre_labels.parquet"))
+
+    # reviews x genres does not fit in memory at once: one row group per chunk of users
+    n_users = len(data['users_data'])
+    with pq.ParquetWriter(path("all_labeled_reviews.parquet"), arrow_table(labeled_reviews(data, users = [0])).schema) as writer:
+        for start in range(0, n_users, chunk_users):
+            chunk = labeled_reviews(data, users = np.arange(start, min(start + chunk_users, n_users)))
+            writer.write_table(arrow_table(chunk))
+
+    # only one of the two genre pct layouts, so build_bundle can't pick up a stale one
+    wide_path, by_user_path = path("compact_user_genre_pct.parquet"), path("user_genre_pct.parquet")
+    if n_users <= max_wide_users:
+        pq.write_table(arrow_table(data['compact_user_genre_pct'], preserve_index = True), wide_path)
+        stale_path = by_user_path
+    else:
+        by_user = data['compact_user_genre_pct'].T.rename_axis('user_id')
+        with pq.ParquetWriter(by_user_path, arrow_table(by_user.iloc[:1], preserve_index = True).schema) as writer:
+            for start in range(0, n_users, chunk_users):
+                writer.write_table(arrow_table(by_user.iloc[start:start + chunk_users], preserve_index = True))
+        print(f"Wrote user_genre_pct.parquet instead of compact_user_genre_pct.parquet "
+              f"({n_users} users > max_wide_users = {max_wide_users})")
+        stale_path = wide_path
+    if os.path.exists(stale_path):
+        os.remove(stale_path)
+
+    data['user_item_matrix'].save(path("smaller_user_item_matrix"))
+
+def write_bundle(data, artifacts_dir = "data/artifacts", version = "synthetic", activate = True):
+    """ A data_loader bundle straight from generate() output; returns its version """
+    from data_loader import save_columns, save_users, save_arrow, publish_bundle, BundleError
+    from genre_similarity_index import GenreSimilarityIndex
+
+    if os.path.exists(os.path.join(artifacts_dir, version)):
+        raise BundleError(f"Bundle {version} already exists in {artifacts_dir}")
+
+    tmp_dir = os.path.join(artifacts_dir, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+
+    save_columns(data['books'], os.path.join(tmp_dir, "books"))
+    save_users(data['users_data'], os.path.join(tmp_dir, "users"))
+    save_arrow(data['genre_labels'], os.path.join(tmp_dir, "genre_labels.arrow"))
+    GenreSimilarityIndex(data['compact_user_genre_pct'], data['user_genre_counts']).save(
+        os.path.join(tmp_dir, "similarity_index"))
+    data['user_item_matrix'].save(os.path.join(tmp_dir, "user_item_matrix"))
+
+    publish_bundle(tmp_dir, artifacts_dir, version, activate, books = len(data['books']),
+                   users = len(data['users_data']), synthetic = True)
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Synthetic recommender data")
+    parser.add_argument("--users", type = int, required = True)
+    parser.add_argument("--books", type = int, default = None, help = "default: same books per user as data/")
+    parser.add_argument("--out", default = "data/synthetic", help = "directory for the parquet files")
+    parser.add_argument("--bundle", default = None, help = "also write a bundle into this artifacts directory")
+    parser.add_argument("--data-dir", default = "data", help = "real files to take the distributions from")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--review-pages", type = int, default = 2)
+    parser.add_argument("--max-wide-users", type = int, default = 50_000)
+    parser.add_argument("--no-files", action = "store_true", help = "only write the bundle")
+    args = parser.parse_args()
+
+    data = generate(args.users, args.books, seed = args.seed, data_dir = args.data_dir, review_pages = args.review_pages)
+    print(f"{len(data['users_data'])} users, {len(data['books'])} books, {len(data['reviews'][0])} reviews")
+
+    if not args.no_files:
+        write_files(data, args.out, max_wide_users = args.max_wide_users)
+        print(f"Wrote {args.out}")
+    if args.bundle:
+        print(f"Wrote bundle {write_bundle(data, args.bundle)} to {args.bundle}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+""" GoodreadsFetcher against a local aiohttp server (python -m pytest) """
+
+import asyncio
+import contextlib
+
+import pytest
+from aiohttp import web
+
+from CustomExceptions import RequestFailedException
+from goodreads_fetcher import GoodreadsFetcher
+
+
+good_page = "x" * 20000
+short_page = "captcha"
+
+
+class Server:
+    """ /page/{name}: sleeps delay seconds, then answers with the next of responses[name] (good_page by default) """
+    def __init__(self, delay = 0.0):
+        self.delay = delay
+        self.responses = {}
+        self.hits = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.url = None
+
+    async def page(self, request):
+        name = request.match_info['name']
+        self.hits[name] = self.hits.get(name, 0) + 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            responses = self.responses.get(name)
+            return web.Response(text = responses.pop(0) if responses else good_page)
+        finally:
+            self.in_flight -= 1
+
+@contextlib.asynccontextmanager
+async def serve(server):
+    app = web.Application()
+    app.router.add_get("/page/{name}", server.page)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    server.url = f"http://{host}:{port}/page"
+    try:
+        yield server
+    finally:
+        await runner.cleanup()
+
+def run(server, fetcher, coro_fn):
+    async def main():
+        async with serve(server):
+            try:
+                return await coro_fn()
+            finally:
+                if fetcher.session is not None:
+                    await fetcher.session.close()
+    return asyncio.run(main())
+
+def test_at_most_per_host_limit_requests_in_flight():
+    server = Server(delay = 0.05)
+    fetcher = GoodreadsFetcher(per_host_limit = 3, hedge = False)
+
+    sources = run(server, fetcher, lambda: asyncio.gather(*(fetcher.fetch_text(f"{server.url}/{i}") for i in range(12))))
+
+    assert sources == [good_page] * 12
+    assert server.max_in_flight == 3
+
+def test_concurrent_requests_for_one_url_are_coalesced():
+    server = Server(delay = 0.05)
+    fetcher = GoodreadsFetcher(hedge = False)
+
+    sources = run(server, fetcher, lambda: asyncio.gather(*(fetcher.fetch_text(f"{server.url}/a") for _ in range(5))))
+
+    assert sources == [good_page] * 5
+    assert server.hits == {'a': 1}
+
+def test_short_pages_are_retried_with_the_next_headers():
+    server = Server()
+    server.responses['a'] = [short_page, short_page]
+    fetcher = GoodreadsFetcher(hedge = False, backoff_base = 0.001)
+
+    assert run(server, fetcher, lambda: fetcher.fetch_text(f"{server.url}/a")) == good_page
+    assert server.hits == {'a': 3}
+
+    stats = fetcher.stats()
+    assert stats['outcomes'] == {'short_page': 2, 'ok': 1}
+    assert stats['header_success'] == {2: 1}
+
+def test_gives_up_after_attempts():
+    server = Server()
+    server.responses['a'] = [short_page] * 3
+    fetcher = GoodreadsFetcher(hedge = False, backoff_base = 0.001)
+
+    with pytest.raises(RequestFailedException):
+        run(server, fetcher, lambda: fetcher.fetch_text(f"{server.url}/a", attempts = 3))
+    assert server.hits == {'a': 3}
+
+def test_backoff_is_capped_full_jitter():
+    fetcher = GoodreadsFetcher(backoff_base = 0.25, backoff_max = 4.0)
+
+    for attempt in range(10):
+        bound = min(4.0, 0.25 * 2 ** attempt)
+        assert all(0 <= fetcher.backoff_delay(attempt) <= bound for _ in range(50))
@@ -0,0 +1,86 @@
+""" upsert_user + compact for the user-item matrix and the genre index (python -m pytest) """
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sparse_user_item_matrix import SparseUserItemMatrix
+from genre_similarity_index import GenreSimilarityIndex
+
+
+def dense(ratings):
+    """ {user: {title: rating}} -> users x titles frame (0 = not rated) """
+    return pd.DataFrame(ratings).T.fillna(0).astype(np.float32)
+
+def assert_same_ratings(matrix, expected):
+    actual = matrix.to_dataframe()
+    actual = actual.loc[sorted(actual.index), sorted(actual.columns)]
+    expected = expected.loc[sorted(expected.index), sorted(expected.columns)]
+
+    np.testing.assert_array_equal(actual.index, expected.index)
+    np.testing.assert_array_equal(actual.columns, expected.columns)
+    np.testing.assert_array_equal(actual.to_numpy(), expected.to_numpy())
+
+@pytest.fixture
+def ratings():
+    return {
+        "1-a": {"Dune": 5, "Emma": 3},
+        "2-b": {"Emma": 4, "Ulysses": 2},
+        "3-c": {"Dune": 1, "Ulysses": 5}
+    }
+
+def test_compact_equals_built_matrix_plus_overlay(ratings):
+    matrix = SparseUserItemMatrix.from_dataframe(dense(ratings))
+
+    # replace a user, add one with a new book (a new column), a book rated twice keeps the last rating
+    matrix.upsert_user("2-b", ["Dune", "Middlemarch"], [2, 4])
+    matrix.upsert_user("4-d", ["Emma", "Beloved", "Emma"], [1, 5, 2])
+    ratings["2-b"] = {"Dune": 2, "Middlemarch": 4}
+    ratings["4-d"] = {"Emma": 2, "Beloved": 5}
+
+    # reads through the overlay before compacting ...
+    overlay = matrix.take_users(list(ratings))
+    assert_same_ratings(overlay, dense(ratings))
+
+    # ... and the compacted matrix is the same
+    token = matrix.columns_token
+    matrix.compact()
+    assert not matrix.pending
+    assert matrix.columns_token is token
+    assert_same_ratings(matrix, dense(ratings))
+
+def test_upsert_only_changes_token_for_new_columns(ratings):
+    matrix = SparseUserItemMatrix.from_dataframe(dense(ratings))
+    token = matrix.columns_token
+
+    matrix.upsert_user("1-a", ["Emma"], [2])
+    assert matrix.columns_token is token
+
+    matrix.upsert_user("1-a", ["Beloved"], [2])
+    assert matrix.columns_token is not token
+
+def test_genre_index_upsert_matches_a_rebuilt_index():
+    rng = np.random.default_rng(0)
+    genres = ["Fantasy", "Horror", "Romance", "Science"]
+    users = [f"{i}-user" for i in range(50)]
+    counts = pd.DataFrame(rng.integers(0, 20, (len(genres), len(users))), index = genres, columns = users)
+    pct = counts / counts.sum(axis = 0)
+
+    index = GenreSimilarityIndex(pct.iloc[:, :40], counts.iloc[:, :40])
+    for user in users[40:] + users[:5]:  # new users, then replaced ones
+        counts[user] = rng.integers(0, 20, len(genres))
+        pct[user] = counts[user] / counts[user].sum()
+        index.upsert_user(user, pct[user], counts[user].sum())
+
+    rebuilt = GenreSimilarityIndex(pct, counts)
+    query = pct.iloc[:, [7]]
+
+    pending = index.query(query, alpha = 2, min_similarity = 0, k = 20)
+    index.compact()
+    compacted = index.query(query, alpha = 2, min_similarity = 0, k = 20)
+    expected = rebuilt.query(query, alpha = 2, min_similarity = 0, k = 20)
+
+    assert len(index) == len(users)
+    for ranker in [pending, compacted]:
+        assert list(ranker.index) == list(expected.index)
+        np.testing.assert_allclose(ranker['score'], expected['score'], rtol = 1e-5)
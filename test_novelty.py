@@ -0,0 +1,57 @@
+""" Per-book novelty: rank bins vs quantile bins, global vs candidate novelty (python -m pytest) """
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from book_catalog import BookCatalog
+from data_loader import global_novelty
+from main_genre_book_recommender import get_bin_labels, get_rank_bin_labels, recommend_books_from_catalog
+from sparse_user_item_matrix import SparseUserItemMatrix
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_rank_bins_match_quantile_bins(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 3000))
+    # num_ratings-like values with heavy ties
+    arr = rng.integers(0, rng.integers(1, 50), n) * int(rng.choice([1, 1000]))
+
+    np.testing.assert_array_equal(get_rank_bin_labels(arr), get_bin_labels(arr))
+
+@pytest.fixture
+def catalog():
+    num_ratings = np.array([10, 5_000, 200, 1_000_000, 40, 75_000])
+    books = pd.DataFrame({
+        'book_id': np.arange(1, 7),
+        'title': [f"Book {i}" for i in range(1, 7)],
+        'author': [f"Author {i}" for i in range(1, 7)],
+        'publish_date': ["2001"] * 6,
+        'rating': np.linspace(3.5, 4.5, 6),
+        'num_ratings': num_ratings,
+        'novelty': global_novelty(num_ratings)
+    })
+    return BookCatalog(books)
+
+@pytest.fixture
+def experts():
+    ratings = np.array([[5, 4, 0, 3, 0, 5],
+                        [4, 0, 0, 5, 0, 0],
+                        [0, 0, 0, 0, 0, 4]], dtype = np.float32)  # books 3 and 5 unrated
+    return SparseUserItemMatrix(ratings, ["1-a", "2-b", "3-c"], [f"Book {i}" for i in range(1, 7)],
+                                book_ids = np.arange(1, 7))
+
+def test_global_novelty_is_the_catalogs(catalog, experts):
+    recs = recommend_books_from_catalog(experts, catalog, novelty_factor = 0.4, rating_emphasis = 8)
+
+    assert set(recs['book_id']) == {1, 2, 4, 6}
+    rows = catalog.rows_for_ids(recs['book_id'].to_numpy())
+    np.testing.assert_array_equal(recs['novelty'].to_numpy(), catalog.novelty[rows])
+
+def test_candidate_novelty_bins_the_candidates_only(catalog, experts):
+    recs = recommend_books_from_catalog(experts, catalog, novelty_factor = 0.4, rating_emphasis = 8, novelty = "candidates")
+
+    rows = catalog.rows_for_ids(recs['book_id'].to_numpy())
+    # every candidate is recommended here (n = 50), and bins don't depend on order
+    np.testing.assert_array_equal(recs['novelty'].to_numpy(), np.abs(1 - get_bin_labels(catalog.num_ratings[rows])))
+    assert not np.array_equal(recs['novelty'].to_numpy(), catalog.novelty[rows])
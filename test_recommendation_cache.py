@@ -0,0 +1,75 @@
+""" RecommendationCache: LRU, TTL and version invalidation (python -m pytest) """
+
+import pandas as pd
+import pytest
+
+import recommendation_cache
+from recommendation_cache import RecommendationCache, recommendation_key
+
+
+class Clock:
+    """ Stands in for the time module """
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(recommendation_cache, "time", clock)
+    return clock
+
+def test_lru_evicts_least_recently_used():
+    cache = RecommendationCache(max_entries = 2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # b is now the oldest
+
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire_after_ttl(clock):
+    cache = RecommendationCache(ttl = 60)
+    cache.set('a', 1)
+
+    clock.now += 60
+    assert cache.get('a') == 1
+
+    clock.now += 1
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+    assert cache.stats()['entries'] == 0
+
+def test_new_version_drops_everything():
+    cache = RecommendationCache(version = "v1")
+    cache.set('a', 1)
+
+    assert not cache.invalidate("v1")
+    assert cache.get('a') == 1
+
+    assert cache.invalidate("v2")
+    assert cache.get('a') is None
+    assert cache.stats()['version'] == "v2"
+
+def test_get_or_compute_computes_once():
+    cache = RecommendationCache()
+    calls = []
+    compute = lambda x: calls.append(x) or x * 2
+
+    assert cache.get_or_compute('a', compute, 21) == 42
+    assert cache.get_or_compute('a', compute, 21) == 42
+    assert calls == [21]
+
+def test_key_quantizes_slider_values():
+    genres = ['Fantasy', 'Horror', 'Romance']
+    a = pd.DataFrame({'me': [0.301, 0.2, 0.499]}, index = genres)
+    b = pd.DataFrame({'me': [0.3, 0.2, 0.5]}, index = genres)
+
+    assert recommendation_key(a, 0.4, 8, genres = genres) == recommendation_key(b, 0.4, 8, genres = genres)
+    assert recommendation_key(a, 0.4, 8, genres = genres) != recommendation_key(a, 0.5, 8, genres = genres)
@@ -0,0 +1,29 @@
+""" bs4 / lxml parity on the saved review list page (python -m pytest) """
+
+import os
+
+import pytest
+
+from review_card_parser import parse_review_cards_bs4, parse_review_cards_lxml
+
+
+fixture_path = os.path.join(os.path.dirname(__file__), "fixtures", "review_list_page.html")
+user_id = "155041466-jamie-ren"
+
+
+@pytest.fixture(scope = "module")
+def source():
+    with open(fixture_path, encoding = "utf-8") as f:
+        return f.read()
+
+def test_engines_give_identical_dicts(source):
+    bs4_reviews = parse_review_cards_bs4(source, user_id)
+    lxml_reviews = parse_review_cards_lxml(source, user_id)
+
+    assert len(bs4_reviews) > 0
+    assert lxml_reviews == bs4_reviews
+
+def test_review_dicts(source):
+    for review in parse_review_cards_lxml(source, user_id):
+        assert set(review) == {'user_id', 'title_id', 'title', 'rating', 'votes'}
+        assert review['user_id'] == user_id
@@ -0,0 +1,82 @@
+""" AsyncSingleFlight: coalescing, shared errors and cancellation (python -m pytest) """
+
+import asyncio
+
+import pytest
+
+from single_flight import AsyncSingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key.upper()
+
+    async def main():
+        flight = AsyncSingleFlight()
+        results = await asyncio.gather(*(flight.do("a", fetch, "a") for _ in range(5)))
+        return flight, results
+
+    flight, results = asyncio.run(main())
+    assert results == ["A"] * 5
+    assert calls == ["a"]
+    assert flight.coalesced == 4
+    assert flight.calls == {}
+
+def test_waiters_get_the_leaders_error():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("no page")
+
+    async def main():
+        flight = AsyncSingleFlight()
+        return await asyncio.gather(flight.do("a", fail), flight.do("a", fail), return_exceptions = True)
+
+    results = asyncio.run(main())
+    assert [type(r) for r in results] == [ValueError, ValueError]
+
+def test_cancelled_leader_makes_the_waiter_retry():
+    calls = []
+
+    async def fetch():
+        calls.append(len(calls))
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main():
+        flight = AsyncSingleFlight()
+        leader = asyncio.create_task(flight.do("a", fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do("a", fetch))
+        await asyncio.sleep(0.01)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    # the waiter ran the call again instead of failing with CancelledError
+    assert asyncio.run(main()) == 2
+    assert calls == [0, 1]
+
+def test_cancelled_waiter_does_not_cancel_the_call():
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        flight = AsyncSingleFlight()
+        leader = asyncio.create_task(flight.do("a", fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do("a", fetch))
+        await asyncio.sleep(0.01)
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert asyncio.run(main()) == "done"
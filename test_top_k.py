@@ -0,0 +1,35 @@
+""" top_k against a full stable sort (python -m pytest) """
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from top_k import top_k_indices, top_k_rows
+
+
+def stable_order(values, ascending = False):
+    keys = np.asarray(values, dtype = np.float64)
+    return np.argsort(keys if ascending else -keys, kind = 'stable')
+
+@pytest.mark.parametrize("k", [0, 1, 5, 37, 100, 1000, None])
+@pytest.mark.parametrize("ascending", [False, True])
+def test_ties_match_a_stable_argsort(k, ascending):
+    # rounded scores: lots of ties, also at the cut-off
+    values = np.random.default_rng(0).integers(0, 20, 500).astype(np.float64)
+
+    expected = stable_order(values, ascending)[:k]
+    np.testing.assert_array_equal(top_k_indices(values, k, ascending = ascending), expected)
+
+def test_nan_goes_last():
+    values = np.array([np.nan, 3.0, np.nan, 1.0, 3.0])
+
+    np.testing.assert_array_equal(top_k_indices(values, 2), [1, 4])
+    np.testing.assert_array_equal(top_k_indices(values, 4), [1, 4, 3, 0])
+
+def test_rows_match_sort_values_head():
+    df = pd.DataFrame({
+        'score': np.random.default_rng(1).integers(0, 10, 200) / 10
+    }, index = [f"{i}-user" for i in range(200)])
+
+    expected = df.sort_values(by = 'score', ascending = False, kind = 'stable').head(20)
+    pd.testing.assert_frame_equal(top_k_rows(df, 'score', 20), expected)
@@ -0,0 +1,86 @@
+""" SharedReviewCache: byte budget, TTL and the SQLite tier (python -m pytest) """
+
+import pandas as pd
+import pytest
+
+import user_review_cache_class
+from user_review_cache_class import SharedReviewCache
+
+
+class Clock:
+    """ Stands in for the time module """
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(user_review_cache_class, "time", clock)
+    return clock
+
+def reviews(n, user_id = "1-user"):
+    return pd.DataFrame({
+        'user_id': [user_id] * n,
+        'title': [f"Book {i}" for i in range(n)],
+        'rating': [i % 5 + 1 for i in range(n)]
+    })
+
+def nbytes(df):
+    return int(df.memory_usage(deep = True).sum())
+
+def test_memory_stays_within_byte_budget():
+    frames = {f"{i}-user": reviews(50, f"{i}-user") for i in range(4)}
+    cache = SharedReviewCache(max_bytes = 2 * nbytes(frames["0-user"]) + 100)
+
+    for key, df in frames.items():
+        cache.set(key, df)
+        assert cache.nbytes <= cache.max_bytes
+
+    # the two least recently set ones were evicted
+    assert cache.get("0-user") is None
+    assert cache.get("1-user") is None
+    assert cache.get("3-user") is frames["3-user"]
+    assert cache.stats()['evictions'] == 2
+    assert cache.nbytes == sum(nbytes(frames[key]) for key in ["2-user", "3-user"])
+
+def test_frame_over_budget_is_not_kept_in_memory():
+    cache = SharedReviewCache(max_bytes = 100)
+    cache.set("1-user", reviews(50))
+
+    assert cache.get("1-user") is None
+    assert cache.nbytes == 0
+
+def test_entries_expire_after_ttl(clock):
+    cache = SharedReviewCache(ttl = 60)
+    cache.set("1-user", reviews(5))
+
+    clock.now += 61
+    assert cache.get("1-user") is None
+    assert cache.stats()['expirations'] == 1
+    assert cache.nbytes == 0
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    path = str(tmp_path / "reviews.sqlite")
+    df = reviews(20)
+    SharedReviewCache(disk_path = path).set("1-user", df)
+
+    cache = SharedReviewCache(disk_path = path)
+    pd.testing.assert_frame_equal(cache.get("1-user"), df)
+    assert cache.stats()['disk_hits'] == 1
+
+    # promoted into memory
+    cache.get("1-user")
+    assert cache.stats()['hits'] == 1
+
+def test_expired_disk_entries_are_deleted(tmp_path, clock):
+    path = str(tmp_path / "reviews.sqlite")
+    SharedReviewCache(ttl = 60, disk_path = path).set("1-user", reviews(5))
+
+    clock.now += 61
+    cache = SharedReviewCache(ttl = 60, disk_path = path)
+    assert cache.get("1-user") is None
+    assert cache.db.execute("SELECT COUNT(*) FROM reviews").fetchone()[0] == 0
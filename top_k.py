@@ -0,0 +1,38 @@
+""" Top-k selection without sorting everything
+
+The rankers and post-processing only ever use the best ~100 users and ~50
+books, so instead of sorting every candidate they partition around the
+k-th value (np.partition, O(n)) and sort just those k.
+
+Ties are stable: equal values keep their original order, and at the
+cut-off the earliest ones are kept. NaN goes last (as in sort_values).
+"""
+
+import numpy as np
+
+
+def top_k_indices(values, k = None, ascending = False):
+    """ Positions of the k best values, best first (all of them if k is None) """
+    values = np.asarray(values, dtype = np.float64)
+    keys = values if ascending else -values
+    n = len(keys)
+
+    if k is None or k >= n:
+        return np.argsort(keys, kind = 'stable')
+    if k <= 0:
+        return np.array([], dtype = np.int64)
+
+    kth = np.partition(keys, k - 1)[k - 1]
+    if np.isnan(kth):
+        # fewer than k non-NaN values: everything but some NaNs
+        return np.argsort(keys, kind = 'stable')[:k]
+
+    # everything at least as good as the k-th value (> k rows if it is tied)
+    candidates = np.flatnonzero(keys <= kth)
+    order = np.argsort(keys[candidates], kind = 'stable')[:k]
+
+    return candidates[order]
+
+def top_k_rows(df, by, k = None, ascending = False):
+    """ df.sort_values(by, ascending, kind = 'stable').head(k) for one column """
+    return df.iloc[top_k_indices(df[by].to_numpy(), k, ascending = ascending)]
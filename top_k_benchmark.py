@@ -0,0 +1,170 @@
+""" Full sort vs top-k selection in the rankers of a request
+
+    python top_k_benchmark.py                  1x, 10x, 100x the current data
+    python top_k_benchmark.py --scales 1 10    only some scales
+
+Times the real ranker functions, called the way a request calls them, on
+synthetic_data.py inputs (scale 1 is the size of the current data/ files):
+
+    similarity ranker    main_genre_book_recommender.get_user_similarities_ranker_by_genre
+                         (the fallback without a GenreSimilarityIndex), top 100 neighbors
+    genre ranker         genre_book_recommender.get_genre_ranker, top 100 reviewers
+    expert book scores   main_genre_book_recommender.get_book_scores_from_experts for
+                         the top 100 neighbors, top 50 books (post_process_books)
+
+    sort   the implementations before top_k (below, copied as they were):
+           sort_values over every candidate, then .head(k)
+    top_k  the current functions (top_k.top_k_rows)
+
+Both must give the same top k scores (the order of tied rows may differ:
+the old sorts were not stable).
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from synthetic_data import generate
+from top_k import top_k_rows
+from main_genre_book_recommender import (get_score, min_max_scale, get_user_similarities_ranker_by_genre,
+                                         get_expert_user_item_matrix, get_book_scores_from_experts)
+from genre_book_recommender import get_genre_ranker
+from sparse_user_item_matrix import SparseUserItemMatrix
+
+
+# sizes of the current data/ files
+base_users = 9466
+base_books = 16083
+
+# what a request keeps
+num_reviewers = 100
+num_books = 50
+
+
+""" The implementations before top_k """
+
+def old_get_user_similarities_ranker_by_genre(this_user_genre_pct, user_genre_counts, other_users_genre_pct, alpha, min_similarity):
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    M = other_users_genre_pct.values
+    v = this_user_genre_pct.values
+    similarities = cosine_similarity(M.T, v.T).ravel()
+    other_users = other_users_genre_pct.T.index
+    similarity_ranker = pd.DataFrame({'other_users': other_users, 'genre_similarity': similarities})
+
+    similarity_ranker = similarity_ranker.set_index("other_users")
+    similarity_ranker['read_count'] = user_genre_counts.sum(axis = 0)
+    similarity_ranker = similarity_ranker[similarity_ranker.genre_similarity >= min_similarity]
+    similarity_ranker['score'] = get_score(similarity_ranker['read_count'], similarity_ranker['genre_similarity'], alpha = alpha)
+    similarity_ranker = similarity_ranker.sort_values(by = 'score', ascending = False)
+
+    return similarity_ranker
+
+def old_user_read_counts_for_genre(my_genre, user_genre_counts, user_genre_pct):
+    genre_review_count_ranked = user_genre_counts.loc[my_genre, :].sort_values(ascending = False)
+    genre_pct_of_reviews_ranked = user_genre_pct.loc[my_genre, :].sort_values(ascending = False)
+
+    res = pd.DataFrame({"review_count": genre_review_count_ranked, "review_pct": genre_pct_of_reviews_ranked})
+    return res
+
+def old_get_genre_ranker(my_genre, user_genre_counts, user_genre_pct, alpha = 1, allowed = None):
+    user_read_counts = old_user_read_counts_for_genre(my_genre, user_genre_counts, user_genre_pct)
+    user_read_counts['score'] = get_score(user_read_counts['review_count'], user_read_counts['review_pct'], alpha = alpha)
+
+    user_read_counts = user_read_counts[user_read_counts.review_count > 0]
+    user_read_counts = user_read_counts.sort_values(by = 'score', ascending = False)
+
+    user_read_counts = user_read_counts[user_read_counts.index.isin(allowed)]
+
+    return user_read_counts
+
+def old_get_book_scores_from_experts(user_item_matrix, rating_emphasis):
+    if isinstance(user_item_matrix, pd.DataFrame):
+        user_item_matrix = SparseUserItemMatrix.from_dataframe(user_item_matrix)
+
+    book_stats = user_item_matrix.book_rating_stats()
+    book_stats['score'] = get_score(book_stats['count'], book_stats['rating'], alpha = rating_emphasis)
+    book_stats['score'] = min_max_scale(book_stats['score']).round(1)
+    book_stats = book_stats.sort_values(by="score", ascending=False)
+    book_stats = book_stats[['score', 'rating', "count"]]
+
+    return book_stats
+
+
+""" Steps: setup(data) -> (candidates, old, new), old and new returning the top k rows """
+
+def query_profile(data, user = 0):
+    """ A real user's genre profile (so the query has neighbors) """
+    return data['compact_user_genre_pct'].iloc[:, [user]]
+
+def similarity_ranker(data):
+    q = query_profile(data)
+    args = (q, data['user_genre_counts'], data['compact_user_genre_pct'])
+    old = lambda: old_get_user_similarities_ranker_by_genre(*args, alpha = 250, min_similarity = 0.8).head(num_reviewers)
+    new = lambda: get_user_similarities_ranker_by_genre(*args, alpha = 250, min_similarity = 0.8, k = num_reviewers)
+    return data['compact_user_genre_pct'].shape[1], old, new
+
+def genre_ranker(data):
+    counts = data['user_genre_counts']
+    genre = counts.sum(axis = 1).idxmax()
+    allowed = counts.columns
+    args = (genre, counts, data['user_genre_pct'])
+    old = lambda: old_get_genre_ranker(*args, alpha = 1, allowed = allowed).head(num_reviewers)
+    new = lambda: get_genre_ranker(*args, alpha = 1, allowed = allowed, k = num_reviewers)
+    return len(allowed), old, new
+
+def expert_book_scores(data):
+    neighbors = get_user_similarities_ranker_by_genre(query_profile(data), data['user_genre_counts'], data['compact_user_genre_pct'],
+                                                      alpha = 250, min_similarity = 0.8, k = num_reviewers)
+    experts = get_expert_user_item_matrix(data['user_item_matrix'], neighbors.index)
+
+    # get_recommendation_from_top: sorted scores (old) / unsorted, top n picked in post_process_books (new)
+    old = lambda: old_get_book_scores_from_experts(experts, 8).head(num_books)
+    new = lambda: top_k_rows(get_book_scores_from_experts(experts, 8, sort = False), 'score', num_books)
+    return len(get_book_scores_from_experts(experts, 8, sort = False)), old, new
+
+steps = {
+    'similarity ranker': similarity_ranker,
+    'genre ranker': genre_ranker,
+    'expert book scores': expert_book_scores
+}
+
+
+def best_ms(fn, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        ms = (time.perf_counter() - start) * 1000
+        best = ms if best is None else min(best, ms)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Full sort vs top-k selection in the rankers")
+    parser.add_argument("--scales", type = int, nargs = "+", default = [1, 10, 100])
+    parser.add_argument("--repeats", type = int, default = 5)
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    print(f"{'step':<20} {'scale':>5} {'rows':>10} {'sort ms':>9} {'top_k ms':>9} {'speedup':>8}")
+    for scale in args.scales:
+        data = generate(base_users * scale, base_books * scale, seed = args.seed, review_pages = 0)
+
+        for name, setup in steps.items():
+            rows, old, new = setup(data)
+
+            old_top, new_top = old(), new()
+            if not np.array_equal(old_top['score'].to_numpy(), new_top['score'].to_numpy()):
+                raise AssertionError(f"{name}: top {len(new_top)} scores differ from the old implementation")
+
+            sort_ms = best_ms(old, args.repeats)
+            top_k_ms = best_ms(new, args.repeats)
+
+            print(f"{name:<20} {scale:>4}x {rows:>10} {sort_ms:>9.2f} {top_k_ms:>9.2f} {sort_ms / top_k_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,11 @@
+import io
+import sqlite3
+import threading
+import time
 from collections import OrderedDict
 
+import pandas as pd
+
 
 # --- Simple LRU Cache ---
 class UserReviewCache:
@@ -18,4 +24,121 @@ class UserReviewCache:
             self.cache.move_to_end(key)
         elif len(self.cache) >= self.maxsize:
             self.cache.popitem(last=False)
-        self.cache[key] = value
\ No newline at end of file
+        self.cache[key] = value
+
+
+# --- Shared cache (all sessions in the process) ---
+class SharedReviewCache:
+    """ Review frames by user id, shared across sessions
+
+    - memory tier bounded by bytes (DataFrame.memory_usage), LRU eviction
+    - entries older than ttl seconds are treated as missing
+    - optional SQLite tier (parquet bytes per user) that survives restarts;
+      disk hits are promoted back into memory
+    """
+
+    def __init__(self, max_bytes = 64 * 1024 ** 2, ttl = 24 * 3600, disk_path = None):
+        self.cache = OrderedDict()  # key -> (value, nbytes, stored_at)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.lock = threading.RLock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self.db = None
+        if disk_path:
+            self.db = sqlite3.connect(disk_path, check_same_thread = False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS reviews (key TEXT PRIMARY KEY, stored_at REAL, data BLOB)")
+            self.db.commit()
+
+    def expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def get(self, key):
+        with self.lock:
+            expired_in_memory = False
+            if key in self.cache:
+                value, nbytes, stored_at = self.cache[key]
+                if not self.expired(stored_at):
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                self.remove(key)
+                self.expirations += 1
+                expired_in_memory = True
+
+            value = self.get_from_disk(key, count_expiration = not expired_in_memory)
+            if value is not None:
+                self.disk_hits += 1
+                return value
+
+            self.misses += 1
+            return None
+
+    def get_from_disk(self, key, count_expiration = True):
+        if self.db is None:
+            return None
+
+        row = self.db.execute("SELECT stored_at, data FROM reviews WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        stored_at, data = row
+        if self.expired(stored_at):
+            self.db.execute("DELETE FROM reviews WHERE key = ?", (key,))
+            self.db.commit()
+            self.expirations += count_expiration
+            return None
+
+        value = pd.read_parquet(io.BytesIO(data))
+        self.set_in_memory(key, value, stored_at)
+        return value
+
+    def set(self, key, value):
+        stored_at = time.time()
+        with self.lock:
+            self.set_in_memory(key, value, stored_at)
+
+            if self.db is not None:
+                buffer = io.BytesIO()
+                value.to_parquet(buffer)
+                self.db.execute("INSERT OR REPLACE INTO reviews VALUES (?, ?, ?)", (key, stored_at, buffer.getvalue()))
+                self.db.commit()
+
+    def set_in_memory(self, key, value, stored_at):
+        if key in self.cache:
+            self.remove(key)
+
+        nbytes = int(value.memory_usage(deep = True).sum())
+        if nbytes > self.max_bytes:
+            return
+
+        while self.nbytes + nbytes > self.max_bytes:
+            _, (_, evicted_bytes, _) = self.cache.popitem(last = False)
+            self.nbytes -= evicted_bytes
+            self.evictions += 1
+
+        self.cache[key] = (value, nbytes, stored_at)
+        self.nbytes += nbytes
+
+    def remove(self, key):
+        _, nbytes, _ = self.cache.pop(key)
+        self.nbytes -= nbytes
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.cache),
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }